@@ -1,49 +1,127 @@
-from typing import Optional
+from typing import Callable, Optional
+import concurrent.futures
+import functools
+import json
+import os
 import time
 from loguru import logger
-from katalyst_core.algorithms.cad_generation.utils import init_client
-from katalyst_core.programs.executor import execute_first_time
-
-from katalyst_core.programs.storage import program_script_path, program_stl_path
+from openai import OpenAI
+from katalyst_core.algorithms.cad_generation.retry_context import (
+    most_relevant_example,
+)
+from katalyst_core.algorithms.cad_generation.utils import (
+    count_messages_tokens,
+    init_client,
+)
+from katalyst_core.programs.executor import execute_first_time, execute_with_params
+from katalyst_core.programs.geometry import geometry_score, stl_metrics
+from katalyst_core.programs.minimizer import minimize_failure
+
+from katalyst_core.tracing import in_context, span, traced
+from katalyst_core.programs.storage import (
+    program_delete,
+    program_params_path,
+    program_script_path,
+    program_stl_path,
+)
+from katalyst_core.programs.errors import error_signature
 from katalyst_core.programs.executor import preamble
 
+from katalyst_core.algorithms.cad_generation.edits import (
+    EDITS_FORMAT_INSTRUCTIONS,
+    apply_edits,
+    parse_edits,
+)
+from katalyst_core.algorithms.cad_generation.error_kb import (
+    known_tips,
+    record_fix,
+    record_llm_fix,
+    try_local_fixes,
+)
 from katalyst_core.algorithms.cad_generation.examples_ragging import (
     generate_examples_for_iteration_prompt,
+    highest_similarity_for_prompt,
+)
+from katalyst_core.algorithms.cad_generation.ledger import (
+    Budget,
+    SessionLedger,
+    budget_exceeded,
+    recording,
+)
+from katalyst_core.algorithms.cad_generation.routing import (
+    Route,
+    choose_route,
+    read_routing_stats,
+    record_route_outcome,
 )
 from katalyst_core.algorithms.cad_generation.constants import (
+    CANDIDATE_TEMPERATURES,
+    MINIMIZER_MAX_ATTEMPTS,
     MODEL,
     MODEL_FAST,
 )
 
 
+def _recording_usage(method: Callable) -> Callable:
+    """Record the LLM calls of an agent method in the agent's ledger."""
+
+    @functools.wraps(method)
+    def wrapper(self: "Agent", *args, **kwargs):
+        with recording(self.ledger):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class Agent:
     initial_prompt: str
     last_program_id: Optional[str]
     initial_precision: int
+    ledger: SessionLedger
 
     def __init__(
         self,
         initial_prompt: str,
         last_program_id: Optional[str],
         initial_precision: int,
+        ledger: Optional[SessionLedger] = None,
     ):
         self.initial_prompt = initial_prompt
         self.last_program_id = last_program_id
         self.initial_precision = initial_precision
+        self.ledger = ledger if ledger is not None else SessionLedger()
 
     @staticmethod
-    def initialize(initial_prompt: str) -> "Agent":
-        return Agent(initial_prompt, None, 0)
-
+    def initialize(initial_prompt: str, budget: Optional[Budget] = None) -> "Agent":
+        """
+        Once the session's `budget` is used up, generations stop escalating:
+        no more refinements, candidates or fix retries.
+        """
+        ledger = SessionLedger(budget=budget if budget is not None else Budget())
+        return Agent(initial_prompt, None, 0, ledger)
+
+    @traced("agent.initial", failed=lambda program_id: program_id is None)
+    @_recording_usage
     def generate_initial(
-        self, precision: int, llm_api_key: Optional[str] = None
+        self,
+        precision: int,
+        llm_api_key: Optional[str] = None,
+        candidates: int = 1,
+        critique_top: int = 0,
     ) -> Optional[str]:
+        """
+        With `candidates` > 1, that many generations run concurrently and the best
+        result is kept, see `_generate_best_of`.
+        """
         random_id = str(time.time())
 
         logger.trace(
             f"[{random_id}] Generating initial solution for: {self.initial_prompt}"
         )
 
+        if budget_exceeded():
+            precision, candidates = 0, 1
+
         examples = generate_examples_for_iteration_prompt(
             self.initial_prompt, assemblies=False, top_n=10
         )
@@ -60,21 +138,33 @@ class Agent:
 Taking inspiration from the up to date syntax in the examples, code a very realistic parametric CAD model using cadquery from the above prompt
 """
 
-        main_model = MODEL
-        depth = precision - 1
-        if precision == 0:
-            main_model = MODEL_FAST
-            depth = 0
-
-        program_id, success = generate_cad(
-            examples,
-            prompt,
-            depth,
-            main_model,
-            second_model=MODEL_FAST,
-            llm_api_key=llm_api_key,
+        route = choose_route(
+            self.initial_prompt,
+            precision,
+            highest_similarity_for_prompt(self.initial_prompt),
+            read_routing_stats(),
+        )
+        logger.info(
+            f"[{random_id}] Routing to {route.name} ({route.model}, depth {route.depth}): {route.reason}"
         )
 
+        start = time.time()
+        if candidates <= 1:
+            program_id, success = generate_cad(
+                examples,
+                prompt,
+                route.depth,
+                route.model,
+                second_model=MODEL_FAST,
+                llm_api_key=llm_api_key,
+            )
+        else:
+            program_id = self._generate_best_of(
+                candidates, critique_top, examples, prompt, route, llm_api_key
+            )
+            success = program_id is not None
+        record_route_outcome(route, success, time.time() - start)
+
         if not success:
             return None
 
@@ -84,18 +174,107 @@ Taking inspiration from the up to date syntax in the examples, code a very reali
 
         return program_id
 
+    def _generate_best_of(
+        self,
+        candidates: int,
+        critique_top: int,
+        examples: str,
+        prompt: str,
+        route: Route,
+        llm_api_key: Optional[str],
+    ) -> Optional[str]:
+        """
+        Run concurrent generations at different temperatures, then rank the
+        successful ones by local geometry metrics, and optionally re-rank the
+        `critique_top` best ones by a vision critique.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=candidates) as executor:
+            futures = [
+                executor.submit(
+                    in_context(generate_cad),
+                    examples,
+                    prompt,
+                    route.depth,
+                    route.model,
+                    second_model=MODEL_FAST,
+                    llm_api_key=llm_api_key,
+                    temperature=CANDIDATE_TEMPERATURES[i % len(CANDIDATE_TEMPERATURES)],
+                )
+                for i in range(candidates)
+            ]
+
+            program_ids = []
+            for future in futures:
+                try:
+                    program_id, success = future.result()
+                except Exception as e:
+                    logger.warning(f"Candidate generation failed: {e}")
+                    continue
+                if success and program_id is not None:
+                    program_ids.append(program_id)
+
+            if not program_ids:
+                return None
+
+            scores = {}
+            for program_id in program_ids:
+                with open(program_params_path(program_id), "r") as f:
+                    parameters_count = len(json.load(f))
+                scores[program_id] = geometry_score(
+                    stl_metrics(program_stl_path(program_id)), parameters_count
+                )
+            ranked = sorted(program_ids, key=lambda p: scores[p], reverse=True)
+
+            finalists = ranked[:critique_top]
+            if len(finalists) > 1:
+                # the docs pipeline is heavy to import, only load it when needed
+                from katalyst_core.algorithms.docs_to_desc.stl_visual_desc import (
+                    compare_stl_to_prompt,
+                )
+
+                critiques = executor.map(
+                    in_context(
+                        lambda p: compare_stl_to_prompt(
+                            program_stl_path(p), self.initial_prompt, MODEL, llm_api_key
+                        )
+                    ),
+                    finalists,
+                )
+                ratings = {
+                    p: critique[1] if critique is not None else -1
+                    for p, critique in zip(finalists, critiques)
+                }
+                finalists.sort(key=lambda p: ratings[p], reverse=True)
+                ranked = finalists + ranked[len(finalists) :]
+
+        logger.info(
+            f"Best of {candidates}: {len(program_ids)} succeeded, scores "
+            + ", ".join(f"{p}: {scores[p]:.2f}" for p in ranked)
+        )
+
+        for program_id in ranked[1:]:
+            program_delete(program_id)
+        return ranked[0]
+
+    @traced("agent.iteration", failed=lambda program_id: program_id is None)
+    @_recording_usage
     def generate_iteration(
         self, iteration: str, llm_api_key: Optional[str] = None
     ) -> Optional[str]:
         assert self.last_program_id is not None
 
+        program_id = self._generate_parameters_iteration(iteration, llm_api_key)
+        if program_id is not None:
+            self.last_program_id = program_id
+            return program_id
+
         examples_prompt = generate_examples_for_iteration_prompt(
             self.initial_prompt, top_n=6
         )
 
         previous_code = ""
         with open(program_script_path(self.last_program_id), "r") as f:
-            previous_code = f.read()
+            previous_code = f.read().removeprefix(preamble)
 
         prompt = f"""
 Answering to the prompt:
@@ -117,15 +296,43 @@ Now you are asked with doing the following change:
 Please EDIT the above code (don't just take inspiration) to add the requested change. Really just use it entirely and then edit.
 """
 
-        program_id, success = generate_cad(
+        # the code being fixed already replaces the previous one in retries
+        task = f"""
+Answering to the prompt:
+
+{self.initial_prompt}
+
+You are modeling the following change:
+
+<request>
+{iteration}
+</request>
+"""
+
+        edited = edit_cad(
             examples_prompt,
             prompt,
-            depth=0,
+            previous_code,
             main_model=MODEL,
             second_model=MODEL_FAST,
             llm_api_key=llm_api_key,
+            task=task,
         )
 
+        if edited is not None:
+            program_id, success = edited
+        else:
+            # the edits didn't apply, have the whole code written again
+            program_id, success = generate_cad(
+                examples_prompt,
+                prompt,
+                depth=0,
+                main_model=MODEL,
+                second_model=MODEL_FAST,
+                llm_api_key=llm_api_key,
+                task=task,
+            )
+
         if not success:
             return None
 
@@ -133,11 +340,89 @@ Please EDIT the above code (don't just take inspiration) to add the requested ch
 
         return program_id
 
+    @traced("parameters_iteration", failed=lambda program_id: program_id is None)
+    def _generate_parameters_iteration(
+        self, iteration: str, llm_api_key: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Fast path for requests that only change parameter values: the fast model
+        only sees the parameters and the request, no code is regenerated.
+        """
+        params_path = program_params_path(self.last_program_id)
+        if not os.path.exists(params_path):
+            return None
+        with open(params_path, "r") as f:
+            params = json.load(f)
+        if not params:
+            return None
+
+        client = init_client(llm_api_key)
+
+        messages = [
+            {
+                "role": "user",
+                "content": f"""
+Here are the parameters of a parametric CAD model:
+
+<parameters>
+{json.dumps(params, indent=4)}
+</parameters>
+
+The user asks for the following change:
+
+<request>
+{iteration}
+</request>
+
+If the change can be made ONLY by changing the values of the above parameters, answer with a JSON object of the parameters to change and their new values (as Python expressions, strings are fine), wrapped in <parameters> </parameters> tags, like in:
+
+<parameters>
+{{"height": "40"}}
+</parameters>
+
+Otherwise, if the change requires editing the code itself, answer with:
+
+<parameters>
+{{}}
+</parameters>
+""",
+            }
+        ]
+
+        try:
+            response = client.chat.completions.create(
+                model=MODEL_FAST, messages=messages, temperature=0.1, timeout=20
+            )
+            content = response.choices[0].message.content
+            logger.trace("Parameters response: {}", content)
+            changes = json.loads(
+                content.split("<parameters>", 1)[1].split("</parameters>", 1)[0]
+            )
+        except Exception as e:
+            logger.info(f"Parameters fast path failed: {e}")
+            return None
+
+        if not isinstance(changes, dict) or not changes:
+            return None
+        if not set(changes.keys()) <= set(params.keys()):
+            logger.info(f"Parameters fast path proposed unknown parameters: {changes}")
+            return None
+
+        new_params = {**params, **{k: str(v) for k, v in changes.items()}}
+        program_id, _, success = execute_with_params(self.last_program_id, new_params)
+
+        if not success:
+            return None
+
+        logger.info(f"Iteration done by changing parameters: {changes}")
+        return program_id
+
     def to_dict(self) -> dict:
         return {
             "initial_prompt": self.initial_prompt,
             "last_program_id": self.last_program_id,
             "initial_precision": self.initial_precision,
+            "ledger": self.ledger.to_dict(),
         }
 
     @staticmethod
@@ -146,9 +431,11 @@ Please EDIT the above code (don't just take inspiration) to add the requested ch
             d["initial_prompt"],
             d["last_program_id"],
             d.get("initial_precision", 0),
+            SessionLedger.from_dict(d.get("ledger", {})),
         )
 
 
+@traced("generate_cad", failed=lambda result: not result[1])
 def generate_cad(
     examples: str,
     prompt: str,
@@ -156,52 +443,18 @@ def generate_cad(
     main_model: str = MODEL,
     second_model: str = MODEL_FAST,
     llm_api_key: Optional[str] = None,
+    task: Optional[str] = None,
+    temperature: float = 0.4,
 ) -> tuple[Optional[str], bool]:
+    """
+    `task` is a condensed version of `prompt` used for fix retries, defaults to `prompt`.
+    """
     client = init_client(llm_api_key)
 
-    messages = [
-        {
-            "role": "user",
-            "content": f"""
-Examples:
-
-{examples}
-
-{prompt}
-
-No imports can be included by you, do not write any. The following imports will be added to your code automatically:
-
-<code>
-{preamble}
-</code>
-
-First reason spatially and geometrically and then write the entire code in one text block wrapped around <code> </code> tags, without using markdown ``` and make sure the parameters are written with one `<variable> = <expression or literal>` per line (avoid dict, avoid list, avoid tuple, except if short and on one line).
-Make also sure parameters are between the imports and the first modeling line and delimited by <parameters> </parameters> tags like in:
-
-<code>
-...
-# <parameters>
-radius = 10
-height = 20
-# </parameters>
-...
-</code>
-
-Make also sure you export to stl in the end:
-
-<code>
-...
-filename = "render.stl"
-result.val().exportStl(filename) # if result is a Workplane, you must call val() before exportStl
-</code>
-
-Now think and code it:
-""",
-        }
-    ]
+    messages = _generation_messages(examples, prompt)
 
     response = client.chat.completions.create(
-        model=main_model, messages=messages, temperature=0.4, timeout=40
+        model=main_model, messages=messages, temperature=temperature, timeout=40
     )
 
     logger.trace(messages[0]["content"])
@@ -228,8 +481,16 @@ Now think and code it:
         except Exception as _:
             code = None
 
+    # each draft is executed in the background while the next one is generated,
+    # the latest one that works is the fallback if the final code fails
+    draft_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    drafts: list[concurrent.futures.Future] = []
+
     d = 0
-    while d < depth:
+    while d < depth and not budget_exceeded():
+        if code is not None:
+            drafts.append(draft_executor.submit(in_context(execute_first_time), code))
+
         messages_improve = [
             {
                 "role": "assistant",
@@ -274,7 +535,10 @@ result.val().exportStl(filename) # if result is a Workplane, you must call val()
         ]
 
         response = client.chat.completions.create(
-            model=main_model, messages=messages_improve, temperature=0.4, timeout=40
+            model=main_model,
+            messages=messages_improve,
+            temperature=temperature,
+            timeout=40,
         )
 
         try:
@@ -349,15 +613,220 @@ result.val().exportStl(filename) # if result is a Workplane, you must call val()
     )
     program_id, output, success = execute_first_time(code)
 
+    if not success:
+        program_id = _latest_successful_draft(drafts)
+        success = program_id is not None
+
+    draft_executor.shutdown(wait=False, cancel_futures=True)
+    _discard_drafts(drafts, keep=program_id)
+
+    if not success:
+        program_id, success = _fix_until_success(
+            client,
+            messages,
+            examples,
+            task if task is not None else prompt,
+            code,
+            output,
+            second_model,
+        )
+
+    return program_id, success
+
+
+def _latest_successful_draft(
+    drafts: list[concurrent.futures.Future],
+) -> Optional[str]:
+    for i, draft in reversed(list(enumerate(drafts))):
+        if draft.cancelled() or draft.exception() is not None:
+            continue
+        program_id, _, success = draft.result()
+        if success:
+            logger.info(f"Final code failed, falling back to draft {i} ({program_id})")
+            return program_id
+    return None
+
+
+def _discard_drafts(drafts: list[concurrent.futures.Future], keep: Optional[str]):
+    """Delete the programs of successful drafts that aren't used, once they finish."""
+
+    def discard(draft: concurrent.futures.Future):
+        if draft.cancelled() or draft.exception() is not None:
+            return
+        program_id, _, success = draft.result()
+        if success and program_id != keep:
+            program_delete(program_id)
+
+    for draft in drafts:
+        draft.add_done_callback(discard)
+
+
+@traced("edit_cad", failed=lambda result: result is None or not result[1])
+def edit_cad(
+    examples: str,
+    prompt: str,
+    previous_code: str,
+    main_model: str = MODEL,
+    second_model: str = MODEL_FAST,
+    llm_api_key: Optional[str] = None,
+    task: Optional[str] = None,
+) -> Optional[tuple[Optional[str], bool]]:
+    """
+    Like `generate_cad`, but the model only answers with search/replace edits of
+    `previous_code`, which is much faster than having it write the entire code again.
+
+    Returns None if the edits couldn't be applied.
+    """
+    client = init_client(llm_api_key)
+
+    edit_messages = [
+        {
+            "role": "user",
+            "content": f"""
+Examples:
+
+{examples}
+
+{prompt}
+
+No imports can be included by you, do not write any. The following imports will be added to your code automatically:
+
+<code>
+{preamble}
+</code>
+{EDITS_FORMAT_INSTRUCTIONS}""",
+        }
+    ]
+
+    try:
+        response = client.chat.completions.create(
+            model=main_model, messages=edit_messages, temperature=0.4, timeout=40
+        )
+        content = response.choices[0].message.content
+    except Exception as e:
+        logger.info(f"Edits request failed: {e}")
+        return None
+
+    logger.trace("Edits response: {}", content)
+
+    code = apply_edits(previous_code, parse_edits(content))
+    if code is None:
+        return None
+
+    program_id, output, success = execute_first_time(code)
+
+    if not success:
+        program_id, success = _fix_until_success(
+            client,
+            _generation_messages(examples, prompt),
+            examples,
+            task if task is not None else prompt,
+            code,
+            output,
+            second_model,
+        )
+
+    return program_id, success
+
+
+def _retry_messages(examples: str, task: str, feedback: str) -> list[dict]:
+    example = most_relevant_example(examples, feedback)
+    return _generation_messages(example if example is not None else "", task)
+
+
+def _generation_messages(examples: str, prompt: str) -> list[dict]:
+    examples_section = f"\nExamples:\n\n{examples}\n" if examples else ""
+    return [
+        {
+            "role": "user",
+            "content": f"""{examples_section}
+{prompt}
+
+No imports can be included by you, do not write any. The following imports will be added to your code automatically:
+
+<code>
+{preamble}
+</code>
+
+First reason spatially and geometrically and then write the entire code in one text block wrapped around <code> </code> tags, without using markdown ``` and make sure the parameters are written with one `<variable> = <expression or literal>` per line (avoid dict, avoid list, avoid tuple, except if short and on one line).
+Make also sure parameters are between the imports and the first modeling line and delimited by <parameters> </parameters> tags like in:
+
+<code>
+...
+# <parameters>
+radius = 10
+height = 20
+# </parameters>
+...
+</code>
+
+Make also sure you export to stl in the end:
+
+<code>
+...
+filename = "render.stl"
+result.val().exportStl(filename) # if result is a Workplane, you must call val() before exportStl
+</code>
+
+Now think and code it:
+""",
+        }
+    ]
+
+
+def _fix_until_success(
+    client: OpenAI,
+    messages: list[dict],
+    examples: str,
+    task: str,
+    code: str,
+    output: str,
+    second_model: str = MODEL_FAST,
+) -> tuple[Optional[str], bool]:
+    """
+    Retry loop fixing `code` from its execution feedback.
+
+    `messages` is the original generation prompt, only used to measure how many
+    tokens the compact retry context saves.
+    """
+    program_id = None
+    success = False
+    total_tokens_saved = 0
     retries = 0
-    last_output = output
+    # execution feedback ends with source context, compare the errors themselves
+    last_signature = error_signature(output)
     repeat_error = False
+    minimizer_attempts = 0
     while not success and retries < 10:
+        signature = error_signature(output)
+        local_fix = try_local_fixes(signature, code, output)
+        if local_fix is not None:
+            program_id, output, code, success = local_fix
+            break
+
+        cryptic_error = "OCP." in output or output.strip() == "" or repeat_error
+        if cryptic_error and minimizer_attempts < MINIMIZER_MAX_ATTEMPTS:
+            # try removing the failing operation locally before asking the LLM
+            minimizer_attempts += 1
+            # the failure is known, the minimizer doesn't run the script again
+            minimization = minimize_failure(code, output=output)
+            if minimization is not None:
+                logger.info(f"Fixed without LLM: {minimization.describe()}")
+                code = minimization.script
+                program_id, output = minimization.program_id, minimization.output
+                success = True
+            record_fix(signature, "minimize", success)
+            if success:
+                break
+
+        if budget_exceeded():
+            break
+
         if output.strip() == "":
             output = "No bugs, but nothing was rendered, empty object. Look if you didn't substract/cut by too much."
 
         if repeat_error:
-            messages_fix = messages.copy() + [
+            fix_turns = [
                 {
                     "role": "assistant",
                     "content": f"""
@@ -387,15 +856,8 @@ This is not the first time you get this error, this means YOU DON'T KNOW HOW TO
             if '__name__ == "__main__"' in code:
                 tips += '\n- If your code contains __name__ == "__main__", DO NOT USE A main function or a __name__ == thing. Your export MUST BE at the end of the code, without indentation, so not inside a function.'
                 tips += 'To export: \n\n```\nfilename = "render.stl"\nresult.val().exportStl(filename)\n```'
-            if "timed out" in output:
-                tips += "\n- If the code timed out, it is likely instanciating multiple objects in a loop, remove that by simplifying the code."
-            if "No pending wires present" in output:
-                tips += "\n- If the error is `No pending wires present`, it is likely not trival: all you can do is to remove the function call causing the error and not attempt to do in any other way what you meant to do with that call."
-            if "fillet" in output or "chamfer" in output:
-                tips += '\n- If the error is regarding fillet and chamfers, make sure you selected some edges with .edges(... (e.g "|Z")) before .fillet(<radius>) or .chamfer(<radius>). Notably, you can\'t pass an edge list to .chamfer() or .fillet(), it only takes a radius. You always need to select the edges with .edges. \n```\n edges(selector: Optional[Union[str, Selector]] = None, tag: Optional[str] = None)→ T\n Select the edges of objects on the stack, optionally filtering the selection. If there are multiple objects on the stack, the edges of all objects are collected and a list of all the distinct edges is returned.\nFilters must provide a single method that filters objects: filter(objectList: Sequence[Shape])→ list[Shape]\n```'
-            if "one solid on the stack to union" in output:
-                tips += "\n- If the error is ` Workplane object must have at least one solid on the stack to union!`, make sure you don't call .union on a workplane you just selected, but instead on a workplane with an existing object within. For instance if you created object A on a workplane and object B on another workplane, don't do `result = cq.Workplane(...).union(A).union(B)` but instead `result = A.union(B)`"
-            messages_fix = messages.copy() + [
+            tips += known_tips(signature, output)
+            fix_turns = [
                 {
                     "role": "assistant",
                     "content": f"""
@@ -421,32 +883,50 @@ Tips:
                 },
             ]
 
-        response = client.chat.completions.create(
-            model=second_model, messages=messages_fix, temperature=0.4, timeout=40
-        )
+        failed_code, failed_output = code, output
 
-        logger.trace(
-            "Retry response {}: {}", retries, response.choices[0].message.content
+        # only the task, the most relevant example and the current code are resent,
+        # not the whole original prompt with all its examples
+        messages_fix = _retry_messages(examples, task, output) + fix_turns
+        tokens = count_messages_tokens(messages_fix)
+        tokens_saved = count_messages_tokens(messages + fix_turns) - tokens
+        total_tokens_saved += tokens_saved
+        logger.info(
+            f"Retry {retries} context: {tokens} tokens ({tokens_saved} saved, {total_tokens_saved} in total)"
         )
 
-        try:
-            code = (
-                response.choices[0]
-                .message.content.split("<code>", 1)[1]
-                .split("</code>", 1)[0]
-                .strip()
+        with span("fix_retry", retry=retries, signature=signature) as retry_span:
+            response = client.chat.completions.create(
+                model=second_model, messages=messages_fix, temperature=0.4, timeout=40
             )
-        except Exception as e:
-            code = (
-                response.choices[0]
-                .message.content.replace("```python", "```")
-                .split("```", 1)[1]
-                .split("```", 1)[0]
-                .strip()
+
+            logger.trace(
+                "Retry response {}: {}", retries, response.choices[0].message.content
             )
 
-        program_id, output, success = execute_first_time(code)
-        if output.strip().split("\n")[-1] == last_output.strip().split("\n")[-1]:
+            try:
+                code = (
+                    response.choices[0]
+                    .message.content.split("<code>", 1)[1]
+                    .split("</code>", 1)[0]
+                    .strip()
+                )
+            except Exception as e:
+                code = (
+                    response.choices[0]
+                    .message.content.replace("```python", "```")
+                    .split("```", 1)[1]
+                    .split("```", 1)[0]
+                    .strip()
+                )
+
+            program_id, output, success = execute_first_time(code)
+            record_llm_fix(signature, failed_code, failed_output, code, output, success)
+            if not success:
+                retry_span.outcome = "failure"
+
+        new_signature = error_signature(output)
+        if not success and new_signature == last_signature:
             logger.trace("Repeated error, retrying")
             repeat_error = True
         else:
@@ -455,6 +935,6 @@ Tips:
         if success:
             break
         retries += 1
-        last_output = output
+        last_signature = new_signature
 
     return program_id, success
@@ -1,2 +1,17 @@
 MODEL_FAST = "openai/gpt-4o-mini"
 MODEL = "anthropic/claude-3.5-sonnet:beta"
+
+# (input, output) dollars per million tokens, to estimate session costs
+MODEL_PRICES = {
+    MODEL_FAST: (0.15, 0.6),
+    MODEL: (3.0, 15.0),
+}
+
+# local minimizer runs per generation before falling back to LLM fixes only
+MINIMIZER_MAX_ATTEMPTS = 2
+
+# token budget of the retrieved examples in a generation prompt
+EXAMPLES_TOKEN_BUDGET = 6000
+
+# temperatures of the concurrent candidates of a best-of-N initial generation
+CANDIDATE_TEMPERATURES = [0.4, 0.7, 0.2, 1.0]
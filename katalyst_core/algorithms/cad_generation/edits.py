@@ -0,0 +1,156 @@
+import difflib
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from loguru import logger
+
+# minimum similarity for a fuzzy match of a search block against the code
+FUZZY_THRESHOLD = 0.85
+
+EDITS_FORMAT_INSTRUCTIONS = """
+Do NOT write the entire code again. Only answer with the edits to make to the above code, as search/replace blocks:
+
+<edit>
+<search>
+lines copied EXACTLY from the code above
+</search>
+<replace>
+the lines that replace them
+</replace>
+</edit>
+
+Rules:
+- the <search> lines must be copied exactly from the code, with enough lines to be unique, but keep them short
+- use one block per place to edit, in the order they appear in the code
+- new parameters go in the parameters block, with one `<variable> = <expression or literal>` per line: edit the block to add them
+- to delete lines, leave <replace> empty
+- no imports, and keep the stl export at the end of the code
+
+First reason briefly about the changes, then write the blocks.
+"""
+
+
+@dataclass
+class Edit:
+    search: str
+    replace: str
+
+
+def parse_edits(text: str) -> list[Edit]:
+    blocks = re.findall(
+        r"<edit>\s*<search>\n?(.*?)</search>\s*<replace>\n?(.*?)</replace>\s*</edit>",
+        text,
+        re.DOTALL,
+    )
+    return [
+        Edit(_strip_fences(search), _strip_fences(replace))
+        for search, replace in blocks
+    ]
+
+
+def apply_edits(code: str, edits: list[Edit]) -> Optional[str]:
+    """
+    Apply search/replace edits in order, or return None if any of them doesn't apply.
+
+    Search blocks are matched exactly, then ignoring indentation and blank lines,
+    then fuzzily (difflib ratio over windows of lines), always on whole lines.
+    A search block matching several places doesn't apply.
+    """
+    if not edits:
+        return None
+
+    for i, edit in enumerate(edits):
+        edited = _apply_edit(code, edit)
+        if edited is None:
+            logger.info(f"Edit {i} doesn't apply:\n{edit.search}")
+            return None
+        code = edited
+    return code
+
+
+def _strip_fences(text: str) -> str:
+    text = text.strip("\n")
+    text = re.sub(r"^```\w*\n", "", text)
+    text = re.sub(r"\n?```$", "", text)
+    return text
+
+
+def _apply_edit(code: str, edit: Edit) -> Optional[str]:
+    if not edit.search.strip():
+        return None
+
+    # whole lines only: `h = 10` must not match the end of `depth = 10`
+    matches = list(
+        re.finditer(r"(?<![^\n])" + re.escape(edit.search) + r"(?![^\n])", code)
+    )
+    if len(matches) > 1:
+        return None
+    if matches:
+        start, end = matches[0].span()
+        return code[:start] + edit.replace + code[end:]
+
+    lines = code.split("\n")
+    search_lines = [line for line in edit.search.split("\n") if line.strip()]
+    replace_lines = edit.replace.split("\n") if edit.replace.strip() else []
+
+    span = _find_lines(lines, search_lines)
+    if span is None:
+        return None
+    start, end = span
+
+    # keep the indentation of the code if the model got it wrong
+    indent = _indentation(lines[start]) - _indentation(search_lines[0])
+    if indent > 0:
+        replace_lines = [" " * indent + line if line else line for line in replace_lines]
+    elif indent < 0:
+        replace_lines = [
+            line[min(-indent, _indentation(line)) :] for line in replace_lines
+        ]
+
+    return "\n".join(lines[:start] + replace_lines + lines[end:])
+
+
+def _indentation(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def _find_lines(lines: list[str], search_lines: list[str]) -> Optional[tuple[int, int]]:
+    """
+    Find the [start, end) line span of `lines` matching `search_lines`, None if
+    there is none or several equally good.
+    """
+    stripped = [line.strip() for line in lines]
+    wanted = [line.strip() for line in search_lines]
+
+    # non blank lines of the code, so that blank lines don't break matches
+    content = [i for i, line in enumerate(stripped) if line]
+    n = len(wanted)
+    if n == 0 or n > len(content):
+        return None
+
+    exact = [
+        (content[k], content[k + n - 1] + 1)
+        for k in range(len(content) - n + 1)
+        if [stripped[i] for i in content[k : k + n]] == wanted
+    ]
+    if exact:
+        return exact[0] if len(exact) == 1 else None
+
+    best_ratio, best_span, tied = 0.0, None, False
+    target = "\n".join(wanted)
+    for k in range(len(content) - n + 1):
+        window = content[k : k + n]
+        candidate = "\n".join(stripped[i] for i in window)
+        matcher = difflib.SequenceMatcher(None, candidate, target)
+        if matcher.quick_ratio() < max(best_ratio, FUZZY_THRESHOLD):
+            continue
+        ratio = matcher.ratio()
+        if ratio > best_ratio:
+            best_ratio, best_span, tied = ratio, (window[0], window[-1] + 1), False
+        elif ratio == best_ratio:
+            tied = True
+
+    if best_ratio >= FUZZY_THRESHOLD and not tied:
+        return best_span
+    return None
@@ -0,0 +1,125 @@
+"""
+Float32 embeddings of labels, shared by every process through a memory map.
+
+The vectors are appended to a flat float32 file and the labels, in the same
+order, to a stream of pickled lists. Only the label -> row mapping is kept in
+memory. The vectors are read from the page cache when needed, so that
+re-ranking the quantized search doesn't cost every process a float32 copy of
+all the labels.
+"""
+
+import contextlib
+import fcntl
+import os
+import pickle
+import threading
+from typing import Callable
+
+import numpy as np
+
+
+class EmbeddingsStore:
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.labels_path = path + ".labels"
+        self.dim = dim
+        self.lock = threading.Lock()
+
+        self.rows: dict[str, int] = {}
+        self.size = 0
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        # end of the last complete list of labels read
+        self._labels_offset = 0
+        with self.lock:
+            self._refresh()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, label: str) -> bool:
+        return label in self.rows
+
+    def memory_bytes(self) -> int:
+        """Size of the mapped vectors, in the page cache shared by the processes."""
+        return self.size * self.dim * 4
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _refresh(self):
+        """Read the labels appended since, possibly by other processes, and map their vectors."""
+        if not os.path.exists(self.labels_path):
+            return
+        with open(self.labels_path, "rb") as f:
+            f.seek(self._labels_offset)
+            while True:
+                try:
+                    labels = pickle.load(f)
+                except Exception:
+                    # end of the file, or a list being written (or whose write crashed)
+                    break
+                for label in labels:
+                    self.rows.setdefault(label, self.size)
+                    self.size += 1
+                self._labels_offset = f.tell()
+
+        if self.size > len(self.vectors):
+            self.vectors = np.memmap(
+                self.path, dtype=np.float32, mode="r", shape=(self.size, self.dim)
+            )
+
+    def _append(self, labels: list[str], vectors: np.ndarray):
+        """Append under the file lock, right after `_refresh`."""
+        # vectors are written first, labels are only read once theirs are complete
+        with open(self.path, "ab") as f:
+            # drop what a crashed write may have left
+            f.truncate(self.size * self.dim * 4)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self.labels_path, "ab") as f:
+            f.truncate(self._labels_offset)
+            pickle.dump(labels, f)
+        self._refresh()
+
+    def move_from_pickle(self, path: str) -> int:
+        """
+        Move the embeddings of a pickled {label: vector} dict into the store and
+        delete it. Processes starting together may all try, only one moves it.
+        Returns the number of embeddings added.
+        """
+        with self.lock, self._file_lock():
+            try:
+                with open(path, "rb") as f:
+                    previous = pickle.load(f)
+            except FileNotFoundError:
+                # moved by another process
+                self._refresh()
+                return 0
+            self._refresh()
+            missing = [label for label in previous if label not in self.rows]
+            if missing:
+                vectors = np.array([previous[label] for label in missing], dtype=np.float32)
+                self._append(missing, vectors.reshape(len(missing), self.dim))
+            os.remove(path)
+            return len(missing)
+
+    def get_or_compute(
+        self, labels: list[str], encode: Callable[[list[str]], np.ndarray]
+    ) -> np.ndarray:
+        """Float32 embeddings of `labels`, encoding the missing ones in one batch."""
+        with self.lock:
+            missing = [label for label in dict.fromkeys(labels) if label not in self.rows]
+            if missing:
+                vectors = np.asarray(encode(missing), dtype=np.float32).reshape(
+                    len(missing), self.dim
+                )
+                with self._file_lock():
+                    self._refresh()
+                    # other processes may have added some of them meanwhile
+                    new = [i for i, label in enumerate(missing) if label not in self.rows]
+                    if new:
+                        self._append([missing[i] for i in new], vectors[new])
+            return np.array(self.vectors[[self.rows[label] for label in labels]])
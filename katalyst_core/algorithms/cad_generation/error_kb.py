@@ -0,0 +1,403 @@
+import ast
+import atexit
+import contextlib
+import copy
+import difflib
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+from loguru import logger
+
+from katalyst_core.files import atomic_write
+from katalyst_core.programs.errors import error_signature
+from katalyst_core.programs.executor import execute_first_time
+from katalyst_core.tracing import traced
+
+ERROR_KB_PATH = "storage/error-kb.json"
+
+# local fixes are applied once they worked this many times and while their
+# success rate is estimated above this
+AUTO_FIX_MIN_SUCCESSES = 2
+AUTO_FIX_MIN_CONFIDENCE = 0.6
+# unproven fixes are tried this many times to find out whether they work
+AUTO_FIX_TRIALS = 3
+# executions spent on local fixes for one error before asking the LLM
+MAX_LOCAL_FIX_ATTEMPTS = 2
+# fix examples remembered per signature
+MAX_FIX_EXAMPLES = 3
+# lookup counters are written at most this often, fix outcomes right away
+SAVE_INTERVAL_SEC = 30
+
+FAILING_LINE = re.compile(r"^>\s+\d+ \| (.*)$")
+
+TIPS = [
+    (
+        r"timeout",
+        "If the code timed out, it is likely instanciating multiple objects in a loop, remove that by simplifying the code.",
+    ),
+    (
+        r"No pending wires present",
+        "If the error is `No pending wires present`, it is likely not trival: all you can do is to remove the function call causing the error and not attempt to do in any other way what you meant to do with that call.",
+    ),
+    (
+        r"fillet|chamfer",
+        'If the error is regarding fillet and chamfers, make sure you selected some edges with .edges(... (e.g "|Z")) before .fillet(<radius>) or .chamfer(<radius>). Notably, you can\'t pass an edge list to .chamfer() or .fillet(), it only takes a radius. You always need to select the edges with .edges. \n```\n edges(selector: Optional[Union[str, Selector]] = None, tag: Optional[str] = None)→ T\n Select the edges of objects on the stack, optionally filtering the selection. If there are multiple objects on the stack, the edges of all objects are collected and a list of all the distinct edges is returned.\nFilters must provide a single method that filters objects: filter(objectList: Sequence[Shape])→ list[Shape]\n```',
+    ),
+    (
+        r"one solid on the stack to union",
+        "If the error is ` Workplane object must have at least one solid on the stack to union!`, make sure you don't call .union on a workplane you just selected, but instead on a workplane with an existing object within. For instance if you created object A on a workplane and object B on another workplane, don't do `result = cq.Workplane(...).union(A).union(B)` but instead `result = A.union(B)`",
+    ),
+]
+
+
+def failing_source_line(output: str) -> Optional[str]:
+    for line in output.split("\n"):
+        match = FAILING_LINE.match(line)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _unwrap_main_guard(code: str, output: str) -> Optional[str]:
+    """Move the body of `if __name__ == "__main__":` (and of a main() it calls) to the top level."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+
+    guards = [
+        node
+        for node in tree.body
+        if isinstance(node, ast.If)
+        and "__name__" in ast.unparse(node.test)
+        and "__main__" in ast.unparse(node.test)
+    ]
+    if not guards:
+        return None
+
+    lines = code.split("\n")
+    functions = {
+        node.name: node
+        for node in tree.body
+        if isinstance(node, ast.FunctionDef) and not node.args.args
+    }
+
+    def dedented(node: ast.AST, body: list[ast.stmt]) -> list[str]:
+        body_lines = lines[body[0].lineno - 1 : node.end_lineno]
+        indent = min(
+            len(line) - len(line.lstrip()) for line in body_lines if line.strip()
+        )
+        return [line[indent:] for line in body_lines]
+
+    # replace bottom up so that line numbers stay valid
+    replacements = []
+    for guard in guards:
+        body = dedented(guard, guard.body)
+        called = [
+            statement.value.func.id
+            for statement in guard.body
+            if isinstance(statement, ast.Expr)
+            and isinstance(statement.value, ast.Call)
+            and isinstance(statement.value.func, ast.Name)
+            and statement.value.func.id in functions
+        ]
+        if len(guard.body) == 1 and called:
+            function = functions[called[0]]
+            replacements.append((function, dedented(function, function.body)))
+            body = []
+        replacements.append((guard, body))
+
+    for node, body in sorted(replacements, key=lambda r: r[0].lineno, reverse=True):
+        lines[node.lineno - 1 : node.end_lineno] = body
+    return "\n".join(lines)
+
+
+def _export_val(code: str, output: str) -> Optional[str]:
+    """Call exportStl on the shape rather than on the Workplane."""
+    fixed = re.sub(r"(?<!\.val\(\))\.exportStl\(", ".val().exportStl(", code)
+    return fixed if fixed != code else None
+
+
+def _replay(code: str, output: str, examples: list[dict]) -> Optional[str]:
+    """Apply a fix that resolved the same error on the same line in the past."""
+    failing = failing_source_line(output)
+    if failing is None:
+        return None
+    for example in examples:
+        if example["before"] != failing.strip():
+            continue
+        lines = code.split("\n")
+        for i, line in enumerate(lines):
+            if line.strip() == example["before"]:
+                indent = line[: len(line) - len(line.lstrip())]
+                lines[i : i + 1] = [indent + after for after in example["after"]]
+                return "\n".join(lines)
+    return None
+
+
+# local code transforms, with the signatures they are meant for
+TRANSFORMS: dict[str, tuple[str, Callable[[str, str], Optional[str]]]] = {
+    "unwrap_main_guard": (
+        r"__name__ == \"__main__\"|export must be at the end",
+        _unwrap_main_guard,
+    ),
+    "export_val": (r"no attribute 'exportStl'", _export_val),
+}
+
+
+_kb_lock = threading.Lock()
+# the KB as of the last load or save, with the changes since applied
+_kb: Optional[dict] = None
+# changes not written yet, merged into the file on save as other processes
+# update it too
+_pending: Optional[dict] = None
+_last_save = 0.0
+
+
+def _empty_kb() -> dict:
+    return {"stats": {"lookups": 0, "known": 0, "local_fixes": 0}, "signatures": {}}
+
+
+def _read_file() -> dict:
+    if os.path.exists(ERROR_KB_PATH):
+        try:
+            with open(ERROR_KB_PATH, "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            logger.warning(f"Ignoring unreadable error KB at {ERROR_KB_PATH}")
+    return _empty_kb()
+
+
+def _load() -> dict:
+    global _kb
+    if _kb is None:
+        _kb = _read_file()
+    return _kb
+
+
+def _merge(kb: dict, changes: dict):
+    for name, count in changes["stats"].items():
+        kb["stats"][name] = kb["stats"].get(name, 0) + count
+    for signature, change in changes["signatures"].items():
+        entry = kb["signatures"].setdefault(
+            signature, {"seen": 0, "fixes": {}, "examples": []}
+        )
+        entry["seen"] += change["seen"]
+        for name, fix in change["fixes"].items():
+            total = entry["fixes"].setdefault(name, {"attempts": 0, "successes": 0})
+            total["attempts"] += fix["attempts"]
+            total["successes"] += fix["successes"]
+        for example in reversed(change["examples"]):
+            if example not in entry["examples"]:
+                entry["examples"].insert(0, example)
+        del entry["examples"][MAX_FIX_EXAMPLES:]
+
+
+def _change(
+    signature: str,
+    stats: Optional[dict] = None,
+    seen: int = 0,
+    fix: Optional[str] = None,
+    success: bool = False,
+    example: Optional[dict] = None,
+):
+    """Apply a change to the KB in memory and queue it for the next save."""
+    global _pending
+    change = {
+        "stats": stats or {},
+        "signatures": {
+            signature: {
+                "seen": seen,
+                "fixes": (
+                    {fix: {"attempts": 1, "successes": int(success)}} if fix else {}
+                ),
+                "examples": [example] if example else [],
+            }
+        },
+    }
+    _merge(_load(), change)
+    if _pending is None:
+        _pending = _empty_kb()
+    _merge(_pending, change)
+
+
+@contextlib.contextmanager
+def _file_lock():
+    os.makedirs(os.path.dirname(ERROR_KB_PATH), exist_ok=True)
+    with open(ERROR_KB_PATH + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _save(force: bool = True):
+    """
+    Merge the pending changes into the file, as it is now, and replace it
+    atomically. Without `force`, only if the last save is old enough.
+    """
+    global _kb, _pending, _last_save
+    if _pending is None:
+        return
+    if not force and time.time() - _last_save < SAVE_INTERVAL_SEC:
+        return
+    with _file_lock():
+        kb = _read_file()
+        _merge(kb, _pending)
+        with atomic_write(ERROR_KB_PATH) as f:
+            json.dump(kb, f, indent=2)
+    _kb, _pending, _last_save = kb, None, time.time()
+
+
+@atexit.register
+def _flush():
+    with _kb_lock:
+        _save()
+
+
+def _confidence(fix: dict) -> float:
+    # Laplace smoothing, an untried fix starts at 0.5
+    return (fix["successes"] + 1) / (fix["attempts"] + 2)
+
+
+def _proven(fix: dict) -> bool:
+    return (
+        fix["successes"] >= AUTO_FIX_MIN_SUCCESSES
+        and _confidence(fix) >= AUTO_FIX_MIN_CONFIDENCE
+    )
+
+
+def record_fix(signature: str, name: str, success: bool):
+    with _kb_lock:
+        _change(signature, fix=name, success=success)
+        _save()
+
+
+def record_llm_fix(
+    signature: str,
+    old_code: str,
+    old_output: str,
+    new_code: str,
+    new_output: str,
+    success: bool,
+):
+    """
+    Record an LLM retry. If it got rid of the error, remember how the failing
+    line was changed, so it can be replayed locally next time.
+    """
+    resolved = success or error_signature(new_output) != signature
+    record_fix(signature, "llm", resolved)
+
+    failing = failing_source_line(old_output)
+    if not resolved or failing is None:
+        return
+
+    old_lines = old_code.split("\n")
+    new_lines = new_code.split("\n")
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        before = [line.strip() for line in old_lines[i1:i2]]
+        if before != [failing.strip()]:
+            continue
+        indent = len(old_lines[i1]) - len(old_lines[i1].lstrip())
+        after = [
+            line[indent:] if len(line) - len(line.lstrip()) >= indent else line.lstrip()
+            for line in new_lines[j1:j2]
+        ]
+        with _kb_lock:
+            example = {"before": failing.strip(), "after": after}
+            entry = _load()["signatures"].get(signature)
+            if entry is None or example not in entry["examples"]:
+                _change(signature, example=example)
+                _save()
+        return
+
+
+def known_tips(signature: str, output: str) -> str:
+    """Tips for the LLM: the built-in ones matching the error, and past fixes."""
+    text = signature + "\n" + (failing_source_line(output) or "")
+    tips = ""
+    for pattern, tip in TIPS:
+        if re.search(pattern, text, re.IGNORECASE):
+            tips += f"\n- {tip}"
+
+    with _kb_lock:
+        entry = _load()["signatures"].get(signature)
+        examples = list(entry["examples"]) if entry is not None else []
+    for example in examples:
+        after = "\n".join(example["after"]) or "(removed)"
+        tips += f"\n- This error was fixed before by replacing `{example['before']}` with:\n```\n{after}\n```"
+    return tips
+
+
+@traced("local_fixes", failed=lambda fix: fix is None)
+def try_local_fixes(
+    signature: str, code: str, output: str
+) -> Optional[tuple[Optional[str], str, str, bool]]:
+    """
+    Apply the known local transforms for this error, most reliable first, and
+    execute them. Returns (program id, output, code, success) of the first one
+    that works, or None.
+    """
+    with _kb_lock:
+        entry = _load()["signatures"].get(signature)
+        fixes = copy.deepcopy(entry["fixes"]) if entry is not None else {}
+        examples = list(entry["examples"]) if entry is not None else []
+        known = any(fix["successes"] for fix in fixes.values())
+        _change(signature, {"lookups": 1, "known": int(known)}, seen=1)
+        # counters only, not worth a write on every failure
+        _save(force=False)
+
+    candidates = [
+        (name, transform)
+        for name, (pattern, transform) in TRANSFORMS.items()
+        if re.search(pattern, signature)
+    ]
+    if examples:
+        candidates.append(("replay", lambda c, o: _replay(c, o, examples)))
+
+    # proven fixes first, then the ones still on trial; the others failed their trial
+    untried = {"attempts": 0, "successes": 0}
+    candidates = [
+        (name, transform)
+        for name, transform in candidates
+        if _proven(fixes.get(name, untried))
+        or fixes.get(name, untried)["attempts"] < AUTO_FIX_TRIALS
+    ]
+    candidates.sort(
+        key=lambda c: (
+            _proven(fixes.get(c[0], untried)),
+            _confidence(fixes.get(c[0], untried)),
+        ),
+        reverse=True,
+    )
+
+    attempts = 0
+    for name, transform in candidates:
+        if attempts >= MAX_LOCAL_FIX_ATTEMPTS:
+            break
+        fixed = transform(code, output)
+        if fixed is None or fixed == code:
+            continue
+
+        attempts += 1
+        program_id, fixed_output, success = execute_first_time(fixed)
+        record_fix(signature, name, success)
+        if success:
+            with _kb_lock:
+                _change(signature, {"local_fixes": 1})
+                _save()
+            logger.info(f"Fixed without LLM by {name}: {signature}")
+            return program_id, fixed_output, fixed, True
+
+    return None
+
+
+def kb_stats() -> dict:
+    with _kb_lock:
+        return copy.deepcopy(_load())
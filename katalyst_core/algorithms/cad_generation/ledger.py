@@ -0,0 +1,137 @@
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from katalyst_core.algorithms.cad_generation.constants import MODEL_PRICES
+
+
+@dataclass
+class LedgerEntry:
+    model: str
+    tokens_in: int
+    tokens_out: int
+    latency: float
+    timestamp: float
+
+    @property
+    def cost(self) -> float:
+        price_in, price_out = MODEL_PRICES.get(self.model, (0.0, 0.0))
+        return (self.tokens_in * price_in + self.tokens_out * price_out) / 1e6
+
+
+@dataclass
+class Budget:
+    max_tokens: Optional[int] = None
+    # summed duration of the LLM calls: parallel calls (best-of-N candidates,
+    # drafts) all count, so it is more than the wall time they take
+    max_llm_seconds: Optional[float] = None
+
+
+@dataclass
+class SessionLedger:
+    """Usage of every LLM call of an agent session, and the session's budget."""
+
+    entries: list[LedgerEntry] = field(default_factory=list)
+    budget: Budget = field(default_factory=Budget)
+    lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def record(self, entry: LedgerEntry):
+        with self.lock:
+            self.entries.append(entry)
+
+    @property
+    def tokens(self) -> int:
+        return sum(e.tokens_in + e.tokens_out for e in self.entries)
+
+    @property
+    def llm_seconds(self) -> float:
+        return sum(e.latency for e in self.entries)
+
+    @property
+    def cost(self) -> float:
+        return sum(e.cost for e in self.entries)
+
+    def budget_exceeded(self) -> bool:
+        if self.budget.max_tokens is not None and self.tokens >= self.budget.max_tokens:
+            return True
+        return (
+            self.budget.max_llm_seconds is not None
+            and self.llm_seconds >= self.budget.max_llm_seconds
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "entries": [asdict(e) for e in self.entries],
+            "budget": asdict(self.budget),
+        }
+
+    @staticmethod
+    def from_dict(d: dict) -> "SessionLedger":
+        budget = dict(d.get("budget", {}))
+        # sessions serialized before the field was renamed
+        if "max_latency_sec" in budget:
+            budget["max_llm_seconds"] = budget.pop("max_latency_sec")
+        return SessionLedger(
+            [LedgerEntry(**e) for e in d.get("entries", [])],
+            Budget(**budget),
+        )
+
+
+_current_ledger: contextvars.ContextVar[Optional[SessionLedger]] = (
+    contextvars.ContextVar("current_ledger", default=None)
+)
+
+
+@contextlib.contextmanager
+def recording(ledger: SessionLedger) -> Iterator[SessionLedger]:
+    """Record the LLM calls made in the enclosed block into `ledger`."""
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+
+
+def budget_exceeded() -> bool:
+    """Whether the session being recorded has used up its budget."""
+    ledger = _current_ledger.get()
+    if ledger is None or not ledger.budget_exceeded():
+        return False
+    logger.info(
+        f"Session budget reached: {ledger.tokens} tokens, {ledger.llm_seconds:.1f}s of LLM calls"
+    )
+    return True
+
+
+def track_client(client):
+    """Record the usage of every chat completion of `client` in the current ledger."""
+    create = client.chat.completions.create
+
+    @functools.wraps(create)
+    def tracked_create(*args, **kwargs):
+        start = time.perf_counter()
+        response = create(*args, **kwargs)
+        ledger = _current_ledger.get()
+        usage = getattr(response, "usage", None)
+        if ledger is not None and usage is not None:
+            ledger.record(
+                LedgerEntry(
+                    kwargs.get("model", response.model),
+                    usage.prompt_tokens,
+                    usage.completion_tokens,
+                    time.perf_counter() - start,
+                    time.time(),
+                )
+            )
+        return response
+
+    client.chat.completions.create = tracked_create
+    return client
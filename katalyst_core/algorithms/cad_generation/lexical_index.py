@@ -0,0 +1,93 @@
+"""
+BM25 inverted index, the lexical side of retrieval.
+
+Sentence embeddings blur exact CAD vocabulary ("involute", "NACA", "M6",
+"countersink") that the user expects to be matched literally. Rankings of
+both are combined with reciprocal rank fusion, see `fuse_rankings`.
+"""
+
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Hashable
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# reciprocal rank fusion constant, dampens the weight of the very first ranks
+RRF_K = 60
+
+STOPWORDS = set(
+    "a an and are as at be by for from in into is it its of on or so that the "
+    "then this to with".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase words and numbers, identifiers split on underscores and dots."""
+    return [
+        token
+        for token in re.findall(r"[a-z0-9]+", text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+class BM25Index:
+    def __init__(self):
+        self.postings: dict[str, dict[Hashable, int]] = {}
+        self.lengths: dict[Hashable, int] = {}
+        self.terms: dict[Hashable, list[str]] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, key: Hashable, text: str):
+        self.remove(key)
+        tokens = tokenize(text)
+        for term, count in Counter(tokens).items():
+            self.postings.setdefault(term, {})[key] = count
+        self.terms[key] = list(set(tokens))
+        self.lengths[key] = len(tokens)
+        self.total_length += len(tokens)
+
+    def remove(self, key: Hashable):
+        if key not in self.lengths:
+            return
+        for term in self.terms.pop(key):
+            postings = self.postings[term]
+            del postings[key]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(key)
+
+    def search(self, query: str, k: int) -> list[tuple[Hashable, float]]:
+        """The `k` best matching keys with their BM25 scores, best first."""
+        if not self.lengths:
+            return []
+        average_length = self.total_length / len(self.lengths) or 1
+        scores: dict[Hashable, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(
+                1 + (len(self.lengths) - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for key, count in postings.items():
+                norm = BM25_K1 * (
+                    1 - BM25_B + BM25_B * self.lengths[key] / average_length
+                )
+                scores[key] = scores.get(key, 0.0) + idf * count * (BM25_K1 + 1) / (
+                    count + norm
+                )
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def fuse_rankings(*rankings: list[tuple[Hashable, float]]) -> list[Hashable]:
+    """Keys of several best-first rankings, by reciprocal rank fusion."""
+    scores: dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, (key, _) in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1 / (RRF_K + rank + 1)
+    return sorted(scores, key=lambda key: scores[key], reverse=True)
@@ -0,0 +1,116 @@
+import io
+import re
+import tokenize
+from typing import Iterable, Optional
+
+from loguru import logger
+
+from katalyst_core.algorithms.cad_generation.utils import count_tokens
+
+# examples sharing more code shingles than this with an already kept one are dropped
+NEAR_DUPLICATE_THRESHOLD = 0.85
+SHINGLE_SIZE = 5
+
+# comments the parameters post-processing relies on
+KEPT_COMMENTS = re.compile(r"#\s*</?parameters>")
+
+
+def minify_code(code: str) -> str:
+    """
+    Strip comments, trailing whitespace and blank lines from python code.
+
+    Falls back to only dropping blank lines if the code doesn't tokenize, so
+    that broken examples are still shown as they are.
+    """
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return _drop_blank_lines(code)
+
+    lines = code.split("\n")
+    # remove comments right to left so that columns stay valid
+    for token in reversed(tokens):
+        if token.type != tokenize.COMMENT or KEPT_COMMENTS.match(token.string):
+            continue
+        row, col = token.start
+        line = lines[row - 1]
+        lines[row - 1] = line[:col] + line[token.end[1] :]
+
+    return _drop_blank_lines("\n".join(lines))
+
+
+def _drop_blank_lines(code: str) -> str:
+    return "\n".join(line.rstrip() for line in code.split("\n") if line.strip())
+
+
+def minify_markdown_code(text: str) -> str:
+    """Minify the fenced code blocks of a markdown text, keeping the prose."""
+
+    def minify_block(match: re.Match) -> str:
+        return f"```{match.group(1)}\n{minify_code(match.group(2))}\n```"
+
+    text = re.sub(r"```(\w*)\n(.*?)```", minify_block, text, flags=re.DOTALL)
+    return re.sub(r"\n{3,}", "\n\n", text.strip())
+
+
+def _shingles(text: str) -> set[tuple[str, ...]]:
+    words = re.findall(r"\w+|[^\w\s]", text)
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {
+        tuple(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def _similarity(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def compile_examples(
+    examples: Iterable[str],
+    token_budget: int,
+    header: str = "",
+    max_examples: Optional[int] = None,
+) -> tuple[str, int]:
+    """
+    Assemble already minified examples, given in decreasing order of relevance,
+    into a prompt of at most `token_budget` tokens (header included) and
+    `max_examples` examples.
+
+    Near-duplicates of an already kept example are skipped, and so are examples
+    too large for the remaining budget, a smaller one further down may still fit.
+    Returns the prompt and its token count.
+    """
+    prompt = header
+    tokens = count_tokens(header)
+    kept_shingles: list[set] = []
+    skipped_duplicates, skipped_budget = 0, 0
+
+    for example in examples:
+        if max_examples is not None and len(kept_shingles) >= max_examples:
+            break
+
+        shingles = _shingles(example)
+        if any(
+            _similarity(shingles, kept) >= NEAR_DUPLICATE_THRESHOLD
+            for kept in kept_shingles
+        ):
+            skipped_duplicates += 1
+            continue
+
+        example_tokens = count_tokens(example)
+        if tokens + example_tokens > token_budget:
+            skipped_budget += 1
+            continue
+
+        prompt += example
+        tokens += example_tokens
+        kept_shingles.append(shingles)
+
+    logger.trace(
+        f"Compiled {len(kept_shingles)} examples in {tokens} tokens "
+        f"({skipped_duplicates} near-duplicates, {skipped_budget} over budget)"
+    )
+    return prompt, tokens
@@ -0,0 +1,50 @@
+import math
+import re
+from typing import Optional
+
+# words that say nothing about which example could help with an error
+STOPWORDS = {
+    "the",
+    "and",
+    "for",
+    "line",
+    "error",
+    "result",
+    "object",
+    "has",
+    "not",
+    "with",
+    "workplane",
+    "filename",
+    "render",
+    "stl",
+}
+
+
+def split_examples(examples: str) -> list[str]:
+    return re.findall(r"<example>.*?</example>", examples, re.DOTALL)
+
+
+def _words(text: str) -> set[str]:
+    return {
+        word.lower()
+        for word in re.findall(r"[A-Za-z_][A-Za-z_0-9]{2,}", text)
+        if word.lower() not in STOPWORDS
+    }
+
+
+def most_relevant_example(examples: str, feedback: str) -> Optional[str]:
+    """
+    Pick the example sharing the most vocabulary with the error feedback (e.g.
+    the failing call name), or None if no example is related to it at all.
+    """
+    feedback_words = _words(feedback)
+    best_score, best_example = 0.0, None
+    for example in split_examples(examples):
+        example_words = _words(example)
+        if not example_words:
+            continue
+        score = len(feedback_words & example_words) / math.sqrt(len(example_words))
+        if score > best_score:
+            best_score, best_example = score, example
+    return best_example
@@ -0,0 +1,162 @@
+import contextlib
+import fcntl
+import json
+import os
+import random
+import threading
+from dataclasses import asdict, dataclass, field
+
+from loguru import logger
+
+from katalyst_core.algorithms.cad_generation.constants import MODEL, MODEL_FAST
+from katalyst_core.files import atomic_write
+
+ROUTING_STATS_PATH = "storage/routing-stats.json"
+
+# prompts this close to a dataset part are handled well by the fast model
+CLOSE_MATCH_SIMILARITY = 0.75
+# below this, nothing in the dataset looks like the prompt
+FAR_SIMILARITY = 0.35
+# long prompts describe complex parts
+LONG_PROMPT_LENGTH = 600
+
+# a route's statistics are only trusted after this many generations
+MIN_ROUTE_SAMPLES = 10
+MIN_CLOSE_MATCH_SUCCESS_RATE = 0.7
+# share of the prompts still sent to a demoted close-match route, so that its
+# statistics can recover when the fast model gets better
+EXPLORATION_RATE = 0.1
+
+
+@dataclass
+class Route:
+    name: str
+    model: str
+    depth: int
+    reason: str
+
+
+@dataclass
+class RouteStats:
+    attempts: int = 0
+    successes: int = 0
+    total_duration: float = 0.0
+
+    @property
+    def success_rate(self) -> float:
+        return self.successes / self.attempts if self.attempts else 0.0
+
+    @property
+    def mean_duration(self) -> float:
+        return self.total_duration / self.attempts if self.attempts else 0.0
+
+
+@dataclass
+class RoutingStats:
+    routes: dict[str, RouteStats] = field(default_factory=dict)
+
+    def get(self, name: str) -> RouteStats:
+        return self.routes.get(name, RouteStats())
+
+
+_stats_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _file_lock():
+    """Serializes the read-modify-writes of the stats file between processes."""
+    os.makedirs(os.path.dirname(ROUTING_STATS_PATH), exist_ok=True)
+    with open(ROUTING_STATS_PATH + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def read_routing_stats() -> RoutingStats:
+    if not os.path.exists(ROUTING_STATS_PATH):
+        return RoutingStats()
+    try:
+        with open(ROUTING_STATS_PATH, "r") as f:
+            data = json.load(f)
+        return RoutingStats(
+            {name: RouteStats(**stats) for name, stats in data.items()}
+        )
+    except (json.JSONDecodeError, TypeError):
+        logger.warning(f"Ignoring unreadable routing stats at {ROUTING_STATS_PATH}")
+        return RoutingStats()
+
+
+def choose_route(
+    prompt: str, precision: int, similarity: float, stats: RoutingStats
+) -> Route:
+    """
+    Pick the model and refinement depth of an initial generation.
+
+    `precision` 0 still forces the fast path. Otherwise, prompts close to a dataset
+    part go to the fast model unless that route has been failing (except for
+    `EXPLORATION_RATE` of them), and long or unfamiliar prompts get one more
+    refinement pass.
+    """
+    if precision == 0:
+        return Route("fast", MODEL_FAST, 0, "precision 0")
+
+    depth = precision - 1
+    is_long = len(prompt) > LONG_PROMPT_LENGTH
+
+    if similarity >= CLOSE_MATCH_SIMILARITY and not is_long:
+        close_match = stats.get("close-match")
+        demoted = (
+            close_match.attempts >= MIN_ROUTE_SAMPLES
+            and close_match.success_rate < MIN_CLOSE_MATCH_SUCCESS_RATE
+        )
+        if demoted and random.random() < EXPLORATION_RATE:
+            return Route(
+                "close-match",
+                MODEL_FAST,
+                min(depth, 1),
+                f"similarity {similarity:.2f}, exploring close-match "
+                f"({close_match.success_rate:.0%} success)",
+            )
+        if demoted:
+            return Route(
+                "main",
+                MODEL,
+                depth,
+                f"similarity {similarity:.2f} but close-match succeeds only "
+                f"{close_match.success_rate:.0%} of the time",
+            )
+        return Route(
+            "close-match",
+            MODEL_FAST,
+            min(depth, 1),
+            f"similarity {similarity:.2f}",
+        )
+
+    if similarity < FAR_SIMILARITY or is_long:
+        return Route(
+            "hard",
+            MODEL,
+            depth + 1,
+            f"similarity {similarity:.2f}, prompt length {len(prompt)}",
+        )
+
+    return Route("main", MODEL, depth, f"similarity {similarity:.2f}")
+
+
+def record_route_outcome(route: Route, success: bool, duration: float):
+    logger.info(
+        f"Route {route.name} ({route.model}, depth {route.depth}): "
+        f"{'success' if success else 'failure'} in {duration:.1f}s"
+    )
+
+    with _stats_lock, _file_lock():
+        stats = read_routing_stats()
+        route_stats = stats.routes.setdefault(route.name, RouteStats())
+        route_stats.attempts += 1
+        route_stats.successes += int(success)
+        route_stats.total_duration += duration
+
+        # readers don't take the lock, they see the previous or the new file
+        with atomic_write(ROUTING_STATS_PATH) as f:
+            json.dump(
+                {name: asdict(s) for name, s in stats.routes.items()}, f, indent=2
+            )
@@ -1,13 +1,54 @@
+import functools
 import os
 from typing import Optional
+from loguru import logger
 from openai import OpenAI
+import tiktoken
+
+from katalyst_core.algorithms.cad_generation.ledger import track_client
+from katalyst_core.tracing import trace_client
+
+DEFAULT_LLM_BASE_URL = "https://openrouter.ai/api/v1"
+
+
+def llm_base_url() -> str:
+    # LLM_BASE_URL lets us point the agent at any OpenAI-compatible endpoint,
+    # e.g. the fake server from katalyst_core.loadtest.fake_llm
+    return os.getenv("LLM_BASE_URL") or DEFAULT_LLM_BASE_URL
 
 
 def init_client(llm_api_key: Optional[str] = None) -> OpenAI:
-    return OpenAI(
+    client = OpenAI(
         api_key=(
             llm_api_key if llm_api_key is not None else os.getenv("OPENROUTER_API_KEY")
         ),
-        base_url="https://openrouter.ai/api/v1",
+        base_url=llm_base_url(),
         timeout=100,
     )
+    return track_client(trace_client(client))
+
+
+@functools.cache
+def _tokenizer() -> Optional[tiktoken.Encoding]:
+    # loading the encoding is slow, only do it once per process
+    try:
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:
+        # the encoding is downloaded on first use, which fails offline
+        logger.warning(f"Couldn't load the tokenizer, token counts are estimated: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    tokenizer = _tokenizer()
+    if tokenizer is None:
+        return len(text) // 4
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def count_messages_tokens(messages: list[dict]) -> int:
+    return sum(
+        count_tokens(message["content"])
+        for message in messages
+        if isinstance(message.get("content"), str)
+    )
@@ -0,0 +1,355 @@
+"""
+Cosine similarity search over the label embeddings of the dataset.
+
+Search is exact (one matrix-vector product) while the index is small. From
+`IVF_MIN_SIZE` vectors on, it is an inverted file index: vectors are
+clustered by k-means, and a query only scans the `nprobe` clusters whose
+centroids are the most similar to it. Vectors can be added and removed at
+any time; new vectors go to their closest cluster, and the clusters are
+trained again once the index has grown `RETRAIN_GROWTH` times since. Removed
+vectors are dropped once they are `COMPACT_DEAD_FRACTION` of the stored ones.
+
+Vectors can be stored as float16, or as int8 with a scale per vector, to take
+2 or 4 times less memory than float32. Searches then score the candidates
+approximately, and given the float32 vectors of the best `RERANK_FACTOR * k`
+of them, rank these again exactly.
+"""
+
+import threading
+import time
+from typing import Callable, Hashable, Optional
+
+import numpy as np
+
+IVF_MIN_SIZE = 5000
+RETRAIN_GROWTH = 4
+DEFAULT_NPROBE = 20
+KMEANS_ITERATIONS = 10
+KMEANS_MAX_SAMPLES = 20000
+STORAGES = ("float32", "float16", "int8")
+RERANK_FACTOR = 4
+# removed vectors leave dead slots, dropped once they are this share of the stored ones
+COMPACT_DEAD_FRACTION = 0.5
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _kmeans(vectors: np.ndarray, n_clusters: int) -> np.ndarray:
+    """Spherical k-means centroids of normalized vectors."""
+    random = np.random.default_rng(0)
+    if len(vectors) > KMEANS_MAX_SAMPLES:
+        vectors = vectors[random.choice(len(vectors), KMEANS_MAX_SAMPLES, replace=False)]
+    centroids = vectors[random.choice(len(vectors), n_clusters, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = _normalized(centroids)
+    return centroids
+
+
+class VectorIndex:
+    def __init__(
+        self,
+        ivf_min_size: int = IVF_MIN_SIZE,
+        nprobe: int = DEFAULT_NPROBE,
+        storage: str = "float32",
+    ):
+        if storage not in STORAGES:
+            raise ValueError(f"Unknown vector storage {storage}, expected one of {STORAGES}")
+        self.ivf_min_size = ivf_min_size
+        self.nprobe = nprobe
+        self.storage = storage
+        self.lock = threading.Lock()
+
+        self.keys: list[Hashable] = []
+        self.positions: dict[Hashable, int] = {}
+        self.vectors: Optional[np.ndarray] = None
+        # int8 storage only, the vectors are `vectors * scales`
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.size = 0
+
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: list[np.ndarray] = []
+        self.trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        # indexes pickled before quantization was supported are float32
+        state.setdefault("storage", "float32")
+        state.setdefault("scales", np.zeros(0, dtype=np.float32))
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.positions
+
+    def memory_bytes(self) -> int:
+        """Memory taken by the stored vectors and the clusters."""
+        total = self.scales.nbytes + self.alive.nbytes
+        if self.vectors is not None:
+            total += self.vectors.nbytes
+        if self.centroids is not None:
+            total += self.centroids.nbytes + sum(cluster.nbytes for cluster in self.lists)
+        return total
+
+    def _reserve(self, count: int, dim: int):
+        if self.vectors is None:
+            capacity = max(count, 64)
+        elif self.size + count > len(self.vectors):
+            capacity = max(self.size + count, 2 * len(self.vectors))
+        else:
+            return
+        vectors = np.zeros((capacity, dim), dtype=self.storage)
+        scales = np.zeros(capacity if self.storage == "int8" else 0, dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        if self.vectors is not None:
+            vectors[: self.size] = self.vectors[: self.size]
+            scales[: len(self.scales)] = self.scales
+            alive[: self.size] = self.alive[: self.size]
+        self.vectors, self.scales, self.alive = vectors, scales, alive
+
+    def _store(self, start: int, vectors: np.ndarray):
+        end = start + len(vectors)
+        if self.storage == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            self.vectors[start:end] = np.round(vectors / scales[:, None])
+            self.scales[start:end] = scales
+        else:
+            self.vectors[start:end] = vectors
+
+    def _decoded(self, positions: np.ndarray) -> np.ndarray:
+        vectors = self.vectors[positions].astype(np.float32)
+        if self.storage == "int8":
+            vectors *= self.scales[positions, None]
+        return vectors
+
+    def _scores(self, positions: np.ndarray, query: np.ndarray) -> np.ndarray:
+        if self.storage == "float32":
+            return self.vectors[positions] @ query
+        scores = self.vectors[positions].astype(np.float32) @ query
+        if self.storage == "int8":
+            scores *= self.scales[positions]
+        return scores
+
+    def add(self, keys: list[Hashable], vectors: np.ndarray):
+        """Add or replace the vectors of `keys`."""
+        if not keys:
+            return
+        vectors = _normalized(vectors).reshape(len(keys), -1)
+        with self.lock:
+            for key in keys:
+                self._remove(key)
+            self._reserve(len(keys), vectors.shape[1])
+            start = self.size
+            self._store(start, vectors)
+            self.alive[start : start + len(keys)] = True
+            for offset, key in enumerate(keys):
+                self.positions[key] = start + offset
+                self.keys.append(key)
+            self.size += len(keys)
+
+            if self.centroids is not None and len(self) < RETRAIN_GROWTH * self.trained_size:
+                self._assign(np.arange(start, self.size))
+                self._compact_if_sparse()
+            elif len(self) >= self.ivf_min_size:
+                self._train()
+            else:
+                self._compact_if_sparse()
+
+    def remove(self, key: Hashable):
+        with self.lock:
+            self._remove(key)
+            self._compact_if_sparse()
+
+    def _remove(self, key: Hashable):
+        position = self.positions.pop(key, None)
+        if position is not None:
+            # the position stays in its cluster list, dead ones are skipped on search
+            self.alive[position] = False
+
+    def _assign(self, positions: np.ndarray):
+        assignments = np.argmax(self._decoded(positions) @ self.centroids.T, axis=1)
+        for cluster in np.unique(assignments):
+            self.lists[cluster] = np.concatenate(
+                [self.lists[cluster], positions[assignments == cluster]]
+            )
+
+    def _compact_if_sparse(self):
+        if self.size - len(self) > COMPACT_DEAD_FRACTION * self.size:
+            self._compact()
+
+    def _compact(self):
+        """Drop the removed vectors, renumbering the live ones and their cluster lists."""
+        live = np.flatnonzero(self.alive[: self.size])
+        renumbered = np.full(self.size, -1, dtype=np.int64)
+        renumbered[live] = np.arange(len(live))
+        self.vectors = self.vectors[live].copy()
+        if self.storage == "int8":
+            self.scales = self.scales[live].copy()
+        self.alive = np.ones(len(live), dtype=bool)
+        self.keys = [self.keys[position] for position in live]
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+        self.size = len(live)
+        if self.centroids is not None:
+            lists = [renumbered[cluster] for cluster in self.lists]
+            self.lists = [cluster[cluster >= 0] for cluster in lists]
+
+    def _train(self):
+        """Cluster the live vectors, compacting away the removed ones."""
+        self._compact()
+
+        n_clusters = max(1, int(np.sqrt(self.size)))
+        self.centroids = _kmeans(self._decoded(np.arange(self.size)), n_clusters)
+        self.lists = [np.zeros(0, dtype=np.int64) for _ in range(n_clusters)]
+        self._assign(np.arange(self.size))
+        self.trained_size = self.size
+
+    def similarity(self, key: Hashable, query: np.ndarray) -> float:
+        """Cosine similarity of an indexed vector to `query`, 0 if not indexed."""
+        with self.lock:
+            position = self.positions.get(key)
+            if position is None:
+                return 0.0
+            return float(
+                self._scores(np.array([position]), _normalized(query).reshape(-1))[0]
+            )
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        exact: bool = False,
+        nprobe: Optional[int] = None,
+        rerank: Optional[Callable[[list[Hashable]], np.ndarray]] = None,
+    ) -> list[tuple[Hashable, float]]:
+        """
+        The `k` keys most similar to `query`, with their cosine similarities.
+        With quantized storage, `rerank` gives the float32 vectors of keys to
+        rank the best candidates exactly.
+        """
+        query = _normalized(query).reshape(-1)
+        with self.lock:
+            if self.vectors is None or not self.positions:
+                return []
+            if exact or self.centroids is None:
+                candidates = np.flatnonzero(self.alive[: self.size])
+            else:
+                probes = np.argsort(self.centroids @ query)[::-1][
+                    : nprobe or self.nprobe
+                ]
+                candidates = np.concatenate([self.lists[probe] for probe in probes])
+                candidates = candidates[self.alive[candidates]]
+
+            scores = self._scores(candidates, query)
+            reranked = rerank is not None and self.storage != "float32"
+            keep = min(RERANK_FACTOR * k if reranked else k, len(candidates))
+            if keep == 0:
+                return []
+            top = np.argpartition(-scores, keep - 1)[:keep]
+            top = top[np.argsort(-scores[top])]
+            ranking = [(self.keys[candidates[i]], float(scores[i])) for i in top]
+
+        if reranked:
+            exact_scores = _normalized(rerank([key for key, _ in ranking])) @ query
+            ranking = [
+                (ranking[i][0], float(exact_scores[i]))
+                for i in np.argsort(-exact_scores, kind="stable")[:k]
+            ]
+        return ranking[:k]
+
+
+def benchmark(
+    index: VectorIndex,
+    queries: np.ndarray,
+    k: int = 10,
+    nprobes: tuple[int, ...] = (1, 5, 10, 20, 50),
+) -> list[dict]:
+    """Recall@k and mean latency of IVF search against exact search, per nprobe."""
+    exact_results = []
+    start = time.perf_counter()
+    for query in queries:
+        exact_results.append({key for key, _ in index.search(query, k, exact=True)})
+    exact_latency = (time.perf_counter() - start) / len(queries)
+
+    rows = [{"nprobe": "exact", "recall": 1.0, "latency_ms": exact_latency * 1e3}]
+    if index.centroids is None:
+        return rows
+
+    for nprobe in nprobes:
+        hits = 0
+        start = time.perf_counter()
+        for query, expected in zip(queries, exact_results):
+            found = {key for key, _ in index.search(query, k, nprobe=nprobe)}
+            hits += len(found & expected)
+        latency = (time.perf_counter() - start) / len(queries)
+        rows.append(
+            {
+                "nprobe": nprobe,
+                "recall": hits / max(1, sum(len(e) for e in exact_results)),
+                "latency_ms": latency * 1e3,
+            }
+        )
+    return rows
+
+
+def storage_benchmark(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    ivf_min_size: int = IVF_MIN_SIZE,
+) -> list[dict]:
+    """
+    Memory, recall@k against exact float32 search, and mean latency of every
+    storage, without and with float32 re-ranking. The memory of re-ranked
+    storages includes the float32 vectors.
+    """
+    vectors = _normalized(vectors)
+    keys = list(range(len(vectors)))
+
+    def rerank(ranked_keys: list[int]) -> np.ndarray:
+        return vectors[ranked_keys]
+
+    expected = []
+    for query in queries:
+        scores = vectors @ _normalized(query).reshape(-1)
+        expected.append(set(np.argsort(-scores)[:k].tolist()))
+    total = max(1, sum(len(e) for e in expected))
+
+    rows = []
+    for storage in STORAGES:
+        index = VectorIndex(ivf_min_size=ivf_min_size, storage=storage)
+        index.add(keys, vectors)
+        for reranked in (False, True) if storage != "float32" else (False,):
+            hits = 0
+            start = time.perf_counter()
+            for query, relevant in zip(queries, expected):
+                found = index.search(query, k, rerank=rerank if reranked else None)
+                hits += len({key for key, _ in found} & relevant)
+            latency = (time.perf_counter() - start) / len(queries)
+            rows.append(
+                {
+                    "storage": storage + (" + rerank" if reranked else ""),
+                    "memory_mb": (
+                        index.memory_bytes() + (vectors.nbytes if reranked else 0)
+                    )
+                    / 2**20,
+                    "recall": hits / total,
+                    "latency_ms": latency * 1e3,
+                }
+            )
+    return rows
@@ -6,6 +6,9 @@ import lancedb
 from langchain_text_splitters import NLTKTextSplitter
 from loguru import logger
 
+from katalyst_core.algorithms.cad_generation.examples_ragging import (
+    generate_examples_for_shape,
+)
 from katalyst_core.algorithms.docs_to_desc.design_schema import Design
 from katalyst_core.algorithms.docs_to_desc.utilities import (
     convert_image_to_base64,
@@ -20,6 +23,7 @@ from katalyst_core.algorithms.docs_to_desc.utilities import (
     sort_files,
 )
 from katalyst_core.algorithms.stl_to_pics.to_pics import stl_to_pictures
+from katalyst_core.tracing import traced
 
 VECDB_PATH = "storage/dataset/multimodal_vector_db"
 
@@ -35,6 +39,10 @@ SAMPLING_RATE = 0.5  # Frames per second
 CHUNK_SIZE = 1000
 OVERLAP = 100
 RETRIEVE_LIMIT = 5
+# shape descriptor distance under which dataset parts are given as examples for an
+# uploaded STL: measured on cadquery primitives, the same part with a hole or at
+# another scale is below 0.1, a box against a cylinder or a plate about 1
+SHAPE_MATCH_DISTANCE = 0.1
 
 MODEL = "openai/gpt-4o-mini"
 
@@ -50,14 +58,24 @@ Geometric Constraints: Rules maintaining relationships between geometric element
 """
 
 
+@traced("docs_to_prompt")
 def docs_to_prompt(
     documents: list[str],
     text_prompt: Optional[str] = None,
     max_concurrent=4,
     llm_api_key: Optional[str] = None,
+    shape_match_distance: Optional[float] = SHAPE_MATCH_DISTANCE,
 ) -> str:
+    """
+    Description of the object in the documents. Uploaded STLs come with the
+    dataset parts of nearly the same shape as examples, those within
+    `shape_match_distance`, or the closest ones if None.
+    """
     messages = _docs_to_description_prompt(
-        documents=documents, text_prompt=text_prompt, llm_api_key=llm_api_key
+        documents=documents,
+        text_prompt=text_prompt,
+        llm_api_key=llm_api_key,
+        shape_match_distance=shape_match_distance,
     )
 
     client = init_client(llm_api_key)
@@ -112,6 +130,7 @@ def _docs_to_description_prompt(
     documents: list[str],
     text_prompt: Optional[str] = None,
     llm_api_key: Optional[str] = None,
+    shape_match_distance: Optional[float] = SHAPE_MATCH_DISTANCE,
 ) -> list[dict[str, Any]]:
     """
     Builds a multimodal prompt
@@ -186,6 +205,19 @@ def _docs_to_description_prompt(
         tokens = get_num_tokens(stl_images)
         docs = images_to_json(stl_images, create_llm_image_format)
 
+        examples = generate_examples_for_shape(
+            stl_path, top_n=RETRIEVE_LIMIT, max_distance=shape_match_distance
+        )
+        if examples:
+            rag_doc = {
+                "type": "text",
+                "text": "The following are dataset designs of nearly the same shape, "
+                "that you can use to aid you in the designing of the object above:\n"
+                + examples,
+            }
+            tokens += get_num_tokens(rag_doc["text"])
+            docs.append(rag_doc)
+
         for image in stl_images:
             image.close()
 
@@ -12,6 +12,9 @@ import math
 from openai import OpenAI
 
 from katalyst_core.algorithms.docs_to_desc.prompts import summarization_prompt
+from katalyst_core.algorithms.cad_generation.ledger import track_client
+from katalyst_core.algorithms.cad_generation.utils import llm_base_url
+from katalyst_core.tracing import trace_client
 
 APIType = Literal["openai"]
 JSON_REGEX = r"```json(.*?)```"
@@ -20,13 +23,14 @@ MODEL = "openai/gpt-4o-mini"
 
 
 def init_client(llm_api_key: Optional[str] = None) -> OpenAI:
-    return OpenAI(
+    client = OpenAI(
         api_key=(
             llm_api_key if llm_api_key is not None else os.getenv("OPENROUTER_API_KEY")
         ),
-        base_url="https://openrouter.ai/api/v1",
+        base_url=llm_base_url(),
         timeout=100,
     )
+    return track_client(trace_client(client))
 
 
 def get_completion_llm(
@@ -37,7 +37,10 @@ if os.path.isdir("/app"):
 
 import vtk  # noqa: E402
 
+from katalyst_core.tracing import traced  # noqa: E402
 
+
+@traced("render")
 def render(
     filenames: list[str],
     positions: list[tuple[float, float, float]],
@@ -0,0 +1,209 @@
+"""
+Near-duplicate detection with MinHash signatures and LSH banding.
+
+Texts are normalized (comments, numbers and whitespace dropped) and cut into
+word shingles. Two texts whose MinHash signatures agree on a whole band are
+candidates, and are duplicates if their estimated Jaccard similarity is at
+least the threshold, so finding the duplicates of a text doesn't compare it
+to the whole corpus.
+
+The signatures and buckets of the dataset are stored in its database (the
+`minhashes` and `lsh_buckets` tables) and updated as rows are added or
+removed, along with the group every row belongs to.
+"""
+
+import hashlib
+import re
+import sqlite3
+from typing import Hashable, Iterable, Optional
+
+import numpy as np
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 64
+# 8 bands of 8 rows: pairs above ~0.77 similarity are very likely candidates
+NUM_BANDS = 8
+DUPLICATE_THRESHOLD = 0.8
+
+_random = np.random.default_rng(0)
+_multipliers = _random.integers(1, 2**63, NUM_PERMUTATIONS, dtype=np.uint64) | 1
+_offsets = _random.integers(0, 2**63, NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def normalize(text: str) -> str:
+    """Drop what doesn't make two examples different: comments, numbers, case and spacing."""
+    text = re.sub(r"#[^\n]*", "", text)
+    text = re.sub(r"\d+(\.\d+)?", "0", text)
+    return " ".join(text.lower().split())
+
+
+def minhash(text: str) -> np.ndarray:
+    words = re.findall(r"\w+|[^\w\s]", normalize(text))
+    shingles = {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    }
+    hashes = np.array(
+        [
+            int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little")
+            for s in shingles
+        ],
+        dtype=np.uint64,
+    )
+    # multiply-shift hashing, the products wrap around 2**64 on purpose
+    with np.errstate(over="ignore"):
+        permuted = (hashes[:, None] * _multipliers + _offsets) >> np.uint64(32)
+    return permuted.min(axis=0)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingles behind two signatures."""
+    return float(np.mean(a == b))
+
+
+def bands(signature: np.ndarray) -> list[bytes]:
+    return [band.tobytes() for band in np.split(signature, NUM_BANDS)]
+
+
+class NearDuplicateIndex:
+    def __init__(self, threshold: float = DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.signatures: dict[Hashable, np.ndarray] = {}
+        self.buckets: list[dict[bytes, list[Hashable]]] = [
+            {} for _ in range(NUM_BANDS)
+        ]
+
+    def add(self, key: Hashable, text: str, signature: Optional[np.ndarray] = None):
+        if signature is None:
+            signature = minhash(text)
+        self.signatures[key] = signature
+        for buckets, band in zip(self.buckets, bands(signature)):
+            buckets.setdefault(band, []).append(key)
+
+    def duplicates_of(
+        self, text: str, signature: Optional[np.ndarray] = None
+    ) -> list[Hashable]:
+        """Keys of the indexed texts near-identical to `text`, most similar first."""
+        if signature is None:
+            signature = minhash(text)
+        candidates = set()
+        for buckets, band in zip(self.buckets, bands(signature)):
+            candidates.update(buckets.get(band, []))
+        scored = [
+            (similarity(signature, self.signatures[key]), key) for key in candidates
+        ]
+        return [
+            key
+            for score, key in sorted(scored, key=lambda s: s[0], reverse=True)
+            if score >= self.threshold
+        ]
+
+
+def duplicate_clusters(
+    items: Iterable[tuple[Hashable, str]], threshold: float = DUPLICATE_THRESHOLD
+) -> dict[Hashable, Hashable]:
+    """
+    Group near-identical texts. Maps every key to the first key of its group,
+    in the order of `items`.
+    """
+    index = NearDuplicateIndex(threshold)
+    representatives = {}
+    for key, text in items:
+        signature = minhash(text)
+        duplicates = index.duplicates_of(text, signature)
+        representatives[key] = (
+            representatives[duplicates[0]] if duplicates else key
+        )
+        if not duplicates:
+            # only representatives are indexed, so groups can't chain
+            index.add(key, text, signature)
+    return representatives
+
+
+def stored_duplicates(
+    connection: sqlite3.Connection,
+    kind: str,
+    signature: np.ndarray,
+    threshold: float = DUPLICATE_THRESHOLD,
+) -> list[int]:
+    """
+    Keys of the stored group representatives of `kind` near-identical to
+    `signature`, most similar first.
+    """
+    candidates = set()
+    for band, bucket in enumerate(bands(signature)):
+        candidates.update(
+            row[0]
+            for row in connection.execute(
+                "SELECT key FROM lsh_buckets WHERE kind = ? AND band = ? AND bucket = ?",
+                (kind, band, bucket),
+            )
+        )
+    scored = []
+    for key in candidates:
+        row = connection.execute(
+            "SELECT signature FROM minhashes WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        score = similarity(signature, np.frombuffer(row[0], dtype=np.uint64))
+        if score >= threshold:
+            scored.append((score, key))
+    return [key for _, key in sorted(scored, key=lambda s: s[0], reverse=True)]
+
+
+def store_signature(
+    connection: sqlite3.Connection, kind: str, key: int, signature: np.ndarray
+) -> int:
+    """
+    Store the signature of a new row and put it in the group of its closest
+    near-duplicate, or in a new group. Returns the representative of its group.
+    """
+    duplicates = stored_duplicates(connection, kind, signature)
+    representative = duplicates[0] if duplicates else key
+    connection.execute(
+        "INSERT OR REPLACE INTO minhashes (kind, key, signature, representative) "
+        "VALUES (?, ?, ?, ?)",
+        (kind, key, signature.tobytes(), representative),
+    )
+    if representative == key:
+        # only representatives are in buckets, so groups can't chain
+        connection.executemany(
+            "INSERT INTO lsh_buckets (kind, band, bucket, key) VALUES (?, ?, ?, ?)",
+            [(kind, band, bucket, key) for band, bucket in enumerate(bands(signature))],
+        )
+    return representative
+
+
+def delete_signatures(connection: sqlite3.Connection, kind: str, keys: list[int]):
+    """Forget removed rows, regrouping the members of the groups they represented."""
+    if not keys:
+        return
+    connection.execute("CREATE TEMP TABLE IF NOT EXISTS removed_keys (key INTEGER)")
+    connection.executemany("INSERT INTO removed_keys VALUES (?)", [(k,) for k in keys])
+    orphans = connection.execute(
+        "SELECT key, signature FROM minhashes WHERE kind = ? "
+        "AND representative IN (SELECT key FROM removed_keys) "
+        "AND key NOT IN (SELECT key FROM removed_keys) ORDER BY key",
+        (kind,),
+    ).fetchall()
+    for table in ("minhashes", "lsh_buckets"):
+        connection.execute(
+            f"DELETE FROM {table} WHERE kind = ? "
+            "AND key IN (SELECT key FROM removed_keys)",
+            (kind,),
+        )
+    connection.execute("DELETE FROM removed_keys")
+    for key, signature in orphans:
+        store_signature(
+            connection, kind, key, np.frombuffer(signature, dtype=np.uint64)
+        )
+
+
+def stored_representatives(
+    connection: sqlite3.Connection, kind: str
+) -> dict[int, int]:
+    return dict(
+        connection.execute(
+            "SELECT key, representative FROM minhashes WHERE kind = ? ORDER BY key",
+            (kind,),
+        ).fetchall()
+    )
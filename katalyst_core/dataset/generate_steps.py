@@ -3,6 +3,7 @@ import openai
 import pandas as pd
 from bs4 import BeautifulSoup
 
+from katalyst_core.algorithms.cad_generation.utils import llm_base_url
 from katalyst_core.dataset.part import DatasetPart
 
 
@@ -40,6 +41,20 @@ def dataset_part_to_steps(index, example: DatasetPart):
     return low_level_steps, high_level_steps
 
 
+def part_to_step_rows(index, example: DatasetPart) -> list[dict]:
+    """
+    Same as `dataset_part_to_steps`, but with the low-level and high-level
+    steps as a single list of rows, and raising instead of returning None.
+    """
+    rows = []
+    for steps_text in _generate(example):
+        for step in _parse_steps(steps_text):
+            rows.append({**step, "parent_name": example.name, "parent_id": index})
+    if not rows:
+        raise ValueError("no steps in the LLM answer")
+    return rows
+
+
 def _parse_steps(steps_text):
     soup = BeautifulSoup(steps_text, "html.parser")
     steps = soup.find_all("step")
@@ -85,7 +100,7 @@ def _generate(entry: DatasetPart):
 
     client = openai.OpenAI(
         api_key=os.getenv("OPENROUTER_API_KEY"),
-        base_url="https://openrouter.ai/api/v1",
+        base_url=llm_base_url(),
         timeout=100,
     )
 
@@ -1,115 +1,435 @@
-from dataclasses import dataclass
+import sqlite3
+import threading
 from typing import Iterator, Optional
 import pandas as pd
+from loguru import logger
+from katalyst_core.dataset import dedup, store
 from katalyst_core.dataset.generate_steps import dataset_part_to_steps
 from katalyst_core.dataset.part import DatasetPart
-import math
 
 DATASET_DIR_PATH = "storage/dataset/"
-DATASET_PATH = "storage/dataset/dataset.csv"
-DATASET_STEPS_PATH = "storage/dataset/steps.csv"
 FILES_PATH = "storage/dataset/files/"
 
 
-@dataclass
 class DatasetStep:
-    code_before: str
-    request: str
-    edits: str
-    parent_id: int
+    """Step of the steps dataset, its `code_before` is only loaded when accessed."""
 
+    __slots__ = ("id", "request", "edits", "parent_id", "_code_before")
 
-def dataframe_to_dataset_part(row: pd.Series) -> DatasetPart:
-    files = []
-    if isinstance(row["files"], str) and row["files"]:
-        files = row["files"].split(";")
+    def __init__(self, id: int, request: str, edits: str, parent_id: int):
+        self.id = id
+        self.request = request
+        self.edits = edits
+        self.parent_id = parent_id
+        self._code_before: Optional[str] = None
 
+    @property
+    def code_before(self) -> str:
+        if self._code_before is None:
+            row = (
+                store.connect()
+                .execute("SELECT code_before FROM steps WHERE id = ?", (self.id,))
+                .fetchone()
+            )
+            self._code_before = row["code_before"] if row is not None else ""
+        return self._code_before
+
+
+class DatasetPartRow:
+    """
+    Part of the dataset with only the columns needed to rank it, its `code` is
+    only loaded when accessed.
+    """
+
+    __slots__ = ("id", "name", "description", "backend", "_code")
+
+    def __init__(self, id: int, name: str, description: str, backend: str):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.backend = backend
+        self._code: Optional[str] = None
+
+    @property
+    def code(self) -> str:
+        if self._code is None:
+            row = (
+                store.connect()
+                .execute("SELECT code FROM parts WHERE id = ?", (self.id,))
+                .fetchone()
+            )
+            self._code = row["code"] if row is not None else ""
+        return self._code
+
+
+def _row_to_dataset_part(row: sqlite3.Row) -> DatasetPart:
     return DatasetPart(
         row["id"],
         row["name"],
         row["description"],
         row["code"],
         row["backend"],
-        files,
+        row["files"].split(";") if row["files"] else [],
         row["author"],
         row["created_at"],
-        None if math.isnan(float(row["program_id"])) else int(row["program_id"]),
+        None if row["program_id"] is None else int(row["program_id"]),
+    )
+
+
+def _part_values(part: DatasetPart) -> tuple:
+    return (
+        part.name,
+        part.description,
+        part.code,
+        part.backend,
+        ";".join(part.files),
+        part.author,
+        str(part.created_at) if part.created_at is not None else None,
+        part.program_id,
     )
 
 
+def _backends_filter(only_backends: Optional[list[str]]) -> tuple[str, list[str]]:
+    if not only_backends:
+        return "", []
+    return f"WHERE backend IN ({', '.join('?' * len(only_backends))})", only_backends
+
+
 def read_dataset(only_backends: Optional[list[str]] = None) -> Iterator[DatasetPart]:
-    df = pd.read_csv(DATASET_PATH)
+    where, args = _backends_filter(only_backends)
+    rows = store.connect().execute(f"SELECT * FROM parts {where} ORDER BY id", args)
+    for row in rows:
+        yield _row_to_dataset_part(row)
+
+
+def read_dataset_rows(
+    only_backends: Optional[list[str]] = None,
+) -> Iterator[DatasetPartRow]:
+    parts_by_backend, _ = _cached_partitions()
+    for backend in only_backends or list(parts_by_backend):
+        yield from parts_by_backend.get(backend, [])
+
+
+# rows used by retrieval, partitioned by backend, for the dataset version they
+# were loaded at. Writes bump the version, be they from this process or not.
+_cache_lock = threading.Lock()
+_cache_version: Optional[int] = None
+_cached_parts: dict[str, list[DatasetPartRow]] = {}
+_cached_steps: dict[str, list[DatasetStep]] = {}
+
 
-    if only_backends:
-        df = df[df["backend"].isin(only_backends)]
+def _cached_partitions() -> tuple[dict, dict]:
+    global _cache_version, _cached_parts, _cached_steps
+    version = store.version()
+    with _cache_lock:
+        if version == _cache_version:
+            return _cached_parts, _cached_steps
 
-    for _, row in df.iterrows():
-        yield dataframe_to_dataset_part(row)
+        connection = store.connect()
+        parts: dict[str, list[DatasetPartRow]] = {}
+        # parts that failed to execute on the last precompute run are left out
+        for row in connection.execute(
+            "SELECT id, name, description, backend FROM parts "
+            "LEFT JOIN part_artifacts ON part_artifacts.part_id = parts.id "
+            "WHERE part_artifacts.success IS NOT 0 ORDER BY id"
+        ):
+            parts.setdefault(row["backend"], []).append(
+                DatasetPartRow(
+                    row["id"], row["name"], row["description"], row["backend"]
+                )
+            )
+        steps: dict[str, list[DatasetStep]] = {}
+        for row in connection.execute(
+            "SELECT steps.id, steps.request, steps.edits, steps.parent_id, "
+            "parts.backend FROM steps JOIN parts ON steps.parent_id = parts.id "
+            "ORDER BY steps.id"
+        ):
+            steps.setdefault(row["backend"], []).append(
+                DatasetStep(row["id"], row["request"], row["edits"], row["parent_id"])
+            )
+
+        _cache_version, _cached_parts, _cached_steps = version, parts, steps
+        return parts, steps
+
+
+# near-duplicate groups, for the dataset version they were read at
+_cached_representatives: dict[str, tuple[int, dict[int, int]]] = {}
+
+# rows whose signatures aren't stored yet (imported, or older databases)
+_MISSING_SIGNATURES = {
+    "parts": "SELECT id, description, code FROM parts "
+    "WHERE id NOT IN (SELECT key FROM minhashes WHERE kind = 'parts') ORDER BY id",
+    "steps": "SELECT id, code_before, request FROM steps "
+    "WHERE id NOT IN (SELECT key FROM minhashes WHERE kind = 'steps') ORDER BY id",
+}
+
+
+def _store_missing_signatures(kind: str):
+    text = part_text if kind == "parts" else step_text
+    query = _MISSING_SIGNATURES[kind]
+    if store.connect().execute(query + " LIMIT 1").fetchone() is None:
+        return
+    # groups are stored along the dataset, not a change of what is read from it
+    with store.transaction(bump_version=False) as connection:
+        rows = connection.execute(query).fetchall()
+        for row in rows:
+            dedup.store_signature(
+                connection, kind, row[0], dedup.minhash(text(row[1], row[2]))
+            )
+    logger.info(f"Stored the near-duplicate signatures of {len(rows)} {kind}")
+
+
+def _representatives(kind: str) -> dict[int, int]:
+    version = store.version()
+    with _cache_lock:
+        cached = _cached_representatives.get(kind)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        _store_missing_signatures(kind)
+        representatives = dedup.stored_representatives(store.connect(), kind)
+        _cached_representatives[kind] = (version, representatives)
+        return representatives
+
+
+def part_representatives() -> dict[int, int]:
+    """Maps the id of every part to the first part of its group of near-duplicates."""
+    return _representatives("parts")
+
+
+def step_representatives() -> dict[int, int]:
+    """Maps the id of every step to the first step of its group of near-duplicates."""
+    return _representatives("steps")
+
+
+def get_part(part_id: int) -> Optional[DatasetPart]:
+    row = (
+        store.connect()
+        .execute("SELECT * FROM parts WHERE id = ?", (part_id,))
+        .fetchone()
+    )
+    return _row_to_dataset_part(row) if row is not None else None
 
 
 def get_authors() -> list[str]:
-    df = pd.read_csv(DATASET_PATH)
-    return df["author"].unique().tolist()
+    rows = store.connect().execute(
+        "SELECT author FROM parts GROUP BY author ORDER BY MIN(id)"
+    )
+    return [row["author"] for row in rows]
 
 
 def get_parts_by_author(author: str) -> list[DatasetPart]:
-    df = pd.read_csv(DATASET_PATH)
-    author_df = df[df["author"] == author]
-    return [dataframe_to_dataset_part(row) for _, row in author_df.iterrows()]
+    rows = store.connect().execute(
+        "SELECT * FROM parts WHERE author = ? ORDER BY id", (author,)
+    )
+    return [_row_to_dataset_part(row) for row in rows]
 
 
-def add_part(part: DatasetPart):
-    df = pd.read_csv(DATASET_PATH)
-    part_dict = vars(part)
-    part_dict["files"] = ";".join(part.files)
-    part_dict["id"] = df["id"].max() + 1 if not df.empty else 1
-    new_row = pd.DataFrame([part_dict])
-    df = pd.concat([df, new_row], ignore_index=True)
-    df.to_csv(DATASET_PATH, index=False)
+def part_text(description: str, code: str) -> str:
+    """What two parts are compared on to tell if they are near-duplicates."""
+    return f"{description}\n{code}"
+
+
+def step_text(code_before: str, request: str) -> str:
+    return f"{code_before}\n{request}"
+
+
+def part_signature(part: DatasetPart):
+    return dedup.minhash(part_text(part.description, part.code))
+
+
+def step_signatures(rows: list[dict]) -> list:
+    return [dedup.minhash(step_text(row["code_before"], row["request"])) for row in rows]
+
+
+def find_duplicate_parts(part: DatasetPart, signature=None) -> list[int]:
+    """
+    Ids of the parts of the same backend near-identical to `part`, among the
+    stored representatives of the groups of near-duplicates.
+    """
+    _store_missing_signatures("parts")
+    if signature is None:
+        signature = part_signature(part)
+    connection = store.connect()
+    duplicates = [
+        part_id
+        for part_id in dedup.stored_duplicates(connection, "parts", signature)
+        if part_id != part.id
+    ]
+    if not duplicates:
+        return []
+    backends = dict(
+        connection.execute(
+            f"SELECT id, backend FROM parts WHERE id IN ({', '.join('?' * len(duplicates))})",
+            duplicates,
+        ).fetchall()
+    )
+    return [part_id for part_id in duplicates if backends.get(part_id) == part.backend]
+
+
+def collapse_duplicate_steps(rows: list[dict]) -> list[dict]:
+    """Keep the first of every group of near-identical steps."""
+    representatives = dedup.duplicate_clusters(
+        (i, step_text(row["code_before"], row["request"])) for i, row in enumerate(rows)
+    )
+    return [row for i, row in enumerate(rows) if representatives[i] == i]
+
+
+def add_part(part: DatasetPart, skip_duplicate: bool = False) -> int:
+    """
+    Add a part and return its id. Near-duplicates of existing parts are logged,
+    or not added if `skip_duplicate`, in which case the id of the existing part
+    is returned.
+    """
+    signature = part_signature(part)
+    duplicates = find_duplicate_parts(part, signature)
+    if duplicates:
+        logger.warning(f"Part {part.name} is a near-duplicate of parts {duplicates}")
+        if skip_duplicate:
+            return duplicates[0]
+
+    with store.transaction() as connection:
+        cursor = connection.execute(
+            "INSERT INTO parts (name, description, code, backend, files, author, "
+            "created_at, program_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            _part_values(part),
+        )
+        dedup.store_signature(connection, "parts", cursor.lastrowid, signature)
+    part.id = cursor.lastrowid
+    return part.id
 
 
 def delete_part(part_id: int):
-    df = pd.read_csv(DATASET_PATH)
-    df = df[df["id"] != part_id]
-    df.to_csv(DATASET_PATH, index=False)
+    with store.transaction() as connection:
+        connection.execute("DELETE FROM parts WHERE id = ?", (part_id,))
+        connection.execute("DELETE FROM part_artifacts WHERE part_id = ?", (part_id,))
+        dedup.delete_signatures(connection, "parts", [part_id])
 
 
 def edit_part(part_id: int, new_part: DatasetPart):
-    df = pd.read_csv(DATASET_PATH)
-    df = df[df["id"] != part_id]
-    new_part_dict = vars(new_part)
-    new_part_dict["files"] = ";".join(new_part.files)
-    new_part_dict["id"] = part_id
-    new_row = pd.DataFrame([new_part_dict])
-    df = pd.concat([df, new_row], ignore_index=True)
-    df.to_csv(DATASET_PATH, index=False)
+    signature = part_signature(new_part)
+    with store.transaction() as connection:
+        dedup.delete_signatures(connection, "parts", [part_id])
+        dedup.store_signature(connection, "parts", part_id, signature)
+        connection.execute(
+            "UPDATE parts SET name = ?, description = ?, code = ?, backend = ?, "
+            "files = ?, author = ?, created_at = ?, program_id = ? WHERE id = ?",
+            (*_part_values(new_part), part_id),
+        )
+        # executed again by the next precompute run
+        connection.execute("DELETE FROM part_artifacts WHERE part_id = ?", (part_id,))
+
+
+def dataset_version() -> str:
+    """Changes whenever the dataset is written, cheap enough to check on every lookup."""
+    return f"db-{store.database_id()}-{store.version()}"
 
 
 def read_steps_dataset(
     only_backends: Optional[list[str]] = None,
 ) -> Iterator[DatasetStep]:
-    steps_df = pd.read_csv(DATASET_STEPS_PATH)
-    parts_df = pd.read_csv(DATASET_PATH)
+    _, steps_by_backend = _cached_partitions()
+    for backend in only_backends or list(steps_by_backend):
+        yield from steps_by_backend.get(backend, [])
+
 
-    if only_backends:
-        parts_df = parts_df[parts_df["backend"].isin(only_backends)]
+def add_steps_from_part(index: int, part: DatasetPart):
+    steps_dfs = [df for df in dataset_part_to_steps(index, part) if df is not None]
+    if not steps_dfs:
+        return
+    steps_df = pd.concat(steps_dfs, ignore_index=True)
+    # the low-level and high-level steps often start the same way
+    rows = collapse_duplicate_steps(steps_df.to_dict("records"))
+    signatures = step_signatures(rows)
+    with store.transaction() as connection:
+        insert_steps(connection, rows, signatures)
 
-    merged_df = pd.merge(steps_df, parts_df[["id"]], left_on="parent_id", right_on="id")
 
-    for _, row in merged_df.iterrows():
-        yield DatasetStep(
-            row["code_before"], row["request"], row["edits"], row["parent_id"]
+def insert_steps(connection: sqlite3.Connection, rows: list[dict], signatures: list):
+    """Insert steps and their signatures (see `step_signatures`), in a transaction."""
+    values = store.dataframe_rows(
+        pd.DataFrame(rows, columns=store.STEP_COLUMNS), store.STEP_COLUMNS
+    )
+    for row_values, signature in zip(values, signatures):
+        cursor = connection.execute(
+            f"INSERT INTO steps ({', '.join(store.STEP_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(store.STEP_COLUMNS))})",
+            row_values,
         )
+        dedup.store_signature(connection, "steps", cursor.lastrowid, signature)
 
 
-def add_steps_from_part(index: int, part: DatasetPart):
-    df1, df2 = dataset_part_to_steps(index, part)
-    existing_steps_df = pd.read_csv(DATASET_STEPS_PATH)
-    steps_df = pd.concat([existing_steps_df, df1, df2], ignore_index=True)
-    steps_df.to_csv(DATASET_STEPS_PATH, index=False)
+def delete_steps_of_parts(connection: sqlite3.Connection, part_ids: list[int]):
+    """Delete the steps of parts and their signatures, in a transaction."""
+    step_ids = [
+        row[0]
+        for part_id in part_ids
+        for row in connection.execute(
+            "SELECT id FROM steps WHERE parent_id = ?", (part_id,)
+        )
+    ]
+    dedup.delete_signatures(connection, "steps", step_ids)
+    connection.executemany(
+        "DELETE FROM steps WHERE parent_id = ?", [(part_id,) for part_id in part_ids]
+    )
+    connection.executemany(
+        "DELETE FROM step_sources WHERE part_id = ?", [(part_id,) for part_id in part_ids]
+    )
+
+
+def step_sources() -> dict[int, str]:
+    """Hash of what the stored steps of each part were generated from, see `replace_steps_of_parts`."""
+    return dict(
+        store.connect().execute("SELECT part_id, hash FROM step_sources").fetchall()
+    )
+
+
+def replace_steps_of_parts(
+    rows: list[dict], sources: dict[int, str], skip_duplicates: bool = True
+) -> int:
+    """
+    Replace the steps of the parts in `sources` by `rows`, in one transaction,
+    and record the hash of what they were generated from. With
+    `skip_duplicates`, only the first of every group of near-identical steps is
+    kept, including the stored steps of other parts. Returns the number of
+    steps inserted.
+    """
+    if skip_duplicates:
+        rows = collapse_duplicate_steps(rows)
+    signatures = step_signatures(rows)
+    _store_missing_signatures("steps")
+    with store.transaction() as connection:
+        delete_steps_of_parts(connection, list(sources))
+        if skip_duplicates:
+            kept = [
+                i
+                for i, signature in enumerate(signatures)
+                if not dedup.stored_duplicates(connection, "steps", signature)
+            ]
+            rows = [rows[i] for i in kept]
+            signatures = [signatures[i] for i in kept]
+        insert_steps(connection, rows, signatures)
+        connection.executemany(
+            "INSERT OR REPLACE INTO step_sources (part_id, hash) VALUES (?, ?)",
+            list(sources.items()),
+        )
+    return len(rows)
+
+
+def delete_duplicate_steps() -> int:
+    """Delete every stored step that is a near-duplicate of an earlier one."""
+    duplicates = [
+        (step_id,)
+        for step_id, representative in step_representatives().items()
+        if step_id != representative
+    ]
+    with store.transaction() as connection:
+        connection.executemany("DELETE FROM steps WHERE id = ?", duplicates)
+        dedup.delete_signatures(
+            connection, "steps", [step_id for step_id, in duplicates]
+        )
+    return len(duplicates)
 
 
 def delete_steps_from_part(index: int):
-    df = pd.read_csv(DATASET_STEPS_PATH)
-    df = df[df["parent_id"] != index]
-    df.to_csv(DATASET_STEPS_PATH, index=False)
+    with store.transaction() as connection:
+        delete_steps_of_parts(connection, [index])
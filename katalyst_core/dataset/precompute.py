@@ -0,0 +1,196 @@
+"""
+Execution of every dataset part ahead of time.
+
+Each part is run through the executor like a generated program. Its program
+(STL and thumbnail), pass/fail status, duration and mesh metrics are stored in
+the `part_artifacts` table, as soon as it finishes so that an interrupted run
+resumes where it stopped. Parts are executed again when edited, or when the
+installed cadquery version changes. Parts that fail are left out of the
+retrieved examples, the STLs of the others feed the shape index.
+"""
+
+import concurrent.futures
+import importlib.metadata
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from loguru import logger
+
+from katalyst_core.dataset import store
+from katalyst_core.dataset.manage_parts import read_dataset
+from katalyst_core.dataset.part import DatasetPart
+from katalyst_core.dataset.shape_index import build_shape_index
+from katalyst_core.programs.errors import error_signature
+from katalyst_core.programs.executor import execute_first_time
+from katalyst_core.programs.geometry import stl_metrics
+from katalyst_core.programs.storage import (
+    program_delete,
+    program_stl_path,
+    program_thumbnail_path,
+)
+
+MAX_WORKERS = 4
+# parts slower than this are reported, they slow down examples built on them
+SLOW_EXECUTION_SEC = 10
+
+
+@dataclass
+class PartArtifact:
+    part_id: int
+    cadquery_version: str
+    success: bool
+    program_id: Optional[str]
+    output: str
+    duration: float
+    metrics: Optional[dict]
+    checked_at: float
+
+    @property
+    def stl_path(self) -> Optional[str]:
+        return program_stl_path(self.program_id) if self.program_id else None
+
+    @property
+    def thumbnail_path(self) -> Optional[str]:
+        if self.program_id is None:
+            return None
+        path = program_thumbnail_path(self.program_id)
+        return path if os.path.exists(path) else None
+
+
+def cadquery_version() -> str:
+    try:
+        return importlib.metadata.version("cadquery")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def _row_to_artifact(row) -> PartArtifact:
+    return PartArtifact(
+        row["part_id"],
+        row["cadquery_version"],
+        bool(row["success"]),
+        row["program_id"],
+        row["output"],
+        row["duration"],
+        json.loads(row["metrics"]) if row["metrics"] else None,
+        row["checked_at"],
+    )
+
+
+def part_artifact(part_id: int) -> Optional[PartArtifact]:
+    row = (
+        store.connect()
+        .execute("SELECT * FROM part_artifacts WHERE part_id = ?", (part_id,))
+        .fetchone()
+    )
+    return _row_to_artifact(row) if row is not None else None
+
+
+def read_artifacts() -> list[PartArtifact]:
+    rows = store.connect().execute("SELECT * FROM part_artifacts ORDER BY part_id")
+    return [_row_to_artifact(row) for row in rows]
+
+
+def _execute_part(part: DatasetPart, version: str) -> PartArtifact:
+    start = time.perf_counter()
+    try:
+        program_id, output, success = execute_first_time(part.code)
+    except Exception as e:
+        program_id, output, success = None, str(e), False
+    duration = time.perf_counter() - start
+
+    metrics = None
+    if success:
+        mesh_metrics = stl_metrics(program_stl_path(program_id))
+        metrics = asdict(mesh_metrics) if mesh_metrics is not None else None
+
+    return PartArtifact(
+        part.id, version, success, program_id, output, duration, metrics, time.time()
+    )
+
+
+def _save_artifact(artifact: PartArtifact):
+    previous = part_artifact(artifact.part_id)
+    # progress is not a change of the dataset, the version is bumped once at the end
+    with store.transaction(bump_version=False) as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO part_artifacts (part_id, cadquery_version, "
+            "success, program_id, output, duration, metrics, checked_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                artifact.part_id,
+                artifact.cadquery_version,
+                int(artifact.success),
+                artifact.program_id,
+                artifact.output,
+                artifact.duration,
+                json.dumps(artifact.metrics) if artifact.metrics else None,
+                artifact.checked_at,
+            ),
+        )
+    if previous is not None and previous.program_id not in (None, artifact.program_id):
+        program_delete(previous.program_id)
+
+
+def precompute_parts(max_workers: int = MAX_WORKERS, force: bool = False) -> dict:
+    """
+    Execute the parts that were never executed, were edited since, or were
+    executed with another cadquery version (all of them if `force`).
+    """
+    version = cadquery_version()
+    checked = {
+        row["part_id"]
+        for row in store.connect().execute(
+            "SELECT part_id FROM part_artifacts WHERE cadquery_version = ?",
+            (version,),
+        )
+    }
+    todo = [part for part in read_dataset() if force or part.id not in checked]
+    logger.info(
+        f"Executing {len(todo)} dataset parts with cadquery {version}, "
+        f"{len(checked)} are up to date"
+    )
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_execute_part, part, version) for part in todo]
+            for done, future in enumerate(
+                concurrent.futures.as_completed(futures), 1
+            ):
+                artifact = future.result()
+                _save_artifact(artifact)
+                logger.info(
+                    f"Part {artifact.part_id} {'ok' if artifact.success else 'broken'} "
+                    f"in {artifact.duration:.1f}s ({done}/{len(todo)})"
+                )
+    finally:
+        if todo:
+            # retrieval leaves broken parts out, let its caches reload, even
+            # after an interrupted run that stored some of them
+            store.bump_version()
+
+    if todo:
+        build_shape_index()
+
+    return precompute_report()
+
+
+def precompute_report() -> dict:
+    """Broken and slow parts, according to their last execution."""
+    artifacts = read_artifacts()
+    broken = [a for a in artifacts if not a.success]
+    slow = [a for a in artifacts if a.success and a.duration >= SLOW_EXECUTION_SEC]
+    return {
+        "executed": len(artifacts),
+        "broken": [
+            {"part_id": a.part_id, "error": error_signature(a.output or "")}
+            for a in broken
+        ],
+        "slow": [
+            {"part_id": a.part_id, "duration": round(a.duration, 1)}
+            for a in sorted(slow, key=lambda a: a.duration, reverse=True)
+        ],
+    }
@@ -0,0 +1,198 @@
+"""
+Geometric retrieval of dataset parts from an STL file.
+
+Every part whose precomputed execution succeeded is described by the D2 shape
+distribution of its mesh (histogram of distances between random surface
+points, scaled by their mean so that size doesn't matter) along with its
+principal axes ratios. Finding the parts closest to an uploaded STL is then a
+vectorized L1 distance, no rendering or LLM call needed.
+"""
+
+import os
+import threading
+import zipfile
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+from katalyst_core.dataset import store
+from katalyst_core.files import atomic_write
+from katalyst_core.programs.storage import program_stl_path
+
+SHAPE_INDEX_PATH = "storage/dataset/shape-index.npz"
+
+D2_BINS = 32
+# distances are divided by their mean, so nearly all of them fall below 3
+D2_RANGE = (0.0, 3.0)
+SAMPLE_POINTS = 1024
+SAMPLE_PAIRS = 4096
+# weight of the 4 principal axes ratios against the D2 histogram (L1 norm up to 2)
+RATIOS_WEIGHT = 0.5
+
+
+def _read_triangles(stl_path: str) -> np.ndarray:
+    """Triangles of an ASCII or binary STL file, as an (n, 3, 3) array."""
+    with open(stl_path, "rb") as f:
+        data = f.read()
+
+    if len(data) >= 84:
+        count = int.from_bytes(data[80:84], "little")
+        if len(data) == 84 + count * 50:
+            records = np.frombuffer(
+                data,
+                dtype=np.dtype(
+                    [("normal", "<f4", 3), ("vertices", "<f4", (3, 3)), ("attr", "<u2")]
+                ),
+                count=count,
+                offset=84,
+            )
+            return records["vertices"].astype(np.float64)
+
+    vertices = [
+        line.split()[1:4]
+        for line in data.decode(errors="ignore").split("\n")
+        if line.strip().startswith("vertex")
+    ]
+    return np.array(vertices, dtype=np.float64).reshape(-1, 3, 3)
+
+
+def shape_descriptor(stl_path: str) -> Optional[np.ndarray]:
+    """Scale invariant descriptor of a mesh, or None if it is empty or unreadable."""
+    try:
+        triangles = _read_triangles(stl_path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Couldn't read {stl_path}: {e}")
+        return None
+    if len(triangles) == 0:
+        return None
+
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    areas = np.linalg.norm(np.cross(b - a, c - a), axis=1) / 2
+    if areas.sum() <= 0:
+        return None
+
+    # uniform points on the surface, seeded so that a mesh always gets the same descriptor
+    random = np.random.default_rng(0)
+    faces = random.choice(len(triangles), SAMPLE_POINTS, p=areas / areas.sum())
+    r1 = np.sqrt(random.random((SAMPLE_POINTS, 1)))
+    r2 = random.random((SAMPLE_POINTS, 1))
+    points = (1 - r1) * a[faces] + r1 * (1 - r2) * b[faces] + r1 * r2 * c[faces]
+
+    i, j = random.integers(0, SAMPLE_POINTS, (2, SAMPLE_PAIRS))
+    distances = np.linalg.norm(points[i] - points[j], axis=1)
+    if distances.mean() <= 0:
+        return None
+    histogram, _ = np.histogram(distances / distances.mean(), D2_BINS, D2_RANGE)
+    histogram = histogram / SAMPLE_PAIRS
+
+    centered = points - points.mean(axis=0)
+    eigenvalues, eigenvectors = np.linalg.eigh(np.cov(centered.T))
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues = np.maximum(eigenvalues[order], 0)
+    extents = np.ptp(centered @ eigenvectors[:, order], axis=0)
+    ratios = np.concatenate(
+        [
+            np.sqrt(eigenvalues[1:] / max(eigenvalues[0], 1e-12)),
+            extents[1:] / max(extents[0], 1e-12),
+        ]
+    )
+
+    return np.concatenate([histogram, RATIOS_WEIGHT * ratios]).astype(np.float32)
+
+
+def build_shape_index(index_path: str = SHAPE_INDEX_PATH) -> int:
+    """
+    Describe the STL of every successfully precomputed part, reusing the
+    descriptors of the programs already in the index. Returns the index size.
+    """
+    rows = store.connect().execute(
+        "SELECT parts.id, parts.backend, part_artifacts.program_id FROM parts "
+        "JOIN part_artifacts ON part_artifacts.part_id = parts.id "
+        "WHERE part_artifacts.success = 1 ORDER BY parts.id"
+    )
+
+    previous = {}
+    if os.path.exists(index_path):
+        with np.load(index_path) as index:
+            previous = dict(zip(index["program_ids"], index["descriptors"]))
+
+    part_ids, backends, program_ids, descriptors = [], [], [], []
+    for part_id, backend, program_id in rows:
+        descriptor = previous.get(program_id)
+        if descriptor is None:
+            descriptor = shape_descriptor(program_stl_path(program_id))
+        if descriptor is None:
+            continue
+        part_ids.append(part_id)
+        backends.append(backend)
+        program_ids.append(program_id)
+        descriptors.append(descriptor)
+
+    # find_similar_parts reloads the index when it changes, possibly in the middle of this write
+    with atomic_write(index_path, "wb") as f:
+        np.savez(
+            f,
+            part_ids=np.array(part_ids, dtype=np.int64),
+            backends=np.array(backends, dtype=str),
+            program_ids=np.array(program_ids, dtype=str),
+            descriptors=np.array(descriptors, dtype=np.float32).reshape(
+                len(descriptors), -1
+            ),
+        )
+    logger.info(f"Shape index of {len(part_ids)} parts written to {index_path}")
+    return len(part_ids)
+
+
+_index_lock = threading.Lock()
+_index: Optional[dict] = None
+_index_mtime: Optional[float] = None
+
+
+def _load_index(index_path: str) -> Optional[dict]:
+    global _index, _index_mtime
+    if not os.path.exists(index_path):
+        return None
+    mtime = os.path.getmtime(index_path)
+    with _index_lock:
+        if _index is None or mtime != _index_mtime:
+            try:
+                with np.load(index_path) as index:
+                    _index = {key: index[key] for key in index.files}
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                # keep the previous index, the file is read again on the next call
+                logger.warning(f"Couldn't load the shape index {index_path}: {e}")
+                return _index
+            _index_mtime = mtime
+        return _index
+
+
+def find_similar_parts(
+    stl_path: str,
+    k: int = 5,
+    only_backends: Optional[list[str]] = None,
+    index_path: str = SHAPE_INDEX_PATH,
+) -> list[tuple[int, float]]:
+    """Ids of the `k` dataset parts closest in shape to an STL, with their distances."""
+    index = _load_index(index_path)
+    if index is None or len(index["part_ids"]) == 0:
+        logger.warning(
+            f"No shape index at {index_path}, run scripts/precompute_dataset.py"
+        )
+        return []
+
+    descriptor = shape_descriptor(stl_path)
+    if descriptor is None:
+        return []
+
+    distances = np.abs(index["descriptors"] - descriptor).sum(axis=1)
+    if only_backends:
+        distances = np.where(
+            np.isin(index["backends"], only_backends), distances, np.inf
+        )
+    nearest = np.argsort(distances)[:k]
+    return [
+        (int(index["part_ids"][i]), float(distances[i]))
+        for i in nearest
+        if np.isfinite(distances[i])
+    ]
@@ -0,0 +1,153 @@
+"""
+Bulk generation of the steps dataset.
+
+Parts are processed concurrently, and every finished part is appended to a
+journal along with the hash of what its steps were generated from. A run
+skips the parts already journaled with the same hash, so an interrupted job
+resumes where it stopped, and a part is only regenerated once it is edited.
+At the end of the run, the journaled steps not in the store yet (generated by
+this run, or by an interrupted one) are written to it in a single transaction.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+from katalyst_core.dataset.generate_steps import part_to_step_rows
+from katalyst_core.dataset.manage_parts import (
+    read_dataset,
+    replace_steps_of_parts,
+    step_sources,
+)
+from katalyst_core.dataset.part import DatasetPart
+
+STEPS_JOURNAL_PATH = "storage/dataset/steps-journal.jsonl"
+
+MAX_WORKERS = 4
+MAX_ATTEMPTS = 3
+RETRY_DELAY_SEC = 5
+
+
+def part_hash(part: DatasetPart) -> str:
+    """Hash of what the steps of a part are generated from."""
+    return hashlib.sha256(
+        f"{part.name}\n{part.description}\n{part.code}".encode()
+    ).hexdigest()
+
+
+def read_journal(journal_path: str = STEPS_JOURNAL_PATH) -> dict[int, dict]:
+    """Latest journal entry of every part."""
+    entries = {}
+    if not os.path.exists(journal_path):
+        return entries
+    with open(journal_path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # line cut by a crash
+                continue
+            entries[entry["part_id"]] = entry
+    return entries
+
+
+def _generate_with_retries(part: DatasetPart, max_attempts: int) -> Optional[list[dict]]:
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return part_to_step_rows(part.id, part)
+        except Exception as e:
+            logger.warning(
+                f"Steps generation failed for part {part.id} ({attempt}/{max_attempts}): {e}"
+            )
+            if attempt < max_attempts:
+                time.sleep(RETRY_DELAY_SEC * 2 ** (attempt - 1))
+    return None
+
+
+def generate_all_steps(
+    max_workers: int = MAX_WORKERS,
+    max_attempts: int = MAX_ATTEMPTS,
+    journal_path: str = STEPS_JOURNAL_PATH,
+    collapse_duplicates: bool = True,
+) -> dict[str, int]:
+    """
+    Generate the steps of every part whose journaled steps are missing or
+    outdated, then replace in the store the steps of the parts whose journaled
+    steps aren't there yet, keeping one step of every group of near-duplicates
+    if `collapse_duplicates`.
+    """
+    parts = list(read_dataset())
+    journal = read_journal(journal_path)
+    hashes = {part.id: part_hash(part) for part in parts}
+    todo = [
+        part
+        for part in parts
+        if journal.get(part.id, {}).get("hash") != hashes[part.id]
+    ]
+    logger.info(
+        f"Generating steps for {len(todo)} parts, {len(parts) - len(todo)} are up to date"
+    )
+
+    journal_lock = threading.Lock()
+    generated = 0
+    failed = 0
+
+    def process(part: DatasetPart):
+        nonlocal generated, failed
+        rows = _generate_with_retries(part, max_attempts)
+        with journal_lock:
+            if rows is None:
+                failed += 1
+                return
+            entry = {"part_id": part.id, "hash": hashes[part.id], "steps": rows}
+            journal[part.id] = entry
+            with open(journal_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            generated += 1
+            logger.info(
+                f"Steps generated for part {part.id} ({generated + failed}/{len(todo)})"
+            )
+
+    os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in concurrent.futures.as_completed(
+            [executor.submit(process, part) for part in todo]
+        ):
+            future.result()
+
+    # journaled parts still in the dataset and unchanged since, whose stored
+    # steps come from another version or from nothing
+    stored = step_sources()
+    unwritten = [
+        entry
+        for part_id, entry in journal.items()
+        if hashes.get(part_id) == entry["hash"] and stored.get(part_id) != entry["hash"]
+    ]
+    rows = [row for entry in unwritten for row in entry["steps"]]
+    inserted = 0
+    if unwritten:
+        inserted = replace_steps_of_parts(
+            rows,
+            {entry["part_id"]: entry["hash"] for entry in unwritten},
+            skip_duplicates=collapse_duplicates,
+        )
+    logger.info(
+        f"Wrote {inserted} steps of {len(unwritten)} parts to the store, "
+        f"{len(rows) - inserted} near-duplicates collapsed"
+    )
+
+    return {
+        "generated": generated,
+        "failed": failed,
+        "skipped": len(parts) - len(todo),
+        "steps": inserted,
+        "duplicates": len(rows) - inserted,
+    }
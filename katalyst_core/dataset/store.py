@@ -0,0 +1,284 @@
+"""
+SQLite storage of the dataset, in WAL mode so that readers never block the
+single writer and concurrent writers are serialized instead of losing data.
+
+The CSV files stay the public exchange format: the database is created from
+them on first use, and can be re-imported from or exported to them with
+`python katalyst_core/scripts/dataset_csv.py import|export`.
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+from typing import Iterator
+
+import pandas as pd
+from loguru import logger
+
+DATASET_DB_PATH = "storage/dataset/dataset.sqlite"
+DATASET_CSV_PATH = "storage/dataset/dataset.csv"
+STEPS_CSV_PATH = "storage/dataset/steps.csv"
+
+PART_COLUMNS = [
+    "id",
+    "name",
+    "description",
+    "code",
+    "backend",
+    "files",
+    "author",
+    "created_at",
+    "program_id",
+]
+STEP_COLUMNS = ["step_id", "code_before", "request", "edits", "parent_name", "parent_id"]
+
+# steps are referenced by id (lazy loading, near-duplicates, retrieval indexes),
+# AUTOINCREMENT so that ids of deleted steps are never given to new ones
+STEPS_TABLE = """CREATE TABLE IF NOT EXISTS steps (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    step_id INTEGER,
+    code_before TEXT,
+    request TEXT,
+    edits TEXT,
+    parent_name TEXT,
+    parent_id INTEGER
+)"""
+STEPS_INDEX = "CREATE INDEX IF NOT EXISTS steps_parent_id ON steps (parent_id)"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS parts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    description TEXT,
+    code TEXT,
+    backend TEXT,
+    files TEXT,
+    author TEXT,
+    created_at TEXT,
+    program_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS parts_author ON parts (author);
+CREATE INDEX IF NOT EXISTS parts_backend ON parts (backend);
+
+{STEPS_TABLE};
+{STEPS_INDEX};
+
+-- outcome of executing the parts, see `precompute.py`
+CREATE TABLE IF NOT EXISTS part_artifacts (
+    part_id INTEGER PRIMARY KEY,
+    cadquery_version TEXT,
+    success INTEGER,
+    program_id TEXT,
+    output TEXT,
+    duration REAL,
+    metrics TEXT,
+    checked_at REAL
+);
+
+-- MinHash signatures and near-duplicate groups of parts and steps, see `dedup.py`
+CREATE TABLE IF NOT EXISTS minhashes (
+    kind TEXT,
+    key INTEGER,
+    signature BLOB,
+    representative INTEGER,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    kind TEXT,
+    band INTEGER,
+    bucket BLOB,
+    key INTEGER
+);
+CREATE INDEX IF NOT EXISTS lsh_buckets_bucket ON lsh_buckets (kind, band, bucket);
+CREATE INDEX IF NOT EXISTS lsh_buckets_key ON lsh_buckets (kind, key);
+
+-- hash of the part content the stored steps of each part were generated from
+CREATE TABLE IF NOT EXISTS step_sources (
+    part_id INTEGER PRIMARY KEY,
+    hash TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+-- the version starts over in a new database, caches of the dataset are keyed on both
+INSERT OR IGNORE INTO meta (key, value) VALUES ('database_id', lower(hex(randomblob(16))));
+"""
+
+_connections = threading.local()
+
+
+def connect() -> sqlite3.Connection:
+    """
+    Connection of the current thread to the dataset database, created (and
+    filled from the CSV files if they exist) on first use.
+    """
+    connections = getattr(_connections, "by_path", None)
+    if connections is None:
+        connections = _connections.by_path = {}
+    if DATASET_DB_PATH in connections:
+        return connections[DATASET_DB_PATH]
+
+    os.makedirs(os.path.dirname(DATASET_DB_PATH), exist_ok=True)
+
+    # autocommit mode, transactions are explicit, see `transaction`
+    connection = sqlite3.connect(DATASET_DB_PATH, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    connections[DATASET_DB_PATH] = connection
+    _add_step_ids(connection)
+
+    # also retried if the first import failed and left the database empty
+    if os.path.exists(DATASET_CSV_PATH) and _needs_import(connection):
+        import_csv()
+
+    return connection
+
+
+def _add_step_ids(connection: sqlite3.Connection):
+    """Migrate databases created when steps were only identified by their rowid."""
+    columns = [row["name"] for row in connection.execute("PRAGMA table_info(steps)")]
+    if "id" in columns:
+        return
+    with transaction() as connection:
+        columns = [
+            row["name"] for row in connection.execute("PRAGMA table_info(steps)")
+        ]
+        if "id" in columns:
+            # migrated by another process meanwhile
+            return
+        connection.execute("ALTER TABLE steps RENAME TO steps_without_id")
+        connection.execute("DROP INDEX IF EXISTS steps_parent_id")
+        connection.execute(STEPS_TABLE)
+        connection.execute(STEPS_INDEX)
+        # the rowids become the ids, so that indexes built on them stay valid
+        connection.execute(
+            f"INSERT INTO steps (id, {', '.join(STEP_COLUMNS)}) "
+            f"SELECT rowid, {', '.join(STEP_COLUMNS)} FROM steps_without_id"
+        )
+        connection.execute("DROP TABLE steps_without_id")
+    logger.info("Added ids to the dataset steps")
+
+
+def _needs_import(connection: sqlite3.Connection) -> bool:
+    imported = connection.execute(
+        "SELECT 1 FROM meta WHERE key = 'csv_imported'"
+    ).fetchone()
+    has_parts = connection.execute("SELECT 1 FROM parts LIMIT 1").fetchone()
+    return imported is None and has_parts is None
+
+
+@contextlib.contextmanager
+def transaction(bump_version: bool = True) -> Iterator[sqlite3.Connection]:
+    """
+    Write transaction, taking the write lock upfront so that concurrent
+    read-modify-writes can't interleave. Bumps the dataset version, unless the
+    write doesn't change what is read from the dataset.
+    """
+    connection = connect()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+        if bump_version:
+            connection.execute(
+                "UPDATE meta SET value = value + 1 WHERE key = 'version'"
+            )
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def bump_version():
+    """Tell the readers caching the dataset that it changed."""
+    with transaction():
+        pass
+
+
+def version() -> int:
+    return connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+
+def database_id() -> str:
+    """Random id of the database, changed when its content is replaced by an import."""
+    return str(
+        connect()
+        .execute("SELECT value FROM meta WHERE key = 'database_id'")
+        .fetchone()[0]
+    )
+
+
+def dataframe_rows(df: pd.DataFrame, columns: list[str]) -> list[tuple]:
+    df = df.reindex(columns=columns)
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+def import_csv(
+    dataset_csv_path: str = DATASET_CSV_PATH, steps_csv_path: str = STEPS_CSV_PATH
+):
+    """Replace the content of the database by the CSV files."""
+    parts_df = pd.read_csv(dataset_csv_path)
+    steps_df = (
+        pd.read_csv(steps_csv_path)
+        if os.path.exists(steps_csv_path)
+        else pd.DataFrame(columns=STEP_COLUMNS)
+    )
+
+    with transaction() as connection:
+        connection.execute("DELETE FROM parts")
+        connection.execute("DELETE FROM steps")
+        # where the imported steps come from is unknown
+        connection.execute("DELETE FROM step_sources")
+        # the imported parts may have other code under the same ids
+        connection.execute("DELETE FROM part_artifacts")
+        # signatures are computed again for the imported rows on next use
+        connection.execute("DELETE FROM minhashes")
+        connection.execute("DELETE FROM lsh_buckets")
+        connection.executemany(
+            f"INSERT INTO parts ({', '.join(PART_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(PART_COLUMNS))})",
+            dataframe_rows(parts_df, PART_COLUMNS),
+        )
+        connection.executemany(
+            f"INSERT INTO steps ({', '.join(STEP_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(STEP_COLUMNS))})",
+            dataframe_rows(steps_df, STEP_COLUMNS),
+        )
+        connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_imported', 1)"
+        )
+        # the same ids may now be other rows
+        connection.execute(
+            "UPDATE meta SET value = lower(hex(randomblob(16))) WHERE key = 'database_id'"
+        )
+    logger.info(
+        f"Imported {len(parts_df)} parts and {len(steps_df)} steps into {DATASET_DB_PATH}"
+    )
+
+
+def export_csv(
+    dataset_csv_path: str = DATASET_CSV_PATH, steps_csv_path: str = STEPS_CSV_PATH
+):
+    """Write the database to the public CSV format."""
+    connection = connect()
+    parts_df = pd.read_sql_query(
+        f"SELECT {', '.join(PART_COLUMNS)} FROM parts ORDER BY id", connection
+    )
+    steps_df = pd.read_sql_query(
+        f"SELECT {', '.join(STEP_COLUMNS)} FROM steps ORDER BY id", connection
+    )
+    parts_df.to_csv(dataset_csv_path, index=False)
+    steps_df.to_csv(steps_csv_path, index=False)
+    logger.info(f"Exported {len(parts_df)} parts and {len(steps_df)} steps")
+
+
+def parts_dataframe() -> pd.DataFrame:
+    return pd.read_sql_query(
+        f"SELECT {', '.join(PART_COLUMNS)} FROM parts ORDER BY id", connect()
+    )
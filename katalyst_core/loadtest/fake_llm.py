@@ -0,0 +1,250 @@
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from loguru import logger
+
+CANNED_PROGRAM = """# <parameters>
+length = {length}
+width = {width}
+height = {height}
+hole_diameter = {hole_diameter}
+# </parameters>
+
+result = (
+    cq.Workplane("XY")
+    .box(length, width, height)
+    .faces(">Z")
+    .workplane()
+    .hole(hole_diameter)
+)
+
+filename = "render.stl"
+result.val().exportStl(filename) # if result is a Workplane, you must call val() before exportStl
+"""
+
+
+@dataclass
+class FakeLLMConfig:
+    latency_sec: float = 0.5
+    latency_jitter_sec: float = 0.2
+    failure_rate: float = 0.0
+    use_dataset: bool = False
+    seed: Optional[int] = None
+
+
+@dataclass
+class FakeLLMStats:
+    requests: int = 0
+    failures: int = 0
+    latencies: list[float] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, latency: float, failed: bool):
+        with self.lock:
+            self.requests += 1
+            self.failures += int(failed)
+            self.latencies.append(latency)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "latencies": list(self.latencies),
+            }
+
+
+class FakeLLM:
+    """
+    Produces OpenAI-compatible chat completions without calling any model.
+
+    Answers contain a `<code>` block with a `<parameters>` block and an STL export,
+    so the agent goes through its normal parsing and execution path. Parameter
+    changes and edit requests get answers in their own format.
+    """
+
+    def __init__(self, config: FakeLLMConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.random_lock = threading.Lock()
+        self.stats = FakeLLMStats()
+        self.programs: list[str] = []
+
+        if config.use_dataset:
+            # imported lazily so the server can run without a dataset on disk
+            from katalyst_core.dataset.manage_parts import read_dataset
+
+            self.programs = [
+                part.code
+                for part in read_dataset(only_backends=["cadquery:noassembly"])
+                if isinstance(part.code, str)
+            ]
+            logger.info(f"Fake LLM serving {len(self.programs)} dataset programs")
+
+    def latency(self) -> float:
+        with self.random_lock:
+            jitter = self.random.uniform(
+                -self.config.latency_jitter_sec, self.config.latency_jitter_sec
+            )
+        return max(0.0, self.config.latency_sec + jitter)
+
+    def should_fail(self) -> bool:
+        with self.random_lock:
+            return self.random.random() < self.config.failure_rate
+
+    def program(self) -> str:
+        with self.random_lock:
+            if self.programs:
+                return self.random.choice(self.programs)
+            return CANNED_PROGRAM.format(
+                length=round(self.random.uniform(40, 120), 1),
+                width=round(self.random.uniform(30, 90), 1),
+                height=round(self.random.uniform(5, 30), 1),
+                hole_diameter=round(self.random.uniform(4, 20), 1),
+            )
+
+    def content(self, prompt: str) -> str:
+        if "<search>" in prompt:
+            # edits protocol of Agent.generate_iteration, change the first parameter
+            match = re.search(r"^(\w+) = ([\d.]+)$", prompt, re.MULTILINE)
+            if match is not None:
+                return f"""Changing {match.group(1)}.
+
+<edit>
+<search>
+{match.group(0)}
+</search>
+<replace>
+{match.group(1)} = {round(float(match.group(2)) * 1.5, 1)}
+</replace>
+</edit>
+"""
+
+        if "ONLY by changing the values of the above parameters" in prompt:
+            match = re.search(r'"(\w+)": "([\d.]+)"', prompt)
+            if match is not None and self.should_change_parameters():
+                change = {match.group(1): str(round(float(match.group(2)) * 1.5, 1))}
+                return f"<parameters>\n{json.dumps(change)}\n</parameters>"
+            return "<parameters>\n{}\n</parameters>"
+
+        return f"""The part is a plate with a centered through hole, its dimensions are parametric.
+
+<code>
+{self.program()}
+</code>
+"""
+
+    def should_change_parameters(self) -> bool:
+        with self.random_lock:
+            return self.random.random() < 0.5
+
+    def completion(self, request: dict) -> dict:
+        messages = request.get("messages", [])
+        prompt_text = "\n".join(
+            m["content"] for m in messages if isinstance(m.get("content"), str)
+        )
+        content = self.content(prompt_text)
+
+        prompt_tokens = _estimate_tokens(prompt_text)
+        completion_tokens = _estimate_tokens(content)
+        return {
+            "id": f"fake-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+
+def _estimate_tokens(text: str) -> int:
+    # rough but stable: ~4 characters per token for code and english
+    return max(1, len(re.sub(r"\s+", " ", text)) // 4)
+
+
+def _make_handler(fake_llm: FakeLLM):
+    class FakeLLMHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError:
+                self._send_json(400, {"error": {"message": "Invalid JSON"}})
+                return
+
+            latency = fake_llm.latency()
+            time.sleep(latency)
+
+            if fake_llm.should_fail():
+                fake_llm.stats.record(latency, failed=True)
+                self._send_json(
+                    500,
+                    {"error": {"message": "Injected failure", "type": "server_error"}},
+                )
+                return
+
+            fake_llm.stats.record(latency, failed=False)
+            self._send_json(200, fake_llm.completion(request))
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, fake_llm.stats.to_dict())
+            else:
+                self._send_json(404, {"error": {"message": "Not found"}})
+
+        def _send_json(self, status: int, body: dict):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.trace("Fake LLM: {}", format % args)
+
+    return FakeLLMHandler
+
+
+def make_fake_llm_server(
+    config: FakeLLMConfig, host: str = "127.0.0.1", port: int = 8089
+) -> tuple[ThreadingHTTPServer, FakeLLM]:
+    fake_llm = FakeLLM(config)
+    server = ThreadingHTTPServer((host, port), _make_handler(fake_llm))
+    server.daemon_threads = True
+    return server, fake_llm
+
+
+def start_fake_llm_server(
+    config: FakeLLMConfig, host: str = "127.0.0.1", port: int = 8089
+) -> tuple[ThreadingHTTPServer, FakeLLM]:
+    """
+    Start the fake server in a background thread.
+
+    Point the agent at it with `LLM_BASE_URL=http://<host>:<port>/v1`.
+    """
+    server, fake_llm = make_fake_llm_server(config, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Fake LLM server listening on http://{host}:{server.server_port}/v1")
+    return server, fake_llm
@@ -0,0 +1,117 @@
+import concurrent.futures
+import threading
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+from loguru import logger
+
+from katalyst_core.algorithms.cad_generation.agent import Agent
+from katalyst_core.tracing import Span, listen
+
+DEFAULT_PROMPTS = [
+    "A flange with 6 bolt holes",
+    "A rectangular mounting plate with rounded corners and 4 holes",
+    "A spur gear with 20 teeth",
+    "A shelf bracket",
+    "A cylindrical cup with a handle",
+]
+
+DEFAULT_ITERATIONS = [
+    "Make it 20 mm taller",
+    "Add a chamfer on the top edges",
+]
+
+
+@dataclass
+class StageTimings:
+    durations: dict[str, list[float]] = field(default_factory=dict)
+    failures: dict[str, int] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, stage: str, duration: float, failed: bool = False):
+        with self.lock:
+            self.durations.setdefault(stage, []).append(duration)
+            self.failures[stage] = self.failures.get(stage, 0) + int(failed)
+
+    def record_span(self, span: Span):
+        """Every traced stage counts, however it was reached (minimizer, fix replays...)."""
+        self.record(span.name, span.duration, span.outcome != "ok")
+
+
+@dataclass
+class LoadTestReport:
+    sessions: int
+    failed_sessions: int
+    wall_time_sec: float
+    timings: StageTimings
+
+    def format(self) -> str:
+        lines = [
+            f"Sessions: {self.sessions} ({self.failed_sessions} failed) in {self.wall_time_sec:.1f}s",
+            f"Throughput: {self.sessions / self.wall_time_sec:.2f} sessions/s",
+            "",
+            f"{'stage':<22}{'count':>8}{'fail':>6}{'ops/s':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}",
+        ]
+        for stage, durations in sorted(self.timings.durations.items()):
+            p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+            lines.append(
+                f"{stage:<22}{len(durations):>8}{self.timings.failures.get(stage, 0):>6}"
+                f"{len(durations) / self.wall_time_sec:>8.2f}"
+                f"{p50:>8.2f}s{p90:>8.2f}s{p99:>8.2f}s{max(durations):>8.2f}s"
+            )
+        return "\n".join(lines)
+
+
+def _run_session(prompt: str, iterations: list[str], precision: int) -> bool:
+    """Stages are timed by their spans (agent.initial, agent.iteration and below)."""
+    agent = Agent.initialize(prompt)
+
+    program_id = agent.generate_initial(precision=precision)
+    if program_id is None:
+        return False
+
+    for iteration in iterations:
+        program_id = agent.generate_iteration(iteration)
+        if program_id is None:
+            return False
+
+    return True
+
+
+def run_load_test(
+    sessions: int,
+    concurrency: int,
+    precision: int = 0,
+    prompts: list[str] = DEFAULT_PROMPTS,
+    iterations: list[str] = DEFAULT_ITERATIONS,
+) -> LoadTestReport:
+    """
+    Drive `sessions` agent sessions (one initial generation followed by the
+    `iterations` edit requests) with at most `concurrency` of them in flight.
+    """
+    timings = StageTimings()
+    failed_sessions = 0
+
+    start = time.perf_counter()
+    with listen(timings.record_span):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(
+                    _run_session,
+                    prompts[i % len(prompts)],
+                    iterations,
+                    precision,
+                )
+                for i in range(sessions)
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    success = future.result()
+                except Exception as e:
+                    logger.error(f"Load test session crashed: {e}")
+                    success = False
+                failed_sessions += int(not success)
+    wall_time = time.perf_counter() - start
+
+    return LoadTestReport(sessions, failed_sessions, wall_time, timings)
@@ -0,0 +1,179 @@
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+from katalyst_core.programs.id import ProgramId
+from katalyst_core.programs.storage import program_error_path
+
+# first line of `ExecutionError.format` and last line of a validation diagnostic
+ERROR_HEADER = re.compile(r"^([A-Za-z_][\w.]*)(?: at line \d+)?: (.+)$")
+FORMATTED_HEADER = re.compile(r"^([A-Za-z_][\w.]*)(?: at line (\d+))?: (.*)$")
+FORMATTED_CONTEXT = re.compile(r"^([> ]) +(\d+) \| (.*)$")
+FORMATTED_CALLER = re.compile(r"^  line (\d+) in (.+?): (.*)$")
+
+
+@dataclass
+class ExecutionError:
+    """
+    Exception raised by a program script, as recorded by `runner.py`.
+
+    Line numbers are relative to the script written by the LLM (the preamble is
+    not counted).
+    """
+
+    type: str
+    message: str
+    line: Optional[int]
+    source_line: Optional[str]
+    context: list[tuple[int, str]] = field(default_factory=list)
+    frames: list[dict] = field(default_factory=list)
+
+    @staticmethod
+    def from_dict(d: dict) -> "ExecutionError":
+        return ExecutionError(
+            d["type"],
+            d["message"],
+            d.get("line"),
+            d.get("source_line"),
+            [(n, text) for n, text in d.get("context", [])],
+            d.get("frames", []),
+        )
+
+    @staticmethod
+    def parse(output: str) -> Optional["ExecutionError"]:
+        """
+        Read back the output of `format`, None if it isn't one. Frames only hold
+        the callers, `format` leaves out the frame of the error line.
+        """
+        lines = output.strip().split("\n")
+        # static validation warnings may come first
+        start = next(
+            (i for i, text in enumerate(lines) if FORMATTED_HEADER.match(text)), None
+        )
+        if start is None:
+            return None
+        error_type, line, message = FORMATTED_HEADER.match(lines[start]).groups()
+        error = ExecutionError(error_type, message, int(line) if line else None, None)
+        for text in lines[start + 1 :]:
+            context = FORMATTED_CONTEXT.match(text)
+            caller = FORMATTED_CALLER.match(text)
+            if context is not None:
+                n, source = int(context.group(2)), context.group(3)
+                error.context.append((n, source))
+                if context.group(1) == ">":
+                    error.source_line = source
+            elif caller is not None:
+                error.frames.append(
+                    {
+                        "line": int(caller.group(1)),
+                        "function": caller.group(2),
+                        "source": caller.group(3),
+                    }
+                )
+            elif text.startswith("> ") and error.source_line is None:
+                error.source_line = text[2:]
+        return error
+
+    def to_dict(self) -> dict:
+        return {
+            "type": self.type,
+            "message": self.message,
+            "line": self.line,
+            "source_line": self.source_line,
+            "context": [list(c) for c in self.context],
+            "frames": self.frames,
+        }
+
+    def relocated(self, script: str, context_lines: int = 2) -> "ExecutionError":
+        """
+        Re-anchor line numbers on `script` by looking up the offending source line
+        near the recorded line, as parameters post-processing can shift lines a bit.
+        """
+        if self.line is None or not self.source_line or not self.source_line.strip():
+            return self
+
+        lines = script.split("\n")
+        target = self.source_line.strip()
+        candidates = [i + 1 for i, line in enumerate(lines) if line.strip() == target]
+        if not candidates:
+            return self
+
+        line = min(candidates, key=lambda n: abs(n - self.line))
+        first = max(1, line - context_lines)
+        last = min(len(lines), line + context_lines)
+        context = [(n, lines[n - 1]) for n in range(first, last + 1)]
+
+        return ExecutionError(
+            self.type,
+            self.message,
+            line,
+            lines[line - 1],
+            context,
+            self.frames,
+        )
+
+    def format(self) -> str:
+        """Compact feedback for the LLM, in place of the full interpreter output."""
+        location = f" at line {self.line}" if self.line is not None else ""
+        out = f"{self.type}{location}: {self.message}"
+
+        if self.context:
+            width = len(str(self.context[-1][0]))
+            out += "\n"
+            for n, text in self.context:
+                marker = ">" if n == self.line else " "
+                out += f"\n{marker} {n:>{width}} | {text}"
+        elif self.source_line:
+            out += f"\n\n> {self.source_line.strip()}"
+
+        callers = [
+            frame for frame in self.frames[:-1] if frame.get("line") is not None
+        ]
+        if callers:
+            out += "\n\nCalled from:"
+            for frame in callers:
+                source = (frame.get("source") or "").strip()
+                out += f"\n  line {frame['line']} in {frame['function']}: {source}"
+
+        return out
+
+
+def error_signature(output: str) -> str:
+    """
+    Normalize execution feedback into a signature shared by all occurrences of
+    the same error: the error type and its message without numbers or addresses.
+    """
+    text = output.strip()
+    if not text:
+        return "EmptyResult"
+    if "timed out" in text:
+        return "Timeout"
+
+    lines = text.split("\n")
+    header = None
+    for line in lines:
+        match = ERROR_HEADER.match(line)
+        if match and match.group(1) != "Warning" and not line.startswith("script.py"):
+            header = match
+    if header is not None:
+        error_type, message = header.group(1), header.group(2)
+    else:
+        error_type, message = "Error", lines[-1]
+
+    message = re.sub(r"0x[0-9a-fA-F]+", "ADDR", message)
+    message = re.sub(r"\d+(\.\d+)?", "N", message)
+    message = " ".join(message.split())[:200]
+    return f"{error_type}: {message}"
+
+
+def read_execution_error(program_id: ProgramId) -> Optional[ExecutionError]:
+    path = program_error_path(program_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return ExecutionError.from_dict(json.load(f))
+    except (json.JSONDecodeError, KeyError):
+        return None
@@ -12,6 +12,7 @@ import json
 
 from loguru import logger
 
+from katalyst_core.programs.errors import ExecutionError, read_execution_error
 from katalyst_core.programs.id import ProgramId, new_program_id
 from katalyst_core.programs.sanitize import sanitize_code
 from katalyst_core.programs.parameters_postprocessing import (
@@ -19,12 +20,21 @@ from katalyst_core.programs.parameters_postprocessing import (
     extract_params,
 )
 from katalyst_core.programs.storage import (
+    program_delete,
     program_dir_path,
+    program_error_path,
     program_export_path,
     program_params_path,
     program_script_path,
 )
 from katalyst_core.programs.thumbnail import program_to_thumbnail
+from katalyst_core.tracing import traced
+from katalyst_core.programs.validation import (
+    EXECUTION_PYTHON,
+    format_diagnostics,
+    has_fatal_diagnostic,
+    validate_script,
+)
 
 preamble = """
 import cadquery as cq
@@ -38,6 +48,8 @@ import random
 
 EXECUTION_TIMEOUT_SEC = 40
 
+RUNNER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runner.py")
+
 
 def ensure_dir_exists(dir):
     if not os.path.exists(dir):
@@ -49,8 +61,12 @@ def read_program_code(program_id: str) -> str:
         return script_file.read()
 
 
+@traced("execute", failed=lambda result: not result[1])
 def execute(
-    program_id: ProgramId, params_dict: dict | None = None, export_format: str = "stl"
+    program_id: ProgramId,
+    params_dict: dict | None = None,
+    export_format: str = "stl",
+    thumbnail: bool = True,
 ) -> tuple[str, bool]:
     if os.path.exists(program_export_path(program_id, export_format)):
         os.rename(
@@ -74,10 +90,22 @@ def execute(
     with open(temp_script_path, "w") as file:
         file.write(code)
 
+    if os.path.exists(program_error_path(program_id)):
+        os.remove(program_error_path(program_id))
+
+    # the runner maps traceback lines back to the script without the preamble
+    line_offset = preamble.count("\n") if code.startswith(preamble) else 0
+
     success = False
     try:
         process = subprocess.Popen(
-            ["python", os.path.basename(temp_script_path)],
+            [
+                EXECUTION_PYTHON,
+                RUNNER_PATH,
+                os.path.basename(temp_script_path),
+                str(line_offset),
+                os.path.basename(program_error_path(program_id)),
+            ],
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             cwd=os.path.dirname(temp_script_path),
@@ -95,7 +123,7 @@ def execute(
         if success:
             if os.path.exists(program_export_path(program_id, export_format) + ".old"):
                 os.remove(program_export_path(program_id, export_format) + ".old")
-            if export_format == "stl":
+            if export_format == "stl" and thumbnail:
                 program_to_thumbnail(program_id)
         else:
             if os.path.exists(program_export_path(program_id, export_format) + ".old"):
@@ -118,32 +146,124 @@ def execute(
     return output, success
 
 
+def prepare_script(script: str) -> str:
+    script = sanitize_code(script)
+    # logger.trace(f"Sanitized script:\n{script}")
+    script = fix_and_replace_filename(script, "render.stl")
+    script = set_tolerance(script)
+    # logger.trace(f"Fixed script:\n{script}")
+    return script
+
+
+@traced("execute_first_time", failed=lambda result: not result[2])
 def execute_first_time(script: str) -> tuple[Optional[str], str, bool]:
-    program_id = new_program_id()
     # logger.trace(f"Initial script:\n{script}")
+    script = prepare_script(script)
+
+    diagnostics = validate_script(script)
+    if has_fatal_diagnostic(diagnostics):
+        # no need to pay for a subprocess and a cadquery import to get this error
+        output = format_diagnostics(diagnostics)
+        logger.info("Script rejected by static validation")
+        logger.info(output)
+        return None, output, False
+
+    program_id = new_program_id()
 
     ensure_dir_exists(program_dir_path(program_id))
 
     with open(program_script_path(program_id), "w") as f:
-        script = sanitize_code(script)
-        # logger.trace(f"Sanitized script:\n{script}")
-        script = fix_and_replace_filename(script, "render.stl")
-        script = set_tolerance(script)
-        # logger.trace(f"Fixed script:\n{script}")
         params = extract_params(script)
         with open(program_params_path(program_id), "w") as params_file:
             json.dump(params, params_file, indent=4)
-        script = preamble + script
-        f.write(script)
+        f.write(preamble + script)
 
     output, success = execute(program_id, params)
 
     if not success:
+        error = read_execution_error(program_id)
+        if error is not None:
+            # the full log, OCP traces included, was already logged by execute
+            output = error.relocated(script).format()
+        if diagnostics:
+            output = format_diagnostics(diagnostics) + "\n\n" + output
         return None, output, False
 
     return program_id, output, True
 
 
+def execute_with_params(
+    program_id: ProgramId, params_dict: dict
+) -> tuple[Optional[str], str, bool]:
+    """
+    Create and execute a new program from an existing one with other parameter values.
+
+    `params_dict` must contain every parameter of the program.
+    """
+    code = apply_params(read_program_code(program_id), params_dict)
+
+    new_id = new_program_id()
+    ensure_dir_exists(program_dir_path(new_id))
+    with open(program_script_path(new_id), "w") as f:
+        f.write(code)
+    with open(program_params_path(new_id), "w") as params_file:
+        json.dump(params_dict, params_file, indent=4)
+
+    output, success = execute(new_id, params_dict)
+
+    if not success:
+        error = read_execution_error(new_id)
+        if error is not None:
+            output = error.relocated(code.removeprefix(preamble)).format()
+        return None, output, False
+
+    return new_id, output, True
+
+
+def try_script(
+    script: str, keep: bool = False
+) -> tuple[str, bool, Optional[ExecutionError], Optional[ProgramId]]:
+    """
+    Execute a script in a throwaway program directory.
+
+    Used to test variants of a script (e.g. by the minimizer) without keeping
+    programs around. With `keep`, a successful program is kept like
+    `execute_first_time` would have created it, and its id returned.
+    """
+    script = prepare_script(script)
+
+    diagnostics = validate_script(script)
+    if has_fatal_diagnostic(diagnostics):
+        return format_diagnostics(diagnostics), False, None, None
+
+    program_id = new_program_id()
+    ensure_dir_exists(program_dir_path(program_id))
+    success = False
+    try:
+        with open(program_script_path(program_id), "w") as f:
+            f.write(preamble + script)
+        params = None
+        if keep:
+            params = extract_params(script)
+            with open(program_params_path(program_id), "w") as params_file:
+                json.dump(params, params_file, indent=4)
+
+        # the thumbnail is only rendered for the program that is kept
+        output, success = execute(program_id, params, thumbnail=keep)
+
+        error = None
+        if not success:
+            error = read_execution_error(program_id)
+            if error is not None:
+                error = error.relocated(script)
+                output = error.format()
+    finally:
+        if not (keep and success):
+            program_delete(program_id)
+
+    return output, success, error, program_id if keep and success else None
+
+
 def set_tolerance(code: str, tolerance=5) -> str:
     return code.replace(
         ".exportSTL(filename)", f".exportSTL(filename, tolerance={tolerance})"
@@ -169,7 +289,8 @@ def fix_and_replace_filename(code: str, by: str) -> str:
                 ):
                     var_name = parts[0].strip()
                     modified_value_part = f'"{by}"'
-                    line = f"filename = {modified_value_part}"
+                    indent = line[: len(line) - len(line.lstrip())]
+                    line = f"{indent}filename = {modified_value_part}"
                     replaced = True
 
         if var_name is not None and replaced and ".exportStl(" in stripped_line:
@@ -177,12 +298,12 @@ def fix_and_replace_filename(code: str, by: str) -> str:
 
         modified_lines.append(line)
 
-    # If no replacement was done, check for .exportStl("<myname>.stl")
+    # If no replacement was done, check for .exportStl("<myname>.stl") or cq.exporters.export(result, "<myname>.stl")
     if not replaced:
         new_modified_lines = []
         for line in modified_lines:
             stripped_line = line.strip()
-            if ".exportStl(" in stripped_line:
+            if ".exportStl(" in stripped_line or "exporters.export(" in stripped_line:
                 start_quote = (
                     stripped_line.find('"')
                     if '"' in stripped_line
@@ -0,0 +1,80 @@
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+import vtk
+from loguru import logger
+
+
+@dataclass
+class MeshMetrics:
+    triangles: int
+    solids: int
+    volume: float
+    area: float
+    size: tuple[float, float, float]
+    watertight: bool
+
+
+def stl_metrics(stl_path: str) -> Optional[MeshMetrics]:
+    """Cheap geometric metrics of an STL file, or None if it can't be read."""
+    reader = vtk.vtkSTLReader()
+    reader.SetFileName(stl_path)
+    reader.Update()
+
+    # STL facets don't share vertices, merge them to get the topology back
+    clean = vtk.vtkCleanPolyData()
+    clean.SetInputConnection(reader.GetOutputPort())
+    clean.Update()
+    mesh = clean.GetOutput()
+
+    triangles = mesh.GetNumberOfCells()
+    if triangles == 0:
+        logger.warning(f"Empty or unreadable mesh: {stl_path}")
+        return None
+
+    connectivity = vtk.vtkPolyDataConnectivityFilter()
+    connectivity.SetInputData(mesh)
+    connectivity.SetExtractionModeToAllRegions()
+    connectivity.Update()
+
+    mass = vtk.vtkMassProperties()
+    mass.SetInputData(mesh)
+    mass.Update()
+
+    edges = vtk.vtkFeatureEdges()
+    edges.SetInputData(mesh)
+    edges.BoundaryEdgesOn()
+    edges.NonManifoldEdgesOn()
+    edges.FeatureEdgesOff()
+    edges.ManifoldEdgesOff()
+    edges.Update()
+
+    x0, x1, y0, y1, z0, z1 = mesh.GetBounds()
+
+    return MeshMetrics(
+        triangles=triangles,
+        solids=connectivity.GetNumberOfExtractedRegions(),
+        volume=mass.GetVolume(),
+        area=mass.GetSurfaceArea(),
+        size=(x1 - x0, y1 - y0, z1 - z0),
+        watertight=edges.GetOutput().GetNumberOfCells() == 0,
+    )
+
+
+def geometry_score(metrics: Optional[MeshMetrics], parameters_count: int) -> float:
+    """
+    Rank candidate models of the same prompt without looking at them: detailed,
+    parametric, closed, single-piece models score higher. Broken meshes score -inf.
+    """
+    if metrics is None or metrics.volume <= 0 or min(metrics.size) <= 0:
+        return -math.inf
+
+    # detail saturates, a million triangles is not better than a hundred thousand
+    detail = min(math.log10(metrics.triangles), 5.0)
+    parametric = min(parameters_count, 15) / 5
+    # floating pieces usually are misplaced features
+    fragmentation = min(metrics.solids - 1, 6) * 0.5
+    leak = 0.0 if metrics.watertight else 2.0
+
+    return detail + parametric - fragmentation - leak
@@ -0,0 +1,330 @@
+import ast
+import concurrent.futures
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from loguru import logger
+
+from katalyst_core.programs.errors import ExecutionError
+from katalyst_core.programs.executor import try_script
+from katalyst_core.programs.id import ProgramId
+from katalyst_core.programs.storage import program_delete
+from katalyst_core.programs.validation import workplane_api
+from katalyst_core.tracing import in_context, traced
+
+MAX_RUNS = 24
+MAX_WORKERS = 4
+
+# calls holding a chain together, removing them only moves the error elsewhere
+STRUCTURAL_CALLS = {
+    "Workplane",
+    "workplane",
+    "end",
+    "tag",
+    "val",
+    "vals",
+    "first",
+    "last",
+    "item",
+    "center",
+    "moveTo",
+    "move",
+    "transformed",
+    "exportStl",
+}
+
+SELECTOR_CALLS = {"edges", "faces", "vertices", "wires", "solids", "shells"}
+
+# names bound by the preamble, scripts may rebind them freely
+PREAMBLE_NAMES = {"cq", "cadquery", "Airfoil", "math", "np", "random"}
+
+
+@dataclass
+class Removal:
+    kind: str  # "call" or "statement"
+    start: int
+    end: int
+    line: int
+    end_line: int
+    text: str
+
+    def overlaps(self, other: "Removal") -> bool:
+        return self.start < other.end and other.start < self.end
+
+    def describe(self) -> str:
+        text = " ".join(self.text.split())
+        if len(text) > 80:
+            text = text[:77] + "..."
+        if self.kind == "call":
+            return f"the call `{text}` at line {self.line}"
+        return f"the statement `{text}` at line {self.line}"
+
+
+@dataclass
+class Minimization:
+    script: str
+    removed: list[Removal]
+    runs: int
+    # the successful execution of `script`, no need to run it again
+    program_id: ProgramId
+    output: str
+
+    @property
+    def culprit(self) -> Removal:
+        return self.removed[0]
+
+    def describe(self) -> str:
+        return "Removed " + ", then ".join(r.describe() for r in self.removed)
+
+
+@traced("minimize", failed=lambda minimization: minimization is None)
+def minimize_failure(
+    script: str,
+    error: Optional[ExecutionError] = None,
+    output: Optional[str] = None,
+    max_runs: int = MAX_RUNS,
+    max_workers: int = MAX_WORKERS,
+) -> Optional[Minimization]:
+    """
+    Find the smallest removal of chained Workplane calls or top-level statements
+    that makes a failing script succeed, delta-debugging style.
+
+    Candidates around the failing line are tried first, in parallel. When no single
+    removal succeeds but one moves the error further, it is kept and the search goes
+    on from there, so scripts with several broken operations can be fixed too.
+
+    The script is only executed first if neither its `error` nor the `output`
+    of its failed execution are given.
+    """
+    try:
+        candidates = _find_candidates(script)
+    except SyntaxError:
+        return None
+    if not candidates:
+        return None
+
+    runs = 0
+    if error is None and output is not None:
+        error = ExecutionError.parse(output)
+    elif error is None:
+        output, success, error, program_id = try_script(script, keep=True)
+        runs += 1
+        if success:
+            return Minimization(script, [], runs, program_id, output)
+
+    removed: list[Removal] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while runs < max_runs:
+            remaining = [
+                c for c in candidates if not any(c.overlaps(r) for r in removed)
+            ]
+            remaining.sort(key=lambda c: _priority(c, error))
+
+            progress = None
+            while remaining and runs < max_runs and progress is None:
+                batch = remaining[: min(max_workers, max_runs - runs)]
+                remaining = remaining[len(batch) :]
+                variants = [_apply(script, removed + [c]) for c in batch]
+                results = list(
+                    executor.map(
+                        in_context(lambda variant: try_script(variant, keep=True)),
+                        variants,
+                    )
+                )
+                runs += len(batch)
+
+                minimization = None
+                for candidate, variant, (
+                    variant_output,
+                    success,
+                    new_error,
+                    program_id,
+                ) in zip(batch, variants, results):
+                    if success and minimization is None:
+                        minimization = Minimization(
+                            variant,
+                            removed + [candidate],
+                            runs,
+                            program_id,
+                            variant_output,
+                        )
+                    elif success:
+                        program_delete(program_id)
+                    if progress is None and _is_progress(error, new_error):
+                        progress = (candidate, new_error)
+                if minimization is not None:
+                    logger.info(
+                        f"Minimizer succeeded after {runs} runs: {minimization.describe()}"
+                    )
+                    return minimization
+
+            if progress is None:
+                break
+            removed.append(progress[0])
+            error = progress[1]
+            logger.trace(f"Minimizer progressed: {progress[0].describe()}")
+
+    logger.info(f"Minimizer gave up after {runs} runs")
+    return None
+
+
+def _is_progress(
+    error: Optional[ExecutionError], new_error: Optional[ExecutionError]
+) -> bool:
+    """
+    Whether a removal moved the error further without changing the kind of
+    failure. Trading an empty result for an exception, or an exception for
+    another type of exception, would minimize another bug than the reported one.
+    """
+    if error is None or new_error is None:
+        # an empty result has no position to move
+        return False
+    if new_error.type != error.type:
+        return False
+    return (new_error.line, new_error.message) != (error.line, error.message)
+
+
+def _priority(candidate: Removal, error: Optional[ExecutionError]) -> tuple:
+    kind_rank = 0 if candidate.kind == "call" else 1
+    if error is None or error.line is None:
+        # empty results usually come from the last operations
+        return (1, kind_rank, -candidate.line)
+
+    lines = {error.line} | {f["line"] for f in error.frames if f.get("line")}
+    hit = any(candidate.line <= line <= candidate.end_line for line in lines)
+    return (0 if hit else 1, kind_rank, abs(candidate.line - error.line))
+
+
+def _apply(script: str, removals: list[Removal]) -> str:
+    applied: list[Removal] = []
+    for removal in sorted(removals, key=lambda r: r.start, reverse=True):
+        if any(removal.overlaps(a) for a in applied):
+            continue
+        script = script[: removal.start] + script[removal.end :]
+        applied.append(removal)
+    return script
+
+
+def _parameters_lines(lines: list[str]) -> set[int]:
+    in_block = False
+    block_lines = set()
+    for i, line in enumerate(lines, start=1):
+        if re.match(r"\s*#\s*<parameters>", line):
+            in_block = True
+        if in_block:
+            block_lines.add(i)
+        if re.match(r"\s*#\s*</parameters>", line):
+            in_block = False
+    return block_lines
+
+
+def _find_candidates(script: str) -> list[Removal]:
+    tree = ast.parse(script)
+    lines = script.split("\n")
+    line_starts = [0]
+    for line in lines:
+        line_starts.append(line_starts[-1] + len(line) + 1)
+
+    def offset(lineno: int, col: int) -> int:
+        # ast columns are utf-8 byte offsets
+        line = lines[lineno - 1]
+        return line_starts[lineno - 1] + len(
+            line.encode("utf-8")[:col].decode("utf-8", errors="ignore")
+        )
+
+    parameters_lines = _parameters_lines(lines)
+    api = workplane_api()
+    candidates = []
+
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+            continue
+        attr = node.func.attr
+        receiver = node.func.value
+        if attr in STRUCTURAL_CALLS or attr in SELECTOR_CALLS:
+            continue
+        if api is not None and not api.get(attr, False):
+            continue
+        if api is None and not isinstance(receiver, ast.Call):
+            continue
+        if node.lineno in parameters_lines:
+            continue
+
+        # drop the selector feeding the operation too, e.g. `.edges("|Z").fillet(2)`
+        if (
+            isinstance(receiver, ast.Call)
+            and isinstance(receiver.func, ast.Attribute)
+            and receiver.func.attr in SELECTOR_CALLS
+        ):
+            receiver = receiver.func.value
+
+        start = offset(receiver.end_lineno, receiver.end_col_offset)
+        end = offset(node.end_lineno, node.end_col_offset)
+        candidates.append(
+            Removal(
+                "call",
+                start,
+                end,
+                node.func.end_lineno,
+                node.end_lineno,
+                script[start:end].strip(),
+            )
+        )
+
+    bound = set(PREAMBLE_NAMES)
+    for statement in tree.body:
+        stored = {
+            n.id
+            for n in ast.walk(statement)
+            if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)
+        }
+        if isinstance(statement, (ast.For, ast.AsyncFor)):
+            loop_names = {
+                n.id for n in ast.walk(statement.target) if isinstance(n, ast.Name)
+            }
+        else:
+            loop_names = set()
+
+        removable = (
+            not isinstance(
+                statement,
+                (
+                    ast.Import,
+                    ast.ImportFrom,
+                    ast.FunctionDef,
+                    ast.AsyncFunctionDef,
+                    ast.ClassDef,
+                ),
+            )
+            and "filename" not in stored
+            and not any(
+                isinstance(n, ast.Attribute) and n.attr == "exportStl"
+                for n in ast.walk(statement)
+            )
+            # only statements updating existing values, removing a definition
+            # would just trade the error for a NameError
+            and (stored - loop_names) <= bound
+            and not parameters_lines & set(
+                range(statement.lineno, statement.end_lineno + 1)
+            )
+        )
+        if removable:
+            start = line_starts[statement.lineno - 1]
+            end = min(line_starts[statement.end_lineno], len(script))
+            candidates.append(
+                Removal(
+                    "statement",
+                    start,
+                    end,
+                    statement.lineno,
+                    statement.end_lineno,
+                    script[start:end].strip(),
+                )
+            )
+
+        bound |= stored
+        if isinstance(statement, (ast.FunctionDef, ast.ClassDef)):
+            bound.add(statement.name)
+
+    return candidates
@@ -0,0 +1,98 @@
+"""
+Runs a program script and records a structured error if it raises.
+
+This file is executed directly by `executor.execute` in the program's directory:
+
+    python runner.py <script> <preamble line count> <error json path>
+
+It must only depend on the standard library, as it runs in the execution
+environment before the script's own imports.
+"""
+
+import json
+import os
+import sys
+import traceback
+
+CONTEXT_LINES = 2
+MAX_MESSAGE_LENGTH = 1000
+
+
+def error_record(
+    error: BaseException, source: str, script_path: str, line_offset: int
+) -> dict:
+    lines = source.split("\n")
+
+    def to_user_line(lineno):
+        if lineno is None or lineno - line_offset < 1:
+            # the error happened in the preamble or outside the script
+            return None
+        return lineno - line_offset
+
+    frames = []
+    if isinstance(error, SyntaxError) and error.filename == script_path:
+        frames.append({"line": to_user_line(error.lineno), "function": "<module>"})
+    else:
+        for frame in traceback.extract_tb(error.__traceback__):
+            if frame.filename == script_path:
+                frames.append(
+                    {"line": to_user_line(frame.lineno), "function": frame.name}
+                )
+
+    for frame in frames:
+        line = frame["line"]
+        frame["source"] = lines[line + line_offset - 1] if line is not None else None
+
+    line = frames[-1]["line"] if frames else None
+    context = []
+    if line is not None:
+        first = max(1, line - CONTEXT_LINES)
+        last = min(len(lines) - line_offset, line + CONTEXT_LINES)
+        context = [[n, lines[n + line_offset - 1]] for n in range(first, last + 1)]
+
+    message = error.msg if isinstance(error, SyntaxError) else str(error)
+    if len(message) > MAX_MESSAGE_LENGTH:
+        message = message[:MAX_MESSAGE_LENGTH] + "..."
+
+    error_type = type(error).__qualname__
+    if type(error).__module__ != "builtins":
+        # keeps e.g. "OCP.OCP.StdFail.StdFail_NotDone" recognizable as an OCP error
+        error_type = f"{type(error).__module__}.{error_type}"
+
+    return {
+        "type": error_type,
+        "message": message,
+        "line": line,
+        "source_line": frames[-1]["source"] if frames else None,
+        "context": context,
+        "frames": frames,
+    }
+
+
+def main():
+    script_path = os.path.abspath(sys.argv[1])
+    line_offset = int(sys.argv[2])
+    error_path = sys.argv[3]
+
+    # behave as if the script had been run with `python <script>`
+    sys.argv = [script_path]
+    sys.path[0] = os.path.dirname(script_path)
+
+    with open(script_path, "r") as f:
+        source = f.read()
+
+    try:
+        code = compile(source, script_path, "exec")
+        exec(code, {"__name__": "__main__", "__file__": script_path})
+    except SystemExit:
+        raise
+    except BaseException as e:
+        # skip the runner's own frame in the log
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        with open(error_path, "w") as f:
+            json.dump(error_record(e, source, script_path, line_offset), f)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,10 @@ def program_script_path(program_id: ProgramId) -> str:
     return os.path.join(program_dir_path(program_id), "script.py")
 
 
+def program_error_path(program_id: ProgramId) -> str:
+    return os.path.join(program_dir_path(program_id), "error.json")
+
+
 def program_thumbnail_path(program_id: ProgramId) -> str:
     return os.path.join(program_dir_path(program_id), "thumbnail.png")
 
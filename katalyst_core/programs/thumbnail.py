@@ -3,8 +3,10 @@ from loguru import logger
 from katalyst_core.algorithms.stl_to_pics.render import render
 from katalyst_core.programs.id import ProgramId
 from katalyst_core.programs.storage import program_stl_path, program_thumbnail_path
+from katalyst_core.tracing import traced
 
 
+@traced("thumbnail", failed=lambda thumbnail_path: thumbnail_path is None)
 def program_to_thumbnail(program_id: ProgramId) -> Optional[str]:
     stl_path = program_stl_path(program_id)
     thumbnail_path = program_thumbnail_path(program_id)
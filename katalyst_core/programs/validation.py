@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import ast
+import functools
+import importlib
+import inspect
+import subprocess
+from dataclasses import dataclass
+from typing import Optional
+
+from loguru import logger
+
+SCRIPT_NAME = "script.py"
+
+# modules imported by `executor.preamble`, importing them again is harmless but noisy
+PREAMBLE_MODULES = {"cadquery", "cq_gears", "airfoils", "math", "numpy", "random"}
+
+CADQUERY_MODULE_NAMES = {"cq", "cadquery"}
+
+# interpreter the executor runs scripts with, modules are looked up in it
+EXECUTION_PYTHON = "python"
+
+WORKPLANE_OPERATORS = {
+    ast.Add: "__add__",
+    ast.Sub: "__sub__",
+    ast.BitAnd: "__and__",
+    ast.BitOr: "__or__",
+}
+
+
+@dataclass
+class Diagnostic:
+    kind: str
+    message: str
+    line: Optional[int]
+    source_line: Optional[str]
+    fatal: bool
+    column: Optional[int] = None
+
+    def format(self) -> str:
+        """
+        Render the diagnostic the way the Python interpreter would have reported it,
+        so the LLM sees the same kind of feedback as for a real execution.
+        """
+        if not self.fatal:
+            location = SCRIPT_NAME if self.line is None else f"{SCRIPT_NAME}:{self.line}"
+            out = f"{location}: Warning: {self.message}"
+            if self.source_line:
+                out += f"\n  {self.source_line.strip()}"
+            return out
+
+        if self.kind in ("SyntaxError", "IndentationError", "TabError"):
+            out = f'  File "{SCRIPT_NAME}", line {self.line}'
+            if self.source_line:
+                out += f"\n    {self.source_line.strip()}"
+                if self.column is not None:
+                    indent = len(self.source_line) - len(self.source_line.lstrip())
+                    out += "\n    " + " " * max(0, self.column - 1 - indent) + "^"
+            return out + f"\n{self.kind}: {self.message}"
+
+        out = "Traceback (most recent call last):"
+        if self.line is not None:
+            out += f'\n  File "{SCRIPT_NAME}", line {self.line}, in <module>'
+            if self.source_line:
+                out += f"\n    {self.source_line.strip()}"
+        return out + f"\n{self.kind}: {self.message}"
+
+
+def has_fatal_diagnostic(diagnostics: list[Diagnostic]) -> bool:
+    return any(diagnostic.fatal for diagnostic in diagnostics)
+
+
+def format_diagnostics(diagnostics: list[Diagnostic]) -> str:
+    # warnings first, like the interpreter prints them before the traceback
+    ordered = sorted(diagnostics, key=lambda diagnostic: diagnostic.fatal)
+    return "\n\n".join(diagnostic.format() for diagnostic in ordered)
+
+
+@functools.cache
+def workplane_api() -> Optional[dict[str, bool]]:
+    """
+    Introspect `cq.Workplane` once per process.
+
+    Maps every method name to whether it returns a Workplane (so that chained
+    calls can keep being checked), or returns None if cadquery isn't importable.
+    The preamble modules are imported first, plugins such as cq_gears add
+    methods to Workplane.
+    """
+    try:
+        import cadquery as cq
+    except ImportError:
+        logger.warning("cadquery not importable, Workplane calls won't be validated")
+        return None
+    for module in sorted(PREAMBLE_MODULES):
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.warning(f"Preamble module {module} not importable: {e}")
+
+    api = {}
+    for name in dir(cq.Workplane):
+        attribute = getattr(cq.Workplane, name, None)
+        returns_workplane = False
+        if callable(attribute):
+            try:
+                annotation = inspect.signature(attribute).return_annotation
+            except (TypeError, ValueError):
+                annotation = inspect.Signature.empty
+            # most methods are annotated with the `T` TypeVar bound to Workplane
+            returns_workplane = (
+                annotation in ("Workplane", "T", cq.Workplane)
+                or getattr(annotation, "__bound__", None) is not None
+            )
+        api[name] = returns_workplane
+    return api
+
+
+def validate_script(script: str) -> list[Diagnostic]:
+    """
+    Statically check an LLM-written script (without the preamble) for problems
+    that would make its execution fail or be rejected.
+    """
+    lines = script.split("\n")
+
+    def source_line(lineno: Optional[int]) -> Optional[str]:
+        if lineno is None or lineno < 1 or lineno > len(lines):
+            return None
+        return lines[lineno - 1]
+
+    try:
+        tree = ast.parse(script)
+    except SyntaxError as e:
+        return [
+            Diagnostic(
+                type(e).__name__,
+                e.msg,
+                e.lineno,
+                source_line(e.lineno),
+                fatal=True,
+                column=e.offset,
+            )
+        ]
+
+    diagnostics = []
+    diagnostics += _check_main_guard(tree, source_line)
+    diagnostics += _check_imports(tree, source_line)
+    diagnostics += _check_export(tree, source_line)
+
+    api = workplane_api()
+    if api is not None:
+        checker = _WorkplaneCallChecker(api, source_line)
+        checker.visit_scope(tree.body, {})
+        diagnostics += checker.diagnostics
+
+    return diagnostics
+
+
+def _is_main_guard(node: ast.AST) -> bool:
+    if not isinstance(node, ast.If) or not isinstance(node.test, ast.Compare):
+        return False
+    operands = [node.test.left, *node.test.comparators]
+    names = [o.id for o in operands if isinstance(o, ast.Name)]
+    constants = [o.value for o in operands if isinstance(o, ast.Constant)]
+    return "__name__" in names and "__main__" in constants
+
+
+def _check_main_guard(tree: ast.Module, source_line) -> list[Diagnostic]:
+    return [
+        Diagnostic(
+            "ScriptStructureError",
+            '`if __name__ == "__main__":` is not allowed, nor is a main function. '
+            "The export must be at the end of the code, without indentation.",
+            node.lineno,
+            source_line(node.lineno),
+            fatal=True,
+        )
+        for node in tree.body
+        if _is_main_guard(node)
+    ]
+
+
+def _check_imports(tree: ast.Module, source_line) -> list[Diagnostic]:
+    diagnostics = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules = [node.module]
+        else:
+            continue
+
+        for module in modules:
+            top_level = module.split(".")[0]
+            if top_level in PREAMBLE_MODULES:
+                diagnostics.append(
+                    Diagnostic(
+                        "RedundantImport",
+                        f"`{module}` is already imported by the preamble, do not write imports",
+                        node.lineno,
+                        source_line(node.lineno),
+                        fatal=False,
+                    )
+                )
+            elif not _module_available(top_level):
+                diagnostics.append(
+                    Diagnostic(
+                        "ModuleNotFoundError",
+                        f"No module named '{top_level}'",
+                        node.lineno,
+                        source_line(node.lineno),
+                        fatal=True,
+                    )
+                )
+    return diagnostics
+
+
+@functools.cache
+def _module_available(module: str) -> bool:
+    """Whether the interpreter that executes the scripts can import `module`."""
+    try:
+        process = subprocess.run(
+            [
+                EXECUTION_PYTHON,
+                "-c",
+                "import importlib.util, sys; "
+                "sys.exit(importlib.util.find_spec(sys.argv[1]) is None)",
+                module,
+            ],
+            capture_output=True,
+            timeout=10,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        # the execution will tell, don't reject a script we can't check
+        logger.warning(f"Couldn't look up module {module}: {e}")
+        return True
+    return process.returncode == 0
+
+
+def _is_export_call(node: ast.AST) -> bool:
+    """`shape.exportStl(...)`, or `cq.exporters.export(...)` / `exporters.export(...)`."""
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Attribute):
+        return False
+    if node.func.attr == "exportStl":
+        return True
+    module = node.func.value
+    return node.func.attr == "export" and (
+        (isinstance(module, ast.Name) and module.id == "exporters")
+        or (isinstance(module, ast.Attribute) and module.attr == "exporters")
+    )
+
+
+def _check_export(tree: ast.Module, source_line) -> list[Diagnostic]:
+    top_level_export = any(
+        _is_export_call(node)
+        for statement in tree.body
+        if not isinstance(
+            statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+        )
+        and not _is_main_guard(statement)
+        for node in ast.walk(statement)
+    )
+    if top_level_export:
+        return []
+
+    nested_exports = [node for node in ast.walk(tree) if _is_export_call(node)]
+    if nested_exports:
+        return [
+            Diagnostic(
+                "ScriptStructureError",
+                "The STL export must be at the end of the code, without indentation, "
+                'not inside a function or a block: `result.val().exportStl("render.stl")`',
+                nested_exports[0].lineno,
+                source_line(nested_exports[0].lineno),
+                fatal=True,
+            )
+        ]
+
+    # it may export in a way that isn't recognized here, the execution will tell
+    return [
+        Diagnostic(
+            "ScriptStructureError",
+            "Nothing seems to be exported, the script must end with "
+            '`filename = "render.stl"` and `result.val().exportStl(filename)`',
+            None,
+            None,
+            fatal=False,
+        )
+    ]
+
+
+class _WorkplaneCallChecker:
+    """
+    Follows values known to be Workplanes (built from `cq.Workplane(...)` and
+    chained calls, possibly through variables) and warns about calls to methods
+    the introspected Workplane API doesn't have. These are not fatal: plugins
+    can add methods to Workplane at runtime.
+    """
+
+    def __init__(self, api: dict[str, bool], source_line):
+        self.api = api
+        self.source_line = source_line
+        self.diagnostics: list[Diagnostic] = []
+        self.reported: set[tuple[int, str]] = set()
+
+    def visit_scope(self, statements: list[ast.stmt], env: dict[str, bool]):
+        for statement in statements:
+            self.visit(statement, env)
+
+    def visit(self, node: ast.AST, env: dict[str, bool]):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for expr in [*node.decorator_list, *node.args.defaults]:
+                self.infer(expr, env)
+            env[node.name] = False
+            scope = dict(env)
+            for arg in ast.walk(node.args):
+                if isinstance(arg, ast.arg):
+                    scope[arg.arg] = False
+            self.visit_scope(node.body, scope)
+        elif isinstance(node, ast.Assign):
+            is_workplane = self.infer(node.value, env)
+            for target in node.targets:
+                self._bind(target, env, is_workplane)
+        elif isinstance(node, (ast.For, ast.AsyncFor)):
+            self.infer(node.iter, env)
+            self._bind(node.target, env, False)
+            self.visit_scope(node.body + node.orelse, env)
+        elif isinstance(node, ast.expr):
+            self.infer(node, env)
+        else:
+            for child in ast.iter_child_nodes(node):
+                self.visit(child, env)
+
+    def _bind(self, target: ast.expr, env: dict[str, bool], is_workplane: bool):
+        if isinstance(target, ast.Name):
+            env[target.id] = is_workplane
+            return
+        for node in ast.walk(target):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                env[node.id] = False
+
+    def infer(self, node: ast.expr, env: dict[str, bool]) -> bool:
+        """Check calls within the expression and tell whether it is a Workplane."""
+        if isinstance(node, ast.Name):
+            return env.get(node.id, False)
+
+        if isinstance(node, ast.BinOp) and type(node.op) in WORKPLANE_OPERATORS:
+            left = self.infer(node.left, env)
+            self.infer(node.right, env)
+            return left and WORKPLANE_OPERATORS[type(node.op)] in self.api
+
+        if isinstance(node, ast.Call):
+            for arg in [*node.args, *[keyword.value for keyword in node.keywords]]:
+                self.infer(arg, env)
+
+            func = node.func
+            if not isinstance(func, ast.Attribute):
+                self.infer(func, env)
+                return False
+
+            if (
+                isinstance(func.value, ast.Name)
+                and func.value.id in CADQUERY_MODULE_NAMES
+                and func.attr == "Workplane"
+            ):
+                return True
+
+            if not self.infer(func.value, env):
+                return False
+
+            if func.attr not in self.api:
+                self._report(func)
+                return False
+            return self.api[func.attr]
+
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.expr):
+                self.infer(child, env)
+        return False
+
+    def _report(self, func: ast.Attribute):
+        lineno = func.end_lineno or func.lineno
+        if (lineno, func.attr) in self.reported:
+            return
+        self.reported.add((lineno, func.attr))
+        self.diagnostics.append(
+            Diagnostic(
+                "AttributeError",
+                f"'Workplane' object has no attribute '{func.attr}'",
+                lineno,
+                self.source_line(lineno),
+                fatal=False,
+            )
+        )
@@ -1,12 +1,12 @@
-import pandas as pd
 from PIL import Image
 import lancedb
 from lancedb.pydantic import LanceModel, Vector
 from lancedb.embeddings import EmbeddingFunctionRegistry
 import os
 
+from katalyst_core.dataset import store
+
 VECDB_PATH = "storage/dataset/multimodal_vector_db"
-DATASET_PATH = "storage/dataset/dataset.csv"
 PICTURES_PATH = "storage/dataset/files/"
 
 
@@ -31,7 +31,7 @@ class Design(LanceModel):
 
 images_path = PICTURES_PATH
 
-df = pd.read_csv(DATASET_PATH)
+df = store.parts_dataframe()
 df = df[df["files"].notna()]
 df = df[df["files"] != ""]
 df = df.assign(files=df["files"].str.split(";")).explode("files").reset_index(drop=True)
@@ -0,0 +1,18 @@
+import argparse
+
+from katalyst_core.dataset import store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import the dataset database from, or export it to, the CSV files"
+    )
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("--dataset", default=store.DATASET_CSV_PATH)
+    parser.add_argument("--steps", default=store.STEPS_CSV_PATH)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        store.import_csv(args.dataset, args.steps)
+    else:
+        store.export_csv(args.dataset, args.steps)
@@ -0,0 +1,38 @@
+import argparse
+from collections import Counter
+
+from katalyst_core.dataset.manage_parts import (
+    delete_duplicate_steps,
+    part_representatives,
+    step_representatives,
+)
+
+
+def print_groups(name: str, representatives: dict[int, int]):
+    sizes = Counter(representatives.values())
+    groups = {key: size for key, size in sizes.items() if size > 1}
+    print(
+        f"{name}: {len(representatives)} total, {len(sizes)} distinct, "
+        f"{len(groups)} groups of near-duplicates"
+    )
+    for key, size in sorted(groups.items(), key=lambda g: g[1], reverse=True)[:10]:
+        members = [k for k, r in representatives.items() if r == key]
+        print(f"  {size} x {members[:8]}{' ...' if size > 8 else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report near-duplicate parts and steps of the dataset"
+    )
+    parser.add_argument(
+        "--collapse-steps",
+        action="store_true",
+        help="delete the steps that are near-duplicates of an earlier one",
+    )
+    args = parser.parse_args()
+
+    print_groups("parts", part_representatives())
+    print_groups("steps", step_representatives())
+
+    if args.collapse_steps:
+        print(f"Deleted {delete_duplicate_steps()} duplicate steps")
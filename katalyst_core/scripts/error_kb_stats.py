@@ -0,0 +1,28 @@
+from katalyst_core.algorithms.cad_generation.error_kb import kb_stats
+
+
+if __name__ == "__main__":
+    kb = kb_stats()
+    stats = kb["stats"]
+    lookups = stats["lookups"]
+    if lookups == 0:
+        print("No errors recorded yet")
+        exit()
+
+    print(
+        f"{lookups} failures looked up, {stats['known'] / lookups:.0%} with a known fix, "
+        f"{stats['local_fixes']} fixed without LLM (retries saved)"
+    )
+    print()
+
+    signatures = sorted(
+        kb["signatures"].items(), key=lambda item: item[1]["seen"], reverse=True
+    )
+    for signature, entry in signatures[:20]:
+        fixes = ", ".join(
+            f"{name} {fix['successes']}/{fix['attempts']}"
+            for name, fix in entry["fixes"].items()
+        )
+        print(f"{entry['seen']:>5}  {signature[:100]}")
+        if fixes:
+            print(f"       fixes: {fixes}")
@@ -0,0 +1,32 @@
+import argparse
+
+from katalyst_core.loadtest.fake_llm import FakeLLMConfig, make_fake_llm_server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="OpenAI-compatible stand-in LLM server, use with LLM_BASE_URL=http://<host>:<port>/v1"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--use-dataset",
+        action="store_true",
+        help="answer with programs from storage/dataset/dataset.csv",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(
+        latency_sec=args.latency,
+        latency_jitter_sec=args.jitter,
+        failure_rate=args.failure_rate,
+        use_dataset=args.use_dataset,
+        seed=args.seed,
+    )
+    server, _ = make_fake_llm_server(config, args.host, args.port)
+    print(f"Listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,24 @@
+import argparse
+
+from katalyst_core.dataset.manage_parts import get_part
+from katalyst_core.dataset.shape_index import build_shape_index, find_similar_parts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="List the dataset parts closest in shape to an STL file"
+    )
+    parser.add_argument("stl_path")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument(
+        "--rebuild", action="store_true", help="rebuild the shape index first"
+    )
+    args = parser.parse_args()
+
+    if args.rebuild:
+        build_shape_index()
+
+    for part_id, distance in find_similar_parts(args.stl_path, args.k):
+        part = get_part(part_id)
+        name = part.name if part is not None else "?"
+        print(f"{distance:.3f}  {part_id}  {name}")
@@ -0,0 +1,31 @@
+import argparse
+
+from katalyst_core.dataset.steps_job import (
+    MAX_ATTEMPTS,
+    MAX_WORKERS,
+    STEPS_JOURNAL_PATH,
+    generate_all_steps,
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate the steps of the dataset parts that are new or were edited"
+    )
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--attempts", type=int, default=MAX_ATTEMPTS)
+    parser.add_argument("--journal", default=STEPS_JOURNAL_PATH)
+    parser.add_argument(
+        "--keep-duplicates",
+        action="store_true",
+        help="don't collapse near-identical steps",
+    )
+    args = parser.parse_args()
+
+    report = generate_all_steps(
+        args.workers, args.attempts, args.journal, not args.keep_duplicates
+    )
+    print(
+        f"{report['generated']} parts generated, {report['failed']} failed, "
+        f"{report['skipped']} up to date, {report['steps']} steps written ({report['duplicates']} near-duplicates collapsed)"
+    )
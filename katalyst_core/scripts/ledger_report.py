@@ -0,0 +1,53 @@
+import argparse
+import json
+
+import numpy as np
+
+from katalyst_core.algorithms.cad_generation.ledger import SessionLedger
+
+
+def read_ledgers(paths: list[str]) -> list[SessionLedger]:
+    """Ledgers of the agents serialized with `Agent.to_dict`, one or a list per file."""
+    ledgers = []
+    for path in paths:
+        with open(path, "r") as f:
+            data = json.load(f)
+        agents = data if isinstance(data, list) else [data]
+        ledgers += [SessionLedger.from_dict(agent.get("ledger", {})) for agent in agents]
+    return ledgers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Aggregate the token and cost ledgers of serialized agent sessions"
+    )
+    parser.add_argument("paths", nargs="+", help="JSON files of Agent.to_dict()")
+    args = parser.parse_args()
+
+    ledgers = read_ledgers(args.paths)
+    entries = [entry for ledger in ledgers for entry in ledger.entries]
+    if not entries:
+        print("No LLM calls recorded")
+        exit()
+
+    print(f"{'model':<36}{'calls':>7}{'tokens in':>11}{'tokens out':>11}{'cost':>9}{'latency':>10}")
+    for model in sorted({entry.model for entry in entries}):
+        model_entries = [entry for entry in entries if entry.model == model]
+        print(
+            f"{model:<36}{len(model_entries):>7}"
+            f"{sum(e.tokens_in for e in model_entries):>11}"
+            f"{sum(e.tokens_out for e in model_entries):>11}"
+            f"{sum(e.cost for e in model_entries):>8.2f}$"
+            f"{sum(e.latency for e in model_entries):>9.1f}s"
+        )
+
+    tokens = [ledger.tokens for ledger in ledgers]
+    costs = [ledger.cost for ledger in ledgers]
+    over_budget = sum(ledger.budget_exceeded() for ledger in ledgers)
+    print()
+    print(
+        f"{len(ledgers)} sessions, {over_budget} over budget, "
+        f"tokens p50 {np.percentile(tokens, 50):.0f} p90 {np.percentile(tokens, 90):.0f}, "
+        f"cost p50 {np.percentile(costs, 50):.3f}$ p90 {np.percentile(costs, 90):.3f}$ "
+        f"total {sum(costs):.2f}$"
+    )
@@ -0,0 +1,45 @@
+import argparse
+import os
+
+from katalyst_core.loadtest.fake_llm import FakeLLMConfig, start_fake_llm_server
+from katalyst_core.loadtest.load_generator import run_load_test
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive concurrent agent sessions and report per-stage latency"
+    )
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--precision", type=int, default=0)
+    parser.add_argument(
+        "--with-server",
+        action="store_true",
+        help="start a fake LLM server in-process and point the agent at it",
+    )
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--use-dataset", action="store_true")
+    args = parser.parse_args()
+
+    server = None
+    if args.with_server:
+        server, _ = start_fake_llm_server(
+            FakeLLMConfig(
+                latency_sec=args.latency,
+                latency_jitter_sec=args.jitter,
+                failure_rate=args.failure_rate,
+                use_dataset=args.use_dataset,
+            ),
+            port=args.port,
+        )
+        os.environ["LLM_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+        os.environ.setdefault("OPENROUTER_API_KEY", "fake")
+
+    report = run_load_test(args.sessions, args.concurrency, precision=args.precision)
+    print(report.format())
+
+    if server is not None:
+        server.shutdown()
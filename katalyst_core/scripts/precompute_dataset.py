@@ -0,0 +1,41 @@
+import argparse
+import json
+
+from katalyst_core.dataset.precompute import (
+    MAX_WORKERS,
+    precompute_parts,
+    precompute_report,
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Execute the dataset parts and report the broken and slow ones"
+    )
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument(
+        "--force", action="store_true", help="execute again the up to date parts"
+    )
+    parser.add_argument(
+        "--report-only", action="store_true", help="only print the last report"
+    )
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    if args.report_only:
+        report = precompute_report()
+    else:
+        report = precompute_parts(args.workers, args.force)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        exit()
+
+    print(
+        f"{report['executed']} parts executed, {len(report['broken'])} broken, "
+        f"{len(report['slow'])} slow"
+    )
+    for entry in report["broken"]:
+        print(f"  broken {entry['part_id']}: {entry['error']}")
+    for entry in report["slow"]:
+        print(f"  slow {entry['part_id']}: {entry['duration']}s")
@@ -0,0 +1,87 @@
+import argparse
+
+import numpy as np
+
+from katalyst_core.algorithms.cad_generation.vector_index import (
+    VectorIndex,
+    benchmark,
+    storage_benchmark,
+)
+
+
+def synthetic_vectors(count: int, dim: int, random: np.random.Generator) -> np.ndarray:
+    # clustered like sentence embeddings of a dataset with many variants of each design
+    centers = random.normal(size=(max(1, count // 50), dim))
+    return centers[random.integers(0, len(centers), count)] + random.normal(
+        scale=1.5, size=(count, dim)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recall and latency of the approximate label index against exact search"
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=0,
+        help="benchmark on that many random vectors instead of the dataset steps",
+    )
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument(
+        "--storage",
+        action="store_true",
+        help="compare the memory and recall of float32, float16 and int8 vectors instead",
+    )
+    args = parser.parse_args()
+
+    random = np.random.default_rng(0)
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic + args.queries, 384, random)
+    else:
+        # imported here, loading the embedding model is slow
+        from katalyst_core.algorithms.cad_generation.examples_ragging import (
+            _get_or_compute_embeddings,
+        )
+        from katalyst_core.dataset.manage_parts import read_steps_dataset
+
+        labels = [
+            step.request + " including ".join(step.edits.split("```")[::2])
+            for step in read_steps_dataset()
+        ]
+        vectors = np.array(_get_or_compute_embeddings(labels))
+        random.shuffle(vectors)
+
+    queries, vectors = vectors[: args.queries], vectors[args.queries :]
+    if args.storage:
+        print(
+            f"{len(vectors)} vectors, recall@{args.k} against exact float32 search "
+            f"over {len(queries)} queries"
+        )
+        print(f"{'storage':>18} {'memory':>10} {'recall':>8} {'latency':>10}")
+        for row in storage_benchmark(vectors, queries, args.k):
+            print(
+                f"{row['storage']:>18} {row['memory_mb']:>8.1f}MB "
+                f"{row['recall']:>8.1%} {row['latency_ms']:>8.2f}ms"
+            )
+        print(
+            "re-ranked storages count the float32 vectors, which retrieval "
+            "memory maps from the embeddings store, shared by all processes"
+        )
+        exit()
+
+    # always build the IVF index, whatever the size, to measure it
+    index = VectorIndex(ivf_min_size=1)
+    index.add(list(range(len(vectors))), vectors)
+    if index.centroids is None:
+        print(f"Not enough vectors to benchmark: {len(vectors)}")
+        exit()
+    print(
+        f"{len(vectors)} vectors, {len(index.centroids)} clusters, "
+        f"recall@{args.k} over {len(queries)} queries"
+    )
+
+    print(f"{'nprobe':>8} {'recall':>8} {'latency':>10}")
+    for row in benchmark(index, queries, args.k):
+        print(f"{row['nprobe']:>8} {row['recall']:>8.1%} {row['latency_ms']:>8.2f}ms")
@@ -0,0 +1,90 @@
+import argparse
+import json
+import random
+import time
+
+from katalyst_core.algorithms.cad_generation.examples_ragging import rank_steps
+from katalyst_core.dataset.manage_parts import (
+    read_steps_dataset,
+    step_representatives,
+)
+
+BACKENDS = ["cadquery:noassembly", "cadquery:assembly"]
+MODES = ["semantic", "lexical", "hybrid"]
+
+
+def held_out_from_steps(count: int) -> list[dict]:
+    """
+    Requests of random steps as prompts. A hit is another step of the same
+    part. The step and its near-duplicates are held out: left out of the
+    results as if they weren't indexed, they would be trivial hits.
+    """
+    steps = list(read_steps_dataset(only_backends=BACKENDS))
+    representatives = step_representatives()
+    groups: dict[int, list[int]] = {}
+    for step in steps:
+        groups.setdefault(representatives.get(step.id, step.id), []).append(step.id)
+
+    random.Random(0).shuffle(steps)
+    return [
+        {
+            "prompt": step.request,
+            "part_ids": [step.parent_id],
+            "exclude": groups[representatives.get(step.id, step.id)],
+        }
+        for step in steps[:count]
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Hit rate and latency of semantic, lexical and hybrid step retrieval"
+    )
+    parser.add_argument(
+        "--prompts",
+        help='JSON lines of {"prompt": ..., "part_ids": [...], "exclude": [...]}, the parts '
+        "whose steps are hits and optionally the ids of steps to hold out",
+    )
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.prompts:
+        with open(args.prompts) as f:
+            cases = [json.loads(line) for line in f if line.strip()]
+    else:
+        cases = held_out_from_steps(args.count)
+    if not cases:
+        parser.error("no prompts to evaluate")
+
+    # build the indexes before timing
+    rank_steps("warmup", BACKENDS)
+
+    print(f"{len(cases)} prompts, hit@{args.k}")
+    print(f"{'mode':<10} {'hit rate':>8} {'MRR':>6} {'latency':>10}")
+    for mode in MODES:
+        hits = 0
+        reciprocal_ranks = 0.0
+        start = time.perf_counter()
+        for case in cases:
+            exclude = set(case.get("exclude", []))
+            ranking = [
+                step
+                for step, _ in rank_steps(
+                    case["prompt"], BACKENDS, mode, args.k + len(exclude)
+                )
+                if step.id not in exclude
+            ][: args.k]
+            ranks = [
+                rank
+                for rank, step in enumerate(ranking, 1)
+                if step.parent_id in case["part_ids"]
+            ]
+            if ranks:
+                hits += 1
+                reciprocal_ranks += 1 / ranks[0]
+        latency = (time.perf_counter() - start) / len(cases)
+        print(
+            f"{mode:<10} {hits / len(cases):>8.1%} {reciprocal_ranks / len(cases):>6.3f} "
+            f"{latency * 1e3:>8.2f}ms"
+        )
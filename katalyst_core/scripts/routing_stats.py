@@ -0,0 +1,15 @@
+from katalyst_core.algorithms.cad_generation.routing import read_routing_stats
+
+
+if __name__ == "__main__":
+    stats = read_routing_stats()
+    if not stats.routes:
+        print("No routing statistics recorded yet")
+        exit()
+
+    print(f"{'route':<12} {'attempts':>8} {'success':>8} {'mean time':>10}")
+    for name, route_stats in sorted(stats.routes.items()):
+        print(
+            f"{name:<12} {route_stats.attempts:>8} "
+            f"{route_stats.success_rate:>8.0%} {route_stats.mean_duration:>9.1f}s"
+        )
@@ -0,0 +1,54 @@
+import argparse
+import json
+
+import numpy as np
+
+
+def read_spans(path: str) -> list[dict]:
+    with open(path, "r") as f:
+        content = f.read().strip()
+
+    if content.startswith("["):
+        # Chrome trace, possibly without its optional closing bracket
+        content = content.rstrip(",\n]") + "]"
+        return [
+            {
+                "name": event["name"],
+                "duration": event["dur"] / 1e6,
+                **event.get("args", {}),
+            }
+            for event in json.loads(content)
+            if event.get("ph") == "X"
+        ]
+
+    return [json.loads(line) for line in content.split("\n") if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per-stage latency percentiles of a trace written with TRACE_PATH"
+    )
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    spans = read_spans(args.path)
+    stages: dict[str, list[dict]] = {}
+    for span in spans:
+        stages.setdefault(span["name"], []).append(span)
+
+    print(
+        f"{'stage':<22}{'count':>7}{'fail':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'total':>10}{'tok in':>9}{'tok out':>9}"
+    )
+    for name, stage_spans in sorted(
+        stages.items(), key=lambda item: -sum(s["duration"] for s in item[1])
+    ):
+        durations = [s["duration"] for s in stage_spans]
+        failures = sum(s.get("outcome", "ok") != "ok" for s in stage_spans)
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+        tokens_in = sum(s.get("tokens_in") or 0 for s in stage_spans)
+        tokens_out = sum(s.get("tokens_out") or 0 for s in stage_spans)
+        print(
+            f"{name:<22}{len(durations):>7}{failures:>6}"
+            f"{p50:>8.2f}s{p90:>8.2f}s{p99:>8.2f}s{max(durations):>8.2f}s{sum(durations):>9.1f}s"
+            f"{tokens_in:>9}{tokens_out:>9}"
+        )
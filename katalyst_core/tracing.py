@@ -0,0 +1,195 @@
+"""
+Lightweight spans timing the stages of the generation pipeline.
+
+Spans are only recorded when the TRACE_PATH environment variable is set. They
+are appended to that file as JSON lines, or as Chrome trace events (viewable in
+chrome://tracing or Perfetto) if it ends with `.json`. Summarize a trace with
+`python katalyst_core/scripts/trace_summary.py <path>`. In process, `listen`
+gets every finished span, whether or not TRACE_PATH is set.
+"""
+
+import contextlib
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Optional
+
+from loguru import logger
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    start: float
+    duration: float = 0.0
+    outcome: str = "ok"
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "outcome": self.outcome,
+            "thread": threading.get_ident(),
+            **self.attributes,
+        }
+
+    def to_chrome_event(self) -> dict:
+        return {
+            "name": self.name,
+            "ph": "X",
+            "ts": int(self.start * 1e6),
+            "dur": int(self.duration * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "outcome": self.outcome,
+                **self.attributes,
+            },
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+_span_ids = itertools.count(1)
+_write_lock = threading.Lock()
+_listeners: tuple[Callable[[Span], None], ...] = ()
+_listeners_lock = threading.Lock()
+
+
+def trace_path() -> Optional[str]:
+    return os.getenv("TRACE_PATH") or None
+
+
+def _export(span: Span, path: str):
+    chrome = path.endswith(".json")
+    with _write_lock:
+        try:
+            with open(path, "a") as f:
+                if chrome:
+                    # the closing bracket is optional in the Chrome trace format,
+                    # which lets us keep appending to the file
+                    if f.tell() == 0:
+                        f.write("[\n")
+                    f.write(json.dumps(span.to_chrome_event(), default=str) + ",\n")
+                else:
+                    f.write(json.dumps(span.to_dict(), default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"Couldn't write span to {path}: {e}")
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Time the enclosed block. Exceptions mark the span as an "error", callers can
+    set `outcome` to "failure" for failures reported through return values.
+    """
+    parent = _current_span.get()
+    current = Span(
+        name,
+        next(_span_ids),
+        parent.span_id if parent is not None else None,
+        time.time(),
+        attributes=attributes,
+    )
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.outcome = "error"
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        path = trace_path()
+        if path is not None:
+            _export(current, path)
+        for listener in _listeners:
+            listener(current)
+
+
+@contextlib.contextmanager
+def listen(listener: Callable[[Span], None]) -> Iterator[None]:
+    """Call `listener` with every span finishing in the block, from any thread."""
+    global _listeners
+    with _listeners_lock:
+        _listeners = _listeners + (listener,)
+    try:
+        yield
+    finally:
+        with _listeners_lock:
+            _listeners = tuple(other for other in _listeners if other is not listener)
+
+
+def traced(
+    name: Optional[str] = None, failed: Optional[Callable[[Any], bool]] = None
+) -> Callable:
+    """
+    Decorator version of `span`, named after the function by default. `failed`
+    tells from the return value whether the call failed.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name or fn.__name__) as current:
+                result = fn(*args, **kwargs)
+                if failed is not None and failed(result):
+                    current.outcome = "failure"
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def in_context(fn: Callable) -> Callable:
+    """Bind `fn` to the current span, so that work submitted to a thread pool nests under it."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # a context can't be entered by two threads at once, run in a copy
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def trace_client(client):
+    """Record a span with the model and token usage for every chat completion of `client`."""
+    create = client.chat.completions.create
+
+    @functools.wraps(create)
+    def traced_create(*args, **kwargs):
+        with span("llm", model=kwargs.get("model")) as llm_span:
+            response = create(*args, **kwargs)
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                llm_span.set(
+                    tokens_in=usage.prompt_tokens, tokens_out=usage.completion_tokens
+                )
+            return response
+
+    client.chat.completions.create = traced_create
+    return client
@@ -0,0 +1,39 @@
+from katalyst_core.programs.executor import fix_and_replace_filename
+from katalyst_core.programs.validation import has_fatal_diagnostic, validate_script
+
+BOX = "result = cq.Workplane().box(10, 10, 10)\n"
+
+
+def test_export_stl_is_accepted():
+    script = BOX + 'filename = "render.stl"\nresult.val().exportStl(filename)\n'
+    assert not has_fatal_diagnostic(validate_script(script))
+
+
+def test_exporters_export_is_accepted():
+    script = BOX + 'filename = "render.stl"\ncq.exporters.export(result, filename)\n'
+    assert not has_fatal_diagnostic(validate_script(script))
+
+    script = (
+        "from cadquery import exporters\n"
+        + BOX
+        + 'exporters.export(result, "render.stl")\n'
+    )
+    assert not has_fatal_diagnostic(validate_script(script))
+
+
+def test_missing_export_is_only_a_warning():
+    diagnostics = validate_script(BOX)
+    assert diagnostics
+    assert not has_fatal_diagnostic(diagnostics)
+
+
+def test_nested_export_is_fatal():
+    script = BOX + 'def save():\n    result.val().exportStl("render.stl")\nsave()\n'
+    assert has_fatal_diagnostic(validate_script(script))
+
+
+def test_exporters_export_filename_is_replaced():
+    script = BOX + 'cq.exporters.export(result, "part.stl")'
+    replaced = fix_and_replace_filename(script, "out/render.stl")
+    assert 'filename = "out/render.stl"' in replaced
+    assert "cq.exporters.export(result, filename)" in replaced
@@ -0,0 +1,50 @@
+import numpy as np
+
+from katalyst_core.algorithms.cad_generation.vector_index import VectorIndex
+
+
+def _vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, 16)).astype(np.float32)
+
+
+def test_readding_the_same_keys_stays_bounded():
+    index = VectorIndex(storage="int8")
+    keys = list(range(20))
+    for round in range(200):
+        index.add(keys, _vectors(len(keys), round))
+
+    assert len(index) == len(keys)
+    assert index.size <= 2 * len(keys)
+    assert len(index.keys) <= 2 * len(keys)
+    assert len(index.vectors) <= 4 * len(keys)
+
+
+def test_search_after_compaction_finds_the_latest_vectors():
+    vectors = _vectors(20, 1)
+    index = VectorIndex()
+    for round in range(10):
+        index.add(list(range(20)), _vectors(20, 100 + round))
+    index.add(list(range(20)), vectors)
+    for key in range(5):
+        index.remove(key)
+
+    for key in range(5, 20):
+        found, similarity = index.search(vectors[key], 1)[0]
+        assert found == key
+        assert similarity > 0.99
+    assert all(key not in index for key in range(5))
+
+
+def test_compaction_keeps_the_clusters_searchable():
+    vectors = _vectors(200, 2)
+    index = VectorIndex(ivf_min_size=100, nprobe=1000)
+    index.add(list(range(200)), vectors)
+    assert index.centroids is not None
+    for round in range(5):
+        index.add(list(range(100)), vectors[:100])
+    for key in range(150, 200):
+        index.remove(key)
+
+    assert index.size <= 2 * len(index)
+    for key in (0, 99, 100, 149):
+        assert index.search(vectors[key], 1)[0][0] == key